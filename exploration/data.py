@@ -1,33 +1,1069 @@
 import pandas as pd
+import numpy as np
 import json
+import hashlib
+import os
+import sqlite3
+import re
+import ast
+from math import isnan, inf
+from bisect import bisect_left, bisect_right, insort
+from multiprocessing import shared_memory, resource_tracker
 from tabulate import tabulate
 from copy import deepcopy
 
 
+class LevelIndex:
+    '''Open trades of one side sorted by one of their price levels (TP, SL, TSL, ...)
+    (level, trade_no) pairs in a sorted list, so the trades whose level a price has crossed are found
+    by binary search and a bar only touches those. A level of 0 marks an unset TSL and is not indexed.
+    '''
+
+    def __init__(self):
+        self.keys = []
+        self.level_of = dict()
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def add(self, trade_no: int, level: float):
+        '''Index trade_no at level, replacing its previous level
+        '''
+        self.discard(trade_no)
+        if level != 0:
+            insort(self.keys, (level, trade_no))
+            self.level_of[trade_no] = level
+
+    def discard(self, trade_no: int):
+        level = self.level_of.pop(trade_no, None)
+        if level is not None:
+            del self.keys[bisect_left(self.keys, (level, trade_no))]
+
+    def at_or_below(self, price: float) -> list:
+        '''trade_nos with level <= price in trade_no order
+        '''
+        return sorted(trade_no for _, trade_no in self.keys[:bisect_right(self.keys, (price, inf))])
+
+    def at_or_above(self, price: float) -> list:
+        '''trade_nos with level >= price in trade_no order
+        '''
+        return sorted(trade_no for _, trade_no in self.keys[bisect_left(self.keys, (price, -inf)):])
+
+    def top(self) -> tuple:
+        '''(level, trade_no) of the highest level, earliest trade_no on a tie, None when empty
+        '''
+        return self.keys[bisect_left(self.keys, (self.keys[-1][0], -inf))] if self.keys else None
+
+    def bottom(self) -> tuple:
+        '''(level, trade_no) of the lowest level, earliest trade_no on a tie, None when empty
+        '''
+        return self.keys[0] if self.keys else None
+
+    def between(self, low: float, high: float) -> set:
+        '''Distinct levels in [low, high]
+        '''
+        return {level for level, _ in self.keys[bisect_left(self.keys, (low, -inf)):bisect_right(self.keys, (high, inf))]}
+
+    def lowest(self, default: float=inf) -> float:
+        return self.keys[0][0] if self.keys else default
+
+    def highest(self, default: float=-inf) -> float:
+        return self.keys[-1][0] if self.keys else default
+
+
+def to_points(price: float, scale: int):
+    '''price as a whole number of 1 / scale points, None when it is not one (or not finite)
+    '''
+    scaled = price * scale
+    if not -inf < scaled < inf:
+        return None
+    points = round(scaled)
+    return points if abs(scaled - points) < 1e-6 else None
+
+
+def round_points(points: int, scale: int):
+    '''points / scale rounded to 2 decimals, the same value round(pnl, 2) gives for the float sum
+    None on a tie at half a cent, where the float error of the summation order decides the rounding
+    '''
+    unit = scale // 100
+    if points % unit * 2 == unit:
+        return None
+    return ((points + unit // 2) // unit) / 100
+
+
+def round_level(points: int, scale: int):
+    '''points / scale rounded to 5 decimals, the same value round(level, 5) gives for the float level
+    None on a tie, where the float error of the level decides the rounding
+    '''
+    unit = max(scale // 10 ** 5, 1)
+    if unit > 1 and points % unit * 2 == unit:
+        return None
+    return (points + unit // 2) // unit * unit / scale
+
+
+def to_points_array(prices: np.ndarray, scale: int) -> tuple:
+    '''to_points() of an array of prices, (points, on_grid) with points 0 where the price is not on the grid
+    '''
+    scaled = prices * scale
+    points = np.rint(scaled)
+    on_grid = np.abs(scaled - points) < 1e-6
+    return np.where(on_grid, points, 0).astype(np.int64), on_grid
+
+
+def round_points_array(points: np.ndarray, scale: int) -> tuple:
+    '''round_points() of an int64 array, (values, ties) with NaN values at the ties
+    '''
+    unit = scale // 100
+    ties = points % unit * 2 == unit
+    values = ((points + unit // 2) // unit) / 100
+    values[ties] = np.nan
+    return values, ties
+
+
+class PositionTotals:
+    '''Running size and size x entry of the open trades of one side, updated on open and close
+    Entries are counted in integer points of 1 / scale so the totals stay exact over any number of trades.
+    exact turns False while an entry off the points grid is open.
+    '''
+
+    def __init__(self, scale: int):
+        self.scale = scale
+        self.size, self.cost, self.off_grid = 0, 0, 0
+
+    @property
+    def exact(self) -> bool:
+        return self.off_grid == 0
+
+    def add(self, size: int, entry: float, sign: int=1):
+        points = to_points(entry, self.scale)
+        self.size = self.size + sign * size
+        if points is None:
+            self.off_grid = self.off_grid + sign
+        else:
+            self.cost = self.cost + sign * size * points
+
+    def remove(self, size: int, entry: float):
+        self.add(size, entry, sign=-1)
+
+    def value(self, points: int) -> int:
+        '''size x (price - entry) summed over the trades, in points
+        '''
+        return self.size * points - self.cost
+
+
+class TradeBook:
+    '''Open trades of one side held as a struct of arrays
+    One typed array per field (SIZE, ENTRY, TP, SL, TSL, ...) indexed by slot, an active mask and a
+    free-slot list. Closed slots are reused, so a long run allocates no per-bar dicts or tuples.
+    Iteration order is trade_no order, same as the insertion order of the old dict of tuples.
+    Fields in levels are kept in a LevelIndex each, see self.levels. With a price scale, SIZE and ENTRY
+    are summed in a PositionTotals, see self.totals.
+    '''
+
+    FIELDS = ('SIZE', 'ENTRY', 'TP', 'SL', 'TSL')
+    INT_FIELDS = ('SIZE', 'COVERED')
+
+    def __init__(self, fields: tuple=FIELDS, capacity: int=64, levels: tuple=(), scale: int=None):
+        self.fields = fields
+        self.levels = {f: LevelIndex() for f in levels}
+        self.totals = PositionTotals(scale) if scale is not None else None
+        self.cols = {f: np.zeros(capacity, dtype=np.int64 if f in self.INT_FIELDS else np.float64) for f in fields}
+        self.trade_no = np.zeros(capacity, dtype=np.int64)
+        self.active = np.zeros(capacity, dtype=bool)
+        self.free = list(range(capacity - 1, -1, -1))
+        self.slot_of = dict()
+        self.order = None
+
+    def __len__(self) -> int:
+        return len(self.slot_of)
+
+    def __contains__(self, trade_no: int) -> bool:
+        return trade_no in self.slot_of
+
+    def __getitem__(self, field: str) -> np.ndarray:
+        return self.cols[field]
+
+    def __repr__(self) -> str:
+        return str(self.to_dict())
+
+    def grow(self):
+        capacity = len(self.active)
+        for f, col in self.cols.items():
+            self.cols[f] = np.concatenate((col, np.zeros(capacity, dtype=col.dtype)))
+        self.trade_no = np.concatenate((self.trade_no, np.zeros(capacity, dtype=np.int64)))
+        self.active = np.concatenate((self.active, np.zeros(capacity, dtype=bool)))
+        self.free = list(range(2 * capacity - 1, capacity - 1, -1)) + self.free
+
+    def open(self, trade_no: int, values: tuple) -> int:
+        '''values in the order of self.fields, same as the old tuple
+        '''
+        if not self.free:
+            self.grow()
+        slot = self.free.pop()
+        for f, v in zip(self.fields, values):
+            self.cols[f][slot] = v
+        self.trade_no[slot] = trade_no
+        self.active[slot] = True
+        self.slot_of[trade_no] = slot
+        self.order = None
+        for f, index in self.levels.items():
+            index.add(trade_no, self.cols[f][slot].item())
+        if self.totals is not None:
+            self.totals.add(self.cols['SIZE'][slot].item(), self.cols['ENTRY'][slot].item())
+        return slot
+
+    def close(self, trade_no: int) -> tuple:
+        '''Release the slot of trade_no and return its values as the old tuple
+        '''
+        slot = self.slot_of.pop(trade_no)
+        values = self.record(slot)
+        self.active[slot] = False
+        self.free.append(slot)
+        self.order = None
+        for index in self.levels.values():
+            index.discard(trade_no)
+        if self.totals is not None:
+            self.totals.remove(self.cols['SIZE'][slot].item(), self.cols['ENTRY'][slot].item())
+        return values
+
+    def update(self, trade_no: int, field: str, value):
+        slot = self.slot_of[trade_no]
+        totals = self.totals is not None and field in ('SIZE', 'ENTRY')
+        if totals:
+            self.totals.remove(self.cols['SIZE'][slot].item(), self.cols['ENTRY'][slot].item())
+        self.cols[field][slot] = value
+        if totals:
+            self.totals.add(self.cols['SIZE'][slot].item(), self.cols['ENTRY'][slot].item())
+        if field in self.levels:
+            self.levels[field].add(trade_no, self.cols[field][slot].item())
+
+    def get(self, trade_no: int, field: str):
+        return self.cols[field][self.slot_of[trade_no]].item()
+
+    def oldest(self) -> int:
+        '''trade_no of the oldest open trade, None when empty
+        Trades are opened in trade_no order and slot_of keeps that order
+        '''
+        return next(iter(self.slot_of), None)
+
+    def record(self, slot: int) -> tuple:
+        return tuple(self.cols[f][slot].item() for f in self.fields)
+
+    def slots(self) -> np.ndarray:
+        '''Active slots sorted by trade_no
+        '''
+        if self.order is None:
+            slots = np.flatnonzero(self.active)
+            self.order = slots[np.argsort(self.trade_no[slots], kind='stable')]
+        return self.order
+
+    def values(self, field: str) -> np.ndarray:
+        '''Field of the active trades in trade_no order
+        '''
+        return self.cols[field][self.slots()]
+
+    def trade_nos(self, mask: np.ndarray=None) -> list:
+        '''Active trade_nos in trade_no order, optionally filtered by a mask aligned with self.values()
+        '''
+        trade_nos = self.trade_no[self.slots()]
+        return (trade_nos if mask is None else trade_nos[mask]).tolist()
+
+    def to_dict(self, keys: tuple=None) -> dict:
+        '''Rebuild the old view
+        {trade_no: (SIZE, ENTRY, ...)} or, with keys, {trade_no: {key: value}}
+        '''
+        slots = self.slots()
+        columns = [self.cols[f][slots].tolist() for f in self.fields]
+        records = zip(*columns) if columns else [tuple() for _ in slots]
+        if keys is None:
+            return dict(zip(self.trade_no[slots].tolist(), records))
+        return {trade_no: dict(zip(keys, values)) for trade_no, values in zip(self.trade_no[slots].tolist(), records)}
+
+    def state(self) -> dict:
+        '''Arrays needed to restore the book exactly, slot layout and free list included
+        '''
+        state = {f'col.{f}': col for f, col in self.cols.items()}
+        state.update(trade_no=self.trade_no, active=self.active, free=np.array(self.free, dtype=np.int64))
+        return state
+
+    def load_state(self, state: dict):
+        self.cols = {f: np.array(state[f'col.{f}']) for f in self.fields}
+        self.trade_no = np.array(state['trade_no'])
+        self.active = np.array(state['active'])
+        self.free = state['free'].tolist()
+        self.order = None
+        self.slot_of = dict(zip(self.trade_no[self.slots()].tolist(), self.slots().tolist()))
+        self.levels = {f: LevelIndex() for f in self.levels}
+        self.totals = PositionTotals(self.totals.scale) if self.totals is not None else None
+        for trade_no, slot in self.slot_of.items():
+            for f, index in self.levels.items():
+                index.add(trade_no, self.cols[f][slot].item())
+            if self.totals is not None:
+                self.totals.add(self.cols['SIZE'][slot].item(), self.cols['ENTRY'][slot].item())
+
+
+class TradeLedger:
+    '''Append-only ledger of trade book changes, one record per open / close / adjust / split tagged with its bar
+    bar, kind, side, trade_no and parent are typed arrays, values holds the record in the order of
+    fields (open, adjust, split) or closed_fields (close). Records are appended in bar order,
+    so state at any bar is rebuilt from a prefix found by binary search.
+    A split is written as an adjust of the parent with its remaining values and a split record for
+    the new trade carrying the split off values and the parent trade_no.
+    '''
+
+    OPEN, CLOSE, ADJUST, SPLIT = 0, 1, 2, 3
+    LONG, SHORT = 1, -1
+
+    def __init__(self, fields: tuple=TradeBook.FIELDS, closed_fields: tuple=None, capacity: int=1024):
+        self.fields = fields
+        self.closed_fields = fields if closed_fields is None else closed_fields
+        self.ints = [f in TradeBook.INT_FIELDS for f in self.fields]
+        self.closed_ints = [f in TradeBook.INT_FIELDS for f in self.closed_fields]
+        self.n = 0
+        self.bar = np.zeros(capacity, dtype=np.int64)
+        self.kind = np.zeros(capacity, dtype=np.int8)
+        self.side = np.zeros(capacity, dtype=np.int8)
+        self.trade_no = np.zeros(capacity, dtype=np.int64)
+        self.parent = np.zeros(capacity, dtype=np.int64)
+        self.values = np.zeros((capacity, max(len(self.fields), len(self.closed_fields))), dtype=np.float64)
+
+    def __len__(self) -> int:
+        return self.n
+
+    def grow(self):
+        for attr in ('bar', 'kind', 'side', 'trade_no', 'parent', 'values'):
+            col = getattr(self, attr)
+            setattr(self, attr, np.concatenate((col, np.zeros_like(col))))
+
+    def append(self, bar: int, kind: int, side: int, trade_no: int, values: tuple, parent: int=-1):
+        assert self.n == 0 or bar >= self.bar[self.n-1], f'bar={bar} before last record'
+        if self.n == len(self.bar):
+            self.grow()
+        k = self.n
+        self.bar[k], self.kind[k], self.side[k], self.trade_no[k], self.parent[k] = bar, kind, side, trade_no, parent
+        self.values[k, :len(values)] = values
+        self.n = k + 1
+
+    def open(self, bar: int, side: int, trade_no: int, values: tuple):
+        self.append(bar, self.OPEN, side, trade_no, values)
+
+    def close(self, bar: int, side: int, trade_no: int, values: tuple):
+        '''values in the order of closed_fields
+        '''
+        self.append(bar, self.CLOSE, side, trade_no, values)
+
+    def adjust(self, bar: int, side: int, trade_no: int, values: tuple):
+        '''values are all fields of the trade after the adjustment
+        '''
+        self.append(bar, self.ADJUST, side, trade_no, values)
+
+    def split(self, bar: int, side: int, trade_no: int, values: tuple, new_trade_no: int, new_values: tuple):
+        self.append(bar, self.ADJUST, side, trade_no, values)
+        self.append(bar, self.SPLIT, side, new_trade_no, new_values, parent=trade_no)
+
+    def record(self, k: int) -> tuple:
+        '''Record k as the old tuple, int fields back as int
+        '''
+        fields, ints = (self.closed_fields, self.closed_ints) if self.kind[k] == self.CLOSE else (self.fields, self.ints)
+        return tuple(int(v) if is_int else v for v, is_int in zip(self.values[k, :len(fields)].tolist(), ints))
+
+    def end_of(self, bar: int) -> int:
+        '''Number of records up to and including bar
+        '''
+        return int(np.searchsorted(self.bar[:self.n], bar, side='right'))
+
+    def state_at(self, bar: int) -> dict:
+        '''Open trades at the end of bar, {side: {trade_no: (values)}} in trade_no order
+        Vectorized: the last record of every trade in the prefix, dropped when it is a close
+        '''
+        n = self.end_of(bar)
+        state = {self.LONG: dict(), self.SHORT: dict()}
+        if n == 0:
+            return state
+        key = self.trade_no[:n] * 2 + (self.side[:n] == self.LONG)
+        _, first = np.unique(key[::-1], return_index=True)
+        last = n - 1 - first
+        last = last[self.kind[last] != self.CLOSE]
+        last = last[np.argsort(self.trade_no[last], kind='stable')]
+        for k in last.tolist():
+            state[int(self.side[k])][int(self.trade_no[k])] = self.record(k)
+        return state
+
+    def replay(self, bars):
+        '''Walk the ledger once over ascending bars
+        Yields (open, closed) per bar, each {side: {trade_no: (values)}}: open trades at the end of the bar and trades closed on it
+        '''
+        state = {self.LONG: dict(), self.SHORT: dict()}
+        k = 0
+        for bar in bars:
+            closed = {self.LONG: dict(), self.SHORT: dict()}
+            end = self.end_of(bar)
+            while k < end:
+                side, trade_no = int(self.side[k]), int(self.trade_no[k])
+                if self.kind[k] == self.CLOSE:
+                    state[side].pop(trade_no, None)
+                    if self.bar[k] == bar:
+                        closed[side][trade_no] = self.record(k)
+                else:
+                    state[side][trade_no] = self.record(k)
+                k = k + 1
+            yield {side: dict(trades) for side, trades in state.items()}, closed
+
+    def state(self) -> dict:
+        return {attr: getattr(self, attr)[:self.n] for attr in ('bar', 'kind', 'side', 'trade_no', 'parent', 'values')}
+
+    def load_state(self, state: dict):
+        self.n = len(state['bar'])
+        capacity = max(len(self.bar), self.n)
+        for attr in ('bar', 'kind', 'side', 'trade_no', 'parent', 'values'):
+            col = np.zeros((capacity,) + state[attr].shape[1:], dtype=state[attr].dtype)
+            col[:self.n] = state[attr]
+            setattr(self, attr, col)
+
+    def clear(self):
+        '''Drop all records and keep the buffers, e.g. once a streamed chunk is done with them
+        '''
+        self.n = 0
+
+
+
+class CandleStore:
+    '''Columnar candle store, one .npy file per column and a manifest, read back memory-mapped
+    {path}/manifest.json
+    {path}/{column}.npy
+    Only the pages of the columns actually read are loaded and concurrent processes share them through the OS page cache.
+    time is stored as naive UTC datetime64[ns].
+    '''
+
+    MANIFEST = 'manifest.json'
+
+    @classmethod
+    def path(cls, data_path: str, ticker: str, frequency: str) -> str:
+        return f"{data_path}{ticker}_{frequency}"
+
+    @classmethod
+    def exists(cls, path: str) -> bool:
+        return os.path.isfile(os.path.join(path, cls.MANIFEST))
+
+    @classmethod
+    def manifest(cls, path: str) -> dict:
+        with open(os.path.join(path, cls.MANIFEST), 'r') as f:
+            return json.load(f)
+
+    @classmethod
+    def write(cls, df: pd.DataFrame, path: str):
+        os.makedirs(path, exist_ok=True)
+        columns = dict()
+        for col in df.columns:
+            values, tz = df[col], None
+            if isinstance(values.dtype, pd.DatetimeTZDtype):
+                tz = str(values.dt.tz)
+                values = values.dt.tz_convert(None)
+            values = values.to_numpy(dtype='datetime64[ns]') if pd.api.types.is_datetime64_any_dtype(values) else values.to_numpy()
+            np.save(os.path.join(path, f'{col}.npy'), values, allow_pickle=False)
+            columns[col] = dict(dtype=str(values.dtype), tz=tz)
+        with open(os.path.join(path, cls.MANIFEST), 'w') as f:
+            json.dump(dict(rows=df.shape[0], columns=columns), f, indent=2)
+
+    @classmethod
+    def from_pickle(cls, data_path: str, ticker: str, frequency: str):
+        '''Convert {ticker}_{frequency}.pkl into a store next to it
+        '''
+        cls.write(pd.read_pickle(f"{data_path}{ticker}_{frequency}.pkl"), cls.path(data_path, ticker, frequency))
+
+    @classmethod
+    def read(cls, path: str, cols: list=None) -> pd.DataFrame:
+        '''DataFrame over read-only memory maps of the requested columns, no copy
+        '''
+        manifest = cls.manifest(path)
+        cols = list(manifest['columns'].keys()) if cols is None else cols
+        missing = [col for col in cols if col not in manifest['columns']]
+        assert len(missing) == 0, f'{missing} not in {path}'
+        return pd.DataFrame({col: np.load(os.path.join(path, f'{col}.npy'), mmap_mode='r') for col in cols}, copy=False)
+
+
+def to_epoch(time):
+    '''int64 nanoseconds of a time column or a single time (datetime, Timestamp, str)
+    tz-aware times keep their wall time and drop the tz. Integer columns are taken as epoch nanoseconds already.
+    '''
+    if not isinstance(time, (pd.Series, pd.Index, np.ndarray, list)):
+        time = pd.Timestamp(time)
+        return (time.tz_localize(None) if time.tz is not None else time).value
+    time = pd.Series(time, copy=False)
+    if pd.api.types.is_integer_dtype(time):
+        return time.to_numpy(dtype=np.int64)
+    if not pd.api.types.is_datetime64_any_dtype(time):
+        time = pd.to_datetime(time)
+    if isinstance(time.dtype, pd.DatetimeTZDtype):
+        time = time.dt.tz_localize(None)
+    return time.to_numpy(dtype='datetime64[ns]').view(np.int64)
+
+
+def to_datetime(time):
+    '''datetime64 column (or Timestamp) from int64 epoch nanoseconds
+    '''
+    if np.ndim(time) == 0:
+        return pd.Timestamp(int(time))
+    return pd.to_datetime(np.asarray(time, dtype=np.int64), unit='ns')
+
+
+def time_window(df: pd.DataFrame, start=None, end=None) -> pd.DataFrame:
+    '''Rows [start, end) of a candle dataframe
+    start / end are row indices (int) as in iloc, or times (datetime, Timestamp, str) found by binary search on df.time
+    '''
+    if start is not None and not isinstance(start, (int, np.integer)):
+        start = int(np.searchsorted(to_epoch(df['time']), to_epoch(start), side='left'))
+    if end is not None and not isinstance(end, (int, np.integer)):
+        end = int(np.searchsorted(to_epoch(df['time']), to_epoch(end), side='left'))
+    return df.iloc[start:end]
+
+
+def frame_view(df: pd.DataFrame, cols: list, start: int=None, end: int=None) -> pd.DataFrame:
+    '''Frame of rows [start, end) of cols that shares the column arrays of df, with a new RangeIndex
+    '''
+    return pd.DataFrame({col: df[col].array[start:end] for col in cols}, copy=False)
+
+
+def read_candles(data_path: str, ticker: str, frequency: str, cols: list=None) -> pd.DataFrame:
+    '''Candles from the memory-mapped store when it exists, else from {ticker}_{frequency}.pkl
+    '''
+    path = CandleStore.path(data_path, ticker, frequency)
+    if CandleStore.exists(path):
+        return CandleStore.read(path, cols)
+    df = pd.read_pickle(f"{path}.pkl")
+    return df if cols is None else df[cols]
+
+
+def open_shared_block(name: str) -> shared_memory.SharedMemory:
+    '''Attach to an existing shared memory block without taking ownership of it
+    Before python 3.13 attaching also registers the block with this process' resource tracker, which unlinks it
+    when the process exits, under the feet of the creator and the other workers.
+    '''
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        register = resource_tracker.register
+        resource_tracker.register = lambda name, rtype: None
+        try:
+            return shared_memory.SharedMemory(name=name)
+        finally:
+            resource_tracker.register = register
+
+
+class SharedCandles:
+    '''Candle columns copied once into multiprocessing.shared_memory blocks by a parent process
+    spec = {column: (block name, dtype, rows)} is small and picklable: pass it to the workers, which attach()
+    read-only arrays over the same pages, no copy. time is stored as int64 nanoseconds, like Data.
+    The creator keeps the blocks alive and must close() them (unlink=True by default) when the workers are done.
+    '''
+
+    attached = dict()
+
+    def __init__(self, df: pd.DataFrame, cols: list=None):
+        self.blocks = dict()
+        self.spec = dict()
+        for col in (df.columns if cols is None else cols):
+            values = to_epoch(df[col]) if col == 'time' else np.ascontiguousarray(df[col].to_numpy())
+            block = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+            np.ndarray(values.shape, dtype=values.dtype, buffer=block.buf)[:] = values
+            self.blocks[col] = block
+            self.spec[col] = (block.name, values.dtype.str, len(values))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self, unlink: bool=True):
+        for block in self.blocks.values():
+            block.close()
+            if unlink:
+                block.unlink()
+        self.blocks = dict()
+
+    @classmethod
+    def attach(cls, spec: dict, cols: list=None) -> pd.DataFrame:
+        '''Read-only DataFrame over the shared blocks of spec
+        Attached blocks stay open for the life of the process, the arrays point into them
+        '''
+        columns = dict()
+        for col in (spec.keys() if cols is None else cols):
+            name, dtype, rows = spec[col]
+            if name not in cls.attached:
+                cls.attached[name] = open_shared_block(name)
+            values = np.ndarray((rows,), dtype=np.dtype(dtype), buffer=cls.attached[name].buf)
+            values.flags.writeable = False
+            columns[col] = values
+        return pd.DataFrame(columns, copy=False)
+
+
+NUMPY_SCALAR = re.compile(r'np\.(?:float|int|uint|bool_?|str_)\d*\(([^()]*)\)')
+
+
+def parse_cell(cell):
+    '''Trade book / events cell back from its text in a csv, safe replacement of eval()
+    numpy scalar reprs such as np.float64(1.1) are unwrapped first. Cells that are not text are returned as they are.
+    '''
+    if type(cell) != str:
+        return cell
+    return ast.literal_eval(NUMPY_SCALAR.sub(r'\1', cell))
+
+
+class CellCodec:
+    '''Columnar encoding of an object column of trade book cells, event lists or tuples, see np.savez
+    book: {trade_no: (values)} or {trade_no: {key: value}} cells -> offsets, trade_no and one array per field
+    list: [str, ...] or (value, ...) cells -> offsets and one array of items
+    value: scalar cells (e.g. ratios in an object column) -> one array of the present cells
+    Cell i owns items offsets[i]:offsets[i+1], missing marks empty (NaN) cells.
+    A field / item array is float64 when all its values are numbers (ints restored on decode), vocabulary codes when
+    all are str, else the repr of each value read back by parse_cell.
+    '''
+
+    @classmethod
+    def kind(cls, cells: list) -> str:
+        types = {type(cell) for cell in cells}
+        if types == {dict}:
+            records = {type(record) for cell in cells for record in cell.values()}
+            if records <= {tuple} or records <= {dict}:
+                return 'book'
+        elif len(types) == 1 and types <= {list, tuple}:
+            return 'list'
+        elif not types & {dict, list, tuple}:
+            return 'value'
+        return 'repr'
+
+    @classmethod
+    def encode_values(cls, values: list) -> tuple:
+        '''(arrays, meta) of one field / item column
+        '''
+        if all(isinstance(v, (int, float, np.integer, np.floating)) and not isinstance(v, bool) for v in values):
+            ints = all(isinstance(v, (int, np.integer)) for v in values)
+            return dict(num=np.array(values, dtype=np.float64)), dict(type='num', ints=ints)
+        if all(type(v) == str for v in values):
+            vocab, codes = np.unique(np.array(values, dtype=str), return_inverse=True)
+            return dict(codes=codes.astype(np.int32), vocab=vocab), dict(type='str')
+        return dict(repr=np.array([repr(v) for v in values], dtype=str)), dict(type='repr')
+
+    @classmethod
+    def decode_values(cls, arrays: dict, meta: dict) -> np.ndarray:
+        '''Field / item column as an array of the table
+        '''
+        if meta['type'] == 'num':
+            return arrays['num'].astype(np.int64) if meta['ints'] else arrays['num']
+        if meta['type'] == 'str':
+            return arrays['vocab'][arrays['codes']]
+        return np.array([parse_cell(v) for v in arrays['repr'].tolist()] + [None], dtype=object)[:-1]
+
+    @classmethod
+    def encode(cls, column) -> tuple:
+        '''(arrays, meta) of an object column, arrays is flat {name: ndarray}
+        Cells still in csv text form are parsed first
+        '''
+        cells = [parse_cell(cell) if type(cell) == str and cell[:1] in ('{', '[', '(') else cell for cell in column]
+        cells = [None if isinstance(cell, float) and isnan(cell) else cell for cell in cells]
+        missing = np.array([cell is None for cell in cells], dtype=bool)
+        present = [cell for cell in cells if cell is not None]
+        meta = dict(kind=cls.kind(present))
+        if meta['kind'] == 'repr':
+            return dict(missing=missing, repr=np.array(['' if cell is None else repr(cell) for cell in cells], dtype=str)), meta
+        if meta['kind'] == 'value':
+            value_arrays, meta['item'] = cls.encode_values(present)
+            return dict(missing=missing, **{f'item.{k}': v for k, v in value_arrays.items()}), meta
+
+        lengths = np.zeros(len(cells), dtype=np.int64)
+        lengths[~missing] = [len(cell) for cell in present]
+        arrays = dict(missing=missing, offsets=np.concatenate(([0], np.cumsum(lengths))))
+        if meta['kind'] == 'book':
+            trade_nos = [trade_no for cell in present for trade_no in cell.keys()]
+            records = [record for cell in present for record in cell.values()]
+            arrays['trade_no'] = np.array(trade_nos, dtype=np.float64)
+            meta['int_trade_no'] = all(isinstance(t, (int, np.integer)) for t in trade_nos)
+            if len(records) > 0 and type(records[0]) == dict:
+                meta['record'] = 'dict'
+                meta['fields'] = list(dict.fromkeys(key for record in records for key in record.keys()))
+                columns = [[record.get(key) for record in records] for key in meta['fields']]
+            else:
+                width = max((len(record) for record in records), default=0)
+                assert all(len(record) == width for record in records), 'Records of different length'
+                meta['record'] = 'tuple'
+                meta['fields'] = [f'f{j}' for j in range(width)]
+                columns = [[record[j] for record in records] for j in range(width)]
+            meta['values'] = []
+            for field, values in zip(meta['fields'], columns):
+                field_arrays, field_meta = cls.encode_values(values)
+                arrays.update({f'{field}.{k}': v for k, v in field_arrays.items()})
+                meta['values'].append(field_meta)
+        else:
+            meta['tuple'] = type(present[0]) == tuple if present else False
+            item_arrays, meta['item'] = cls.encode_values([item for cell in present for item in cell])
+            arrays.update({f'item.{k}': v for k, v in item_arrays.items()})
+        return arrays, meta
+
+    @classmethod
+    def part(cls, arrays: dict, prefix: str) -> dict:
+        return {k[len(prefix):]: v for k, v in arrays.items() if k.startswith(prefix)}
+
+    @classmethod
+    def table(cls, arrays: dict, meta: dict) -> pd.DataFrame:
+        '''Flat table of a book or list column without building any cell, one row per trade / item with the row of its cell
+        '''
+        assert meta['kind'] in ('book', 'list'), f"No table for {meta['kind']} cells"
+        lengths = np.diff(arrays['offsets'])
+        table = pd.DataFrame({'row': np.repeat(np.arange(len(lengths)), lengths)})
+        if meta['kind'] == 'book':
+            table['trade_no'] = arrays['trade_no'].astype(np.int64) if meta['int_trade_no'] else arrays['trade_no']
+            for field, field_meta in zip(meta['fields'], meta['values']):
+                table[field] = cls.decode_values(cls.part(arrays, f'{field}.'), field_meta)
+        else:
+            table['item'] = cls.decode_values(cls.part(arrays, 'item.'), meta['item'])
+        return table
+
+    @classmethod
+    def decode(cls, arrays: dict, meta: dict) -> np.ndarray:
+        '''Object column of the cells as they were encoded, NaN for missing cells
+        '''
+        cells = np.full(len(arrays['missing']), np.nan, dtype=object)
+        rows = np.flatnonzero(~arrays['missing']).tolist()
+        if meta['kind'] == 'repr':
+            texts = arrays['repr'].tolist()
+            for i in rows:
+                cells[i] = parse_cell(texts[i])
+            return cells
+        if meta['kind'] == 'value':
+            cells[rows] = cls.decode_values(cls.part(arrays, 'item.'), meta['item']).tolist()
+            return cells
+
+        table = cls.table(arrays, meta)
+        offsets = arrays['offsets'].tolist()
+        if meta['kind'] == 'book':
+            trade_nos = table['trade_no'].tolist()
+            columns = [table[field].tolist() for field in meta['fields']]
+            records = list(zip(*columns)) if columns else [tuple() for _ in trade_nos]
+            if meta['record'] == 'dict':
+                records = [dict(zip(meta['fields'], values)) for values in records]
+            for i in rows:
+                cells[i] = dict(zip(trade_nos[offsets[i]:offsets[i+1]], records[offsets[i]:offsets[i+1]]))
+        else:
+            items = table['item'].tolist()
+            container = tuple if meta['tuple'] else list
+            for i in rows:
+                cells[i] = container(items[offsets[i]:offsets[i+1]])
+        return cells
+
+
+def save_result(df: pd.DataFrame, path: str, meta: dict=None):
+    '''Result dataframe as a compressed .npz, object columns through CellCodec and time as int64 nanoseconds
+    meta: JSON values kept in the manifest, e.g. the final gross_bal of a run whose event rows only are saved
+    '''
+    arrays, columns = dict(), dict()
+    for col in df.columns:
+        if df[col].dtype == object:
+            col_arrays, columns[col] = CellCodec.encode(df[col].to_numpy())
+            arrays.update({f'{col}:{k}': v for k, v in col_arrays.items()})
+        elif pd.api.types.is_datetime64_any_dtype(df[col]):
+            arrays[col], columns[col] = to_epoch(df[col]), dict(kind='time')
+        else:
+            arrays[col], columns[col] = df[col].to_numpy(), dict(kind='array')
+    manifest = dict(rows=df.shape[0], columns=columns)
+    if meta is not None:
+        manifest['meta'] = meta
+    arrays['__manifest__'] = np.array(json.dumps(manifest))
+    np.savez_compressed(path, **arrays)
+
+
+def read_result(path: str) -> tuple:
+    '''(arrays, manifest) of a file written by save_result
+    '''
+    with np.load(path, allow_pickle=False) as npz:
+        arrays = {k: npz[k] for k in npz.files}
+    return arrays, json.loads(arrays.pop('__manifest__').item())
+
+
+def load_result(path: str, cols: list=None) -> pd.DataFrame:
+    '''Result dataframe back from save_result with its cells rebuilt
+    '''
+    return decode_result(*read_result(path), cols)
+
+
+def decode_result(arrays: dict, manifest: dict, cols: list=None) -> pd.DataFrame:
+    '''Result dataframe of the (arrays, manifest) of read_result
+    '''
+    df = dict()
+    for col, meta in manifest['columns'].items():
+        if cols is not None and col not in cols:
+            continue
+        if meta['kind'] == 'time':
+            df[col] = to_datetime(arrays[col])
+        elif meta['kind'] == 'array':
+            df[col] = arrays[col]
+        else:
+            df[col] = CellCodec.decode(CellCodec.part(arrays, f'{col}:'), meta)
+    return pd.DataFrame(df)
+
+
+def load_trades(paths: list, column: str) -> pd.DataFrame:
+    '''Flat table of one trade book / list column over many result files, no cell is built
+    One row per trade (or item) with file, row and the field columns
+    '''
+    tables = []
+    for path in paths:
+        arrays, manifest = read_result(path)
+        table = CellCodec.table(CellCodec.part(arrays, f'{column}:'), manifest['columns'][column])
+        table.insert(0, 'file', os.path.basename(path))
+        tables.append(table)
+    return pd.concat(tables, ignore_index=True) if tables else pd.DataFrame()
+
+
+class ResultsStore:
+    '''Rows of an optimizer sweep (e.g. GridOptimizer.INPUTS_HEADER) appended to a table of an SQLite file
+    Rows are buffered and written batch at a time in one transaction, call flush() at the end of a run.
+    Many processes can append to the same file at once: the journal is WAL and a writer waits up to timeout seconds for the lock.
+    Not for files on a network drive, SQLite locking does not work there.
+    The connection is opened on first use in each process, so a store can be handed to pool workers.
+    '''
+
+    def __init__(self, path: str, columns: list=None, table: str='results', batch: int=100, timeout: float=60.0):
+        '''columns: created as the table if it does not exist, None to open an existing one
+        '''
+        self.path = path
+        self.columns = columns
+        self.table = table
+        self.batch = batch
+        self.timeout = timeout
+        self.rows = list()
+        self.connection = None
+
+    def __getstate__(self) -> dict:
+        return dict(self.__dict__, rows=list(), connection=None)
+
+    def connect(self) -> sqlite3.Connection:
+        if self.connection is None:
+            self.connection = sqlite3.connect(self.path, timeout=self.timeout)
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            if self.columns is not None:
+                columns = ', '.join(f'"{col}"' for col in self.columns)
+                with self.connection:
+                    self.connection.execute(f'CREATE TABLE IF NOT EXISTS "{self.table}" ({columns})')
+            else:
+                self.columns = [row[1] for row in self.connection.execute(f'PRAGMA table_info("{self.table}")')]
+        return self.connection
+
+    def append(self, row: list):
+        '''One row in columns order, numpy scalars are stored as their Python values
+        '''
+        self.rows.append([value.item() if hasattr(value, 'item') else value for value in row])
+        if len(self.rows) >= self.batch:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        connection = self.connect()
+        columns = ', '.join(f'"{col}"' for col in self.columns)
+        marks = ', '.join('?' for _ in self.columns)
+        with connection:
+            connection.executemany(f'INSERT INTO "{self.table}" ({columns}) VALUES ({marks})', self.rows)
+        self.rows = list()
+
+    def close(self):
+        self.flush()
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def query(self, where: dict=None, order: str=None, limit: int=None) -> pd.DataFrame:
+        '''Rows whose columns equal the values of where (None matches NULL), the rows not flushed yet included
+        order: SQL ORDER BY clause, e.g. 'gross_bal DESC'
+        '''
+        self.flush()
+        clauses, values = list(), list()
+        for col, value in (where or dict()).items():
+            if value is None:
+                clauses.append(f'"{col}" IS NULL')
+            else:
+                clauses.append(f'"{col}" = ?')
+                values.append(value)
+        sql = f'SELECT * FROM "{self.table}"'
+        if clauses:
+            sql = sql + ' WHERE ' + ' AND '.join(clauses)
+        if order is not None:
+            sql = sql + f' ORDER BY {order}'
+        if limit is not None:
+            sql = sql + f' LIMIT {int(limit)}'
+        return pd.read_sql_query(sql, self.connect(), params=values)
+
+    def top(self, n: int, by: str='gross_bal', **where) -> pd.DataFrame:
+        '''n rows with the highest by, e.g. store.top(20, ticker='EUR_USD', stop_loss_type='grid_count')
+        '''
+        return self.query(where, order=f'"{by}" IS NULL, "{by}" DESC', limit=n)
+
+class ResultCache:
+    '''Result frames on disk under a hash of everything they depend on, see key()
+    One save_result() .npz per key in path with its meta in the manifest. Reading an entry marks it as used, when the entries
+    go over max_bytes the least recently used ones are removed. An entry is written to a temporary file and renamed, so
+    processes can share a cache.
+    '''
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        # Bytes of the entries at the last scan plus the ones written since
+        self.size = None
+        os.makedirs(path, exist_ok=True)
+
+    @staticmethod
+    def key(*parts) -> str:
+        '''Hash of JSON parts, dicts in any key order
+        '''
+        text = json.dumps(parts, sort_keys=True, default=lambda v: v.item())
+        return hashlib.sha1(text.encode()).hexdigest()
+
+    @staticmethod
+    def file_hash(paths: list) -> str:
+        '''Hash of the contents of files, e.g. the modules of a simulator as its code version
+        '''
+        h = hashlib.sha1()
+        for path in paths:
+            with open(path, 'rb') as f:
+                h.update(f.read())
+        return h.hexdigest()
+
+    @staticmethod
+    def data_hash(df: pd.DataFrame, cols: list) -> str:
+        '''Hash of the values of cols, time as epoch nanoseconds whatever its dtype
+        '''
+        h = hashlib.sha1()
+        for col in cols:
+            values = to_epoch(df[col]) if col == 'time' else df[col].to_numpy(dtype=np.float64)
+            h.update(col.encode())
+            h.update(np.ascontiguousarray(values).tobytes())
+        return h.hexdigest()
+
+    def file(self, key: str) -> str:
+        return os.path.join(self.path, f'{key}.npz')
+
+    def entries(self) -> list:
+        '''(last used, bytes, path) of the entries, temporary files of other processes left out
+        '''
+        entries = list()
+        for entry in os.scandir(self.path):
+            if entry.name.endswith('.npz') and entry.name.count('.') == 1:
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def get(self, key: str) -> tuple:
+        '''(frame, meta) of key, None when it is not cached
+        '''
+        path = self.file(key)
+        try:
+            arrays, manifest = read_result(path)
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return decode_result(arrays, manifest), manifest.get('meta')
+
+    def put(self, key: str, df: pd.DataFrame, meta: dict=None):
+        path = self.file(key)
+        temp = os.path.join(self.path, f'{key}.{os.getpid()}.npz')
+        save_result(df, temp, meta)
+        try:
+            os.replace(temp, path)
+        except PermissionError:
+            # Windows, another process is reading the same entry it wrote
+            os.remove(temp)
+            return
+        if self.size is None:
+            self.size = sum(size for _, size, _ in self.entries())
+        else:
+            self.size = self.size + os.path.getsize(path)
+        if self.size > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        '''Remove the least recently used entries until they fit in max_bytes
+        '''
+        entries = sorted(self.entries())
+        size = sum(size for _, size, _ in entries)
+        for _, entry_size, path in entries:
+            if size <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                # Gone already or open in another process on Windows
+                continue
+            size = size - entry_size
+        self.size = size
+
+
+def load_candles(source, cols: list=None) -> pd.DataFrame:
+    '''Candles of a DataFrame, .pkl file, CandleStore directory or SharedCandles spec, time as int64 nanoseconds
+    A DataFrame is viewed without copy, e.g. a window of a frame shared by many simulators. datetimes are only created again by Data.export().
+    '''
+    assert type(source) in (str, pd.DataFrame, dict), 'Invalid source'
+    if type(source) == str and CandleStore.exists(source):
+        df = CandleStore.read(source, cols)
+    elif type(source) == str:
+        df = pd.read_pickle(source) if cols == None else pd.read_pickle(source)[cols]
+    elif type(source) == dict:
+        df = SharedCandles.attach(source, cols)
+    elif type(source) == pd.DataFrame:
+        df = frame_view(source, source.columns if cols == None else cols)
+    if 'time' in df.columns:
+        df['time'] = to_epoch(df['time'])
+    return df
+
+
+def read_chunks(source, rows: int, cols: list=None):
+    '''Candles of a source in frames of at most rows bars, time as int64 nanoseconds
+    source: CandleStore directory, .pkl file, DataFrame or a list of these read one after the other, e.g. one store per year.
+    A store is mapped again for every chunk and the slice copied out, so only the pages of one chunk stay resident.
+    A .pkl is loaded whole first.
+    '''
+    if type(source) in (list, tuple):
+        for part in source:
+            yield from read_chunks(part, rows, cols)
+        return
+    if type(source) == str and CandleStore.exists(source):
+        for start in range(0, CandleStore.manifest(source)['rows'], rows):
+            df = CandleStore.read(source, cols)
+            chunk = pd.DataFrame({col: np.array(df[col].array[start:start+rows]) for col in df.columns})
+            del df
+            yield load_candles(chunk)
+        return
+    df = load_candles(source, cols)
+    for start in range(0, len(df), rows):
+        yield frame_view(df, df.columns, start, start+rows)
+
+
 class Data:
+
+    LEDGER_COLUMNS = ('open_longs', 'open_shorts', 'closed_longs', 'closed_shorts')
     
     def __init__(self, source, ticker: str, cols: list=None, instruments: str=None):
-        assert type(source) == str or type(source) == pd.DataFrame, 'Invalid source'
+        '''source: DataFrame, .pkl file, CandleStore directory or SharedCandles spec
+        '''
         assert type(instruments) == str, 'Require instruments.json'
-        if type(source) == str:
-            self.df = {
-                'raw': pd.read_pickle(source) if cols == None else pd.read_pickle(source)[cols]
-            }
-        elif type(source) == pd.DataFrame:
-            self.df = {
-                'raw': source.copy() if cols == None else source.copy()[cols]
-            }            
-
-        try:
-            if 'time' in self.df['raw'].columns:
-                self.df['raw']['time'] = [x.replace(tzinfo=None) for x in self.df['raw']['time']]
-        except:
-            pass
+        self.df = {
+            'raw': load_candles(source, cols)
+        }
 
         self.datalen = self.df['raw'].shape[0]
 
         with open(instruments, 'r') as f:
             self.ticker = json.load(f)[ticker]
+        # Points of price_scale() in a unit of price and in a pip
+        self.scale = self.price_scale()
+        self.pip_points = round(self.scale * pow(10, self.ticker['pipLocation']))
+
+        self.offsets = dict(raw=0)
+        self.books = dict()
+        self.ledgers = dict()
 
     def __repr__(self) -> str:
         repr = str()
@@ -35,7 +1071,64 @@ class Data:
             repr = repr + name + ':\n' + str(pd.concat([df.head(2), df.tail(1)])) + '\n'
         repr = repr + 'ticker:\n' + str(self.ticker)
         return repr
-    
+
+    def add_candles(self, name: str, source, cols: list=None):
+        '''Another candle dataframe of the ticker next to raw, e.g. its S5 candles, rows found with index_of(time, source=name)
+        '''
+        self.df[name] = load_candles(source, cols)
+        self.offsets[name] = 0
+
+    def next_chunk(self, name: str, source):
+        '''Move fast data name on to the candles of source, the next chunk of a stream with the columns of raw
+        The last row is kept as row 0, the bar before the chunk, the other rows of the added columns start as NaN again.
+        offsets[name] moves on so that offsets[name] + i stays the row in the whole stream.
+        '''
+        raw = load_candles(source, list(self.df['raw'].columns))
+        columns = dict()
+        for col, values in zip(self.fcols, self.fastdf):
+            rest = raw[col].to_numpy() if col in raw.columns else np.full(len(raw), np.nan, dtype=values.dtype)
+            columns[col] = np.concatenate((values[-1:], rest))
+        self.offsets[name] = self.offsets[name] + self.fdatalen - 1
+        self.offsets['raw'] = self.offsets[name] + 1
+        self.df['raw'] = raw
+        self.datalen = len(raw)
+        self.df[name] = pd.DataFrame(columns, copy=False)
+        self.fastdf = list(columns.values())
+        self.fdatalen = len(self.fastdf[0])
+
+    def index_of(self, time, source: str='raw', side: str='left') -> int:
+        '''Row of time in a component dataframe by binary search on its int64 time axis, see np.searchsorted for side
+        '''
+        return int(np.searchsorted(self.df[source]['time'].to_numpy(), to_epoch(time), side=side))
+
+    def time_range(self, name: str) -> tuple:
+        '''(first, last) time of a component dataframe as Timestamps
+        '''
+        time = self.df[name]['time']
+        return to_datetime(time.iloc[0]), to_datetime(time.iloc[-1])
+
+    def export(self, name: str, rows: np.ndarray=None) -> pd.DataFrame:
+        '''Copy of a component dataframe with time back as datetime64 for saving / analysis
+        rows: optional boolean mask, e.g. event rows only. Trade book columns are rebuilt from the ledger for these rows only.
+        '''
+        df = self.df[name].copy() if rows is None else self.df[name][rows].copy()
+        if 'time' in df.columns:
+            df['time'] = to_datetime(df['time'])
+        if name in self.ledgers:
+            ledger = self.ledgers[name]
+            index = df.index.to_numpy()
+            cells = {col: np.full(len(index), np.nan, dtype=object) for col in self.LEDGER_COLUMNS}
+            for j, (trades, closed) in enumerate(ledger.replay(index)):
+                cells['open_longs'][j], cells['open_shorts'][j] = trades[ledger.LONG], trades[ledger.SHORT]
+                if closed[ledger.LONG]:
+                    cells['closed_longs'][j] = closed[ledger.LONG]
+                if closed[ledger.SHORT]:
+                    cells['closed_shorts'][j] = closed[ledger.SHORT]
+            for col, values in cells.items():
+                if col in df.columns:
+                    df[col] = values
+        return df
+
     def prep_data(self, name: str, start: int, end: int, source: str='raw', cols: list=None):
         '''Create new dataframe with specified list of columns and number of rows as preparation for fast data creation
         '''
@@ -49,8 +1142,10 @@ class Data:
 
         assert end > start, f'start={start}, end={end} not valid'
 
-        self.df[name] = self.df[source][cols].iloc[start:end].copy()
-        self.df[name].reset_index(drop=True, inplace=True)
+        # Window of views over the source arrays, row i is row offsets[name] + i of raw.
+        # Only columns added afterwards (add_columns) get new buffers, of the window length.
+        self.df[name] = frame_view(self.df[source], cols, start, end)
+        self.offsets[name] = self.offsets[source] + start
 
     def add_columns(self, name: str, cols: dict):
         '''Add new columns to component dataframes
@@ -72,17 +1167,24 @@ class Data:
             end = self.datalen
 
         self.prep_data(name=name, start=start, end=end, source=source, cols=cols)
-        if add_cols:
-            self.add_columns(name=name, cols=add_cols)
+
+        # fastdf holds plain ndarrays: the source columns as they are and one NaN filled buffer of the window length per added column.
+        # int columns are float64 buffers as before, NaN marks rows not written yet.
+        # The component dataframe wraps the same arrays without a copy, so it shows every write to fastdf.
+        columns = {col: self.df[name][col].to_numpy() for col in self.df[name].columns}
+        for col, _type in (add_cols or dict()).items():
+            columns[col] = np.full(len(self.df[name]), np.nan, dtype=object if _type == object else np.float64)
+        self.df[name] = pd.DataFrame(columns, copy=False)
 
         self.fcols = dict()
-        for i in range(len(self.df[name].columns)):
-            self.fcols[self.df[name].columns[i]] = i
-        self.fastdf = [self.df[name][col].array for col in self.df[name].columns]
+        for i, col in enumerate(columns.keys()):
+            self.fcols[col] = i
+        self.fastdf = list(columns.values())
         self.fdatalen = len(self.fastdf[0])
 
     def fdata(self, column: str=None, index: int=None, rows: int=None):
         '''Pass rows=-1 if all rows need to be returned
+        Returns a deep copy, use fget / fview / fcell / fcell_copy in per-bar code
         '''
         if column is None:
             fdata = self.fastdf
@@ -99,6 +1201,32 @@ class Data:
                 fdata = self.fastdf[self.fcols[column]][index]
         return deepcopy(fdata)
         
+    def fget(self, column: str, index: int):
+        '''Scalar cell without copy
+        '''
+        return self.fastdf[self.fcols[column]][index]
+
+    def fview(self, column: str, index: int=0, rows: int=None) -> np.ndarray:
+        '''Read-only array view of rows [index, index+rows), all remaining rows if rows is None
+        '''
+        end = self.fdatalen if rows is None else min(index + rows, self.fdatalen)
+        view = np.asarray(self.fastdf[self.fcols[column]])[index:end]
+        view.flags.writeable = False
+        return view
+
+    def fcell(self, column: str, index: int, factory=dict):
+        '''Container cell (dict / list) for reading only, factory() when the cell is empty
+        '''
+        cell = self.fastdf[self.fcols[column]][index]
+        return cell if type(cell) == factory else factory()
+
+    def fcell_copy(self, column: str, index: int, factory=dict):
+        '''Shallow copy of a container cell to modify and write back with update_fdata
+        Cells only hold immutable values (tuples, str, numbers), so a shallow copy never aliases
+        '''
+        cell = self.fastdf[self.fcols[column]][index]
+        return cell.copy() if type(cell) == factory else factory()
+
     def update_fdata(self, column: str, index: int=None, value: float=None):
         if index is None:
             assert len(value) == self.fdatalen
@@ -107,6 +1235,75 @@ class Data:
         else:
             self.fastdf[self.fcols[column]][index] = value
 
+    def fill_fdata(self, column: str, start: int, end: int, value):
+        '''Set rows [start, end) to one value or to an array of end - start values
+        An object value (dict, tuple, ...) is set as one cell shared by all rows, not copied
+        '''
+        if not isinstance(value, np.ndarray):
+            cell = np.empty(1, dtype=object if self.fastdf[self.fcols[column]].dtype == object else np.float64)
+            cell[0] = value
+            value = cell
+        self.fastdf[self.fcols[column]][start:end] = value
+
+    def add_trade_book(self, name: str, fields: tuple=TradeBook.FIELDS, capacity: int=64, levels: tuple=(), totals: bool=False):
+        '''Array backed trade book of open trades, its history is kept by the ledger, see add_ledger
+        levels: fields indexed by price level, e.g. ('TP', 'SL', 'TSL')
+        totals: keep running SIZE and SIZE x ENTRY totals in points of price_scale()
+        '''
+        self.books[name] = TradeBook(fields=fields, capacity=capacity, levels=levels, scale=self.price_scale() if totals else None)
+        return self.books[name]
+
+    def price_scale(self) -> int:
+        '''Points per unit of price, one digit finer than the ticker displays so mid prices stay whole
+        '''
+        return 10 ** (self.ticker['displayPrecision'] + 1)
+
+    def add_ledger(self, name: str, fields: tuple=TradeBook.FIELDS, closed_fields: tuple=None, capacity: int=1024):
+        '''Trade ledger of a component dataframe
+        export() rebuilds its open_longs / open_shorts / closed_longs / closed_shorts columns from it
+        '''
+        self.ledgers[name] = TradeLedger(fields=fields, closed_fields=closed_fields, capacity=capacity)
+        return self.ledgers[name]
+
+    def save_state(self, index: int, cols: list) -> dict:
+        '''Flat dict of arrays with rows [0, index] of cols and all trade books / ledgers, see np.savez
+        Object cells (events lists) are stored as json strings with their row numbers
+        '''
+        state = dict(index=np.array(index))
+        for col in cols:
+            values = np.asarray(self.fastdf[self.fcols[col]])[:index+1]
+            if values.dtype == object:
+                rows = np.array([i for i, cell in enumerate(values) if isinstance(cell, (list, dict, str))], dtype=np.int64)
+                state[f'rows.{col}'] = rows
+                state[f'cells.{col}'] = np.array([json.dumps(values[i]) for i in rows], dtype=str)
+            else:
+                state[f'col.{col}'] = values
+        for book_name, book in self.books.items():
+            state.update({f'book.{book_name}.{k}': v for k, v in book.state().items()})
+        for ledger_name, ledger in self.ledgers.items():
+            state.update({f'ledger.{ledger_name}.{k}': v for k, v in ledger.state().items()})
+        return state
+
+    def load_state(self, state: dict) -> int:
+        '''Restore what save_state wrote, returns the row the state was taken at
+        '''
+        index = int(state['index'])
+        for key in state.keys():
+            kind, _, rest = key.partition('.')
+            if kind == 'col':
+                self.fastdf[self.fcols[rest]][:index+1] = state[key]
+            elif kind == 'rows':
+                col = self.fastdf[self.fcols[rest]]
+                for i, cell in zip(state[key].tolist(), state[f'cells.{rest}'].tolist()):
+                    col[i] = json.loads(cell)
+        for book_name, book in self.books.items():
+            prefix = f'book.{book_name}.'
+            book.load_state({k[len(prefix):]: v for k, v in state.items() if k.startswith(prefix)})
+        for ledger_name, ledger in self.ledgers.items():
+            prefix = f'ledger.{ledger_name}.'
+            ledger.load_state({k[len(prefix):]: v for k, v in state.items() if k.startswith(prefix)})
+        return index
+
     def print_row(self, i: int):
         print(tabulate([[i] + [self.fastdf[self.fcols[col]][i] for col in self.fcols.keys()]], ['index']+ list(self.fcols.keys()), tablefmt='plain'))
 
@@ -115,7 +1312,7 @@ class Data:
         {1: (...), 2: (...)} to {1: {}, 2: {}}
         '''
         if type(self.fastdf[self.fcols[column]][index]) == str:
-            data = eval(self.fastdf[self.fcols[column]][index])
+            data = parse_cell(self.fastdf[self.fcols[column]][index])
         elif type(self.fastdf[self.fcols[column]][index]) == dict:
             data = self.fastdf[self.fcols[column]][index]
         else:
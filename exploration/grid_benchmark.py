@@ -0,0 +1,181 @@
+from grid_simulator import GridSimulator
+from grid_lockstep import GridLockstep
+import grid_kernel
+from data import Data, read_candles
+from timeit import default_timer as timer
+import pandas as pd
+
+data_path = '../data/'
+instruments = "../data/instruments.json"
+
+ticker = 'EUR_USD'
+frequency = 'M5'
+start = 0
+end = 20000
+params = dict(
+    init_bal=1000,
+    init_trade_size=100,
+    grid_pips=20,
+    sl_grid_count=5,
+    stop_loss_type='grid_count',
+    margin_sl_percent=0.60,
+    sizing='dynamic',
+    cash_out_factor=None,
+    cover_stopped_loss=None,
+    cover_sl_ratio=3.0,
+    max_unrealised_pnl=0.10,
+    trailing_sl=False
+)
+# Sweep of lockstep_benchmark(), every combination over params
+sweep = dict(
+    grid_pips=[10, 20, 30, 40, 60],
+    sl_grid_count=[5, 10, 15, 20, 30],
+    stop_loss_type=['grid_count_on_margin', 'oldest_on_margin'],
+    margin_sl_percent=[0.90, 0.80, 0.70],
+    sizing=['dynamic', 'static']
+)
+# Parity runs of kernel_benchmark(), each over params
+kernel_tickers = ['EUR_USD', 'EUR_CHF']
+kernel_variants = [
+    dict(),
+    dict(stop_loss_type='grid_count_on_margin', margin_sl_percent=0.90, sizing='static'),
+    dict(stop_loss_type='oldest_on_margin', margin_sl_percent=0.80, cash_out_factor=1.5),
+    dict(stop_loss_type='farthest_on_margin', margin_sl_percent=0.90),
+    dict(stop_loss_type='max_unrealised_pnl_farthest', trailing_sl=True),
+    dict(stop_loss_type='grid_count_max_unrealised_pnl', trailing_sl=True, cash_out_factor=1.1)
+]
+# intrabar_benchmark(), frequency with and without the intrabar candles against a run on the intrabar candles alone
+intrabar_frequency = 'S5'
+
+
+def deepcopy_accessors():
+    '''Route the per-bar accessors through fdata, i.e. a deepcopy on every read as before
+    Returns the fast accessors so they can be restored
+    '''
+    fast = Data.fget, Data.fcell, Data.fcell_copy
+
+    def fcell(self, column, index, factory=dict):
+        cell = self.fdata(column, index)
+        return cell if type(cell) == factory else factory()
+
+    Data.fget = lambda self, column, index: self.fdata(column, index)
+    Data.fcell = fcell
+    Data.fcell_copy = fcell
+    return fast
+
+
+def restore_accessors(fast):
+    Data.fget, Data.fcell, Data.fcell_copy = fast
+
+
+def time_run_sim(df: pd.DataFrame, label: str, skip_bars: bool=False):
+    sim = GridSimulator(name=f'{ticker}-{frequency}-benchmark', df=df, instruments=instruments, ticker=ticker, skip_bars=skip_bars, **params)
+    begin = timer()
+    sim.run_sim()
+    elapsed = timer() - begin
+    print(f"{label:<20} -> {elapsed:.4f}s {elapsed / sim.d.fdatalen * 1e6:8.1f}us/bar")
+    return sim.d.df[sim.name], elapsed
+
+
+def benchmark():
+    df = read_candles(data_path, ticker, frequency).iloc[start:end]
+    print(f"{ticker} {frequency} bars: {df.shape[0]}")
+
+    fast = deepcopy_accessors()
+    before, before_elapsed = time_run_sim(df, 'fdata deepcopy')
+    restore_accessors(fast)
+    after, after_elapsed = time_run_sim(df, 'zero-copy accessors')
+
+    assert before.gross_bal.equals(after.gross_bal), 'Results differ'
+    print(f"speedup: {before_elapsed / after_elapsed:.2f}x")
+
+    skipped, skipped_elapsed = time_run_sim(df, 'bar skipping', skip_bars=True)
+    assert after.net_bal.equals(skipped.net_bal) and after.gross_bal.equals(skipped.gross_bal), 'Results differ'
+    print(f"speedup: {after_elapsed / skipped_elapsed:.2f}x")
+
+
+def lockstep_benchmark(sample: int=10):
+    '''Configurations per hour of GridLockstep over the sweep against GridSimulator on every sample-th configuration
+    '''
+    df = read_candles(data_path, ticker, frequency).iloc[start:end]
+    configs = [dict(params)]
+    for key, values in sweep.items():
+        configs = [dict(config, **{key: value}) for config in configs for value in values]
+
+    begin = timer()
+    lockstep = GridLockstep(name=f'{ticker}-{frequency}-lockstep', df=df, instruments=instruments, ticker=ticker, configs=configs)
+    lockstep.run_sim()
+    lockstep_elapsed = timer() - begin
+    print(f"{'lockstep':<20} -> {len(configs) / lockstep_elapsed * 3600:10.0f} configs/hour ({len(configs)} configs)")
+
+    elapsed = 0
+    for k in range(0, len(configs), sample):
+        sim = GridSimulator(name=f'{ticker}-{frequency}-{k}', df=df, instruments=instruments, ticker=ticker, **configs[k])
+        begin = timer()
+        sim.run_sim()
+        elapsed = elapsed + timer() - begin
+        assert sim.d.df[sim.name].gross_bal.equals(lockstep.frame(k).gross_bal), f'Results differ for {configs[k]}'
+    per_config = elapsed / len(range(0, len(configs), sample))
+    print(f"{'GridSimulator':<20} -> {3600 / per_config:10.0f} configs/hour")
+    print(f"speedup: {per_config * len(configs) / lockstep_elapsed:.2f}x")
+
+
+def kernel_benchmark():
+    '''GridSimulator with and without the compiled kernel on the variants of each ticker, every column of the exports must match
+    The first kernel run compiles it and is left out of the timing
+    '''
+    print(f"grid_kernel compiled: {grid_kernel.COMPILED}")
+    for tk in kernel_tickers:
+        df = read_candles(data_path, tk, frequency).iloc[start:end]
+        elapsed = dict(reference=0, kernel=0)
+        for k, variant in enumerate(kernel_variants):
+            results = dict()
+            for label, kernel in (('reference', False), ('kernel', True)):
+                sim = GridSimulator(name=f'{tk}-{frequency}-{k}', df=df, instruments=instruments, ticker=tk, kernel=kernel, **dict(params, **variant))
+                if kernel and k == 0:
+                    sim.run_kernel()
+                    sim = GridSimulator(name=f'{tk}-{frequency}-{k}', df=df, instruments=instruments, ticker=tk, kernel=kernel, **dict(params, **variant))
+                begin = timer()
+                sim.run_sim()
+                elapsed[label] = elapsed[label] + timer() - begin
+                results[label] = sim.d.export(sim.name)
+            assert results['reference'].equals(results['kernel']), f'Results differ for {tk} {variant}'
+        bars = df.shape[0] * len(kernel_variants)
+        for label, seconds in elapsed.items():
+            print(f"{tk + ' ' + label:<20} -> {seconds:.4f}s {seconds / bars * 1e6:8.2f}us/bar")
+        print(f"speedup: {elapsed['reference'] / elapsed['kernel']:.2f}x")
+
+
+def intrabar_benchmark():
+    '''gross_bal and closed trades of frequency alone and with its intrabar candles against intrabar_frequency alone
+    Over the kernel_variants, the time of the bars covered by start:end.
+    '''
+    df = read_candles(data_path, ticker, frequency).iloc[start:end]
+    fine = read_candles(data_path, ticker, intrabar_frequency)
+    fine = fine[(fine.time >= df.time.iloc[0]) & (fine.time < df.time.iloc[-1])]
+    runs = dict(frequency=(df, None), intrabar=(df, fine), fine=(fine, None))
+    elapsed = dict.fromkeys(runs, 0)
+    error = dict(frequency=0, intrabar=0)
+    for k, variant in enumerate(kernel_variants):
+        results = dict()
+        for label, (candles, intrabar) in runs.items():
+            sim = GridSimulator(name=f'{ticker}-{label}-{k}', df=candles, instruments=instruments, ticker=ticker, intrabar=intrabar,
+                                **dict(params, **variant))
+            begin = timer()
+            sim.run_sim()
+            elapsed[label] = elapsed[label] + timer() - begin
+            ledger = sim.ledger
+            results[label] = sim.d.fget('gross_bal', sim.d.fdatalen-1), int((ledger.kind[:len(ledger)] == ledger.CLOSE).sum())
+        print(f"{str(variant):<90} gross_bal / closed: " + ', '.join(f"{label} {bal:.2f} / {closed}" for label, (bal, closed) in results.items()))
+        for label in error:
+            error[label] = error[label] + abs(results[label][0] - results['fine'][0])
+    for label, seconds in elapsed.items():
+        print(f"{label:<20} -> {seconds:.4f}s")
+    print(f"abs gross_bal error against {intrabar_frequency}: " + ', '.join(f"{label} {value:.2f}" for label, value in error.items()))
+
+
+if __name__ == '__main__':
+    benchmark()
+    lockstep_benchmark()
+    kernel_benchmark()
+    intrabar_benchmark()
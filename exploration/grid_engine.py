@@ -0,0 +1,236 @@
+from data import parse_cell, to_points, round_level
+
+
+class GridEngine:
+    '''Accounting, trade book cells, event recording and export shared by the GridSimulator variants
+    A variant sets its EVENT_* / OPEN_KEYS / CLOSED_KEYS constants, prepares self.d with the account columns and
+    plugs in its strategy hooks (entry, cover_entry, pyramid_entry, next_grid, update_martingale, trade_direction, ...).
+    Trade books are {trade_no: (values)} cells in OPEN_KEYS / CLOSED_KEYS order. get_open_longs() and friends return
+    modifiable dicts of dicts, the accounting below reads the cells in place through book().
+    Extra columns a variant carries from bar to bar go in carry_strategy_values() / update_strategy_values().
+    '''
+
+    LONG_MARK, SHORT_MARK = 'mid_c', 'mid_c'
+
+    def level(self, price: float, pips: float) -> float:
+        '''round(price + pips * pow(10, pipLocation), 5), added in whole points of Data.scale
+        The float sum is only taken when price or pips is off the points grid or the rounding is a tie.
+        '''
+        points, move = to_points(price, self.d.scale), pips * self.d.pip_points
+        if points is not None and move == int(move):
+            level = round_level(points + int(move), self.d.scale)
+            if level is not None:
+                return level
+        return round(price + pips * pow(10, self.d.ticker['pipLocation']), 5)
+
+    def midpoint(self, entry: float, level: float) -> float:
+        '''round(entry + (level - entry) / 2, 5), in half points, e.g. the first TSL of a trade half way to its TP
+        '''
+        points, other = to_points(entry, self.d.scale), to_points(level, self.d.scale)
+        if points is not None and other is not None:
+            midpoint = round_level(points + other, 2 * self.d.scale)
+            if midpoint is not None:
+                return midpoint
+        return round(entry + (level - entry) / 2, 5)
+
+    def book(self, column: str, i: int=None) -> dict:
+        '''Trade book cell at row i (default self.i) for reading only, an empty dict when there is none
+        '''
+        cell = parse_cell(self.d.fget(column, self.i if i is None else i))
+        return cell if type(cell) == dict else dict()
+
+    def get_open_longs(self, i: int=None):
+        i = self.i if i is None else i
+        return self.d.to_dict_of_dicts('open_longs', self.OPEN_KEYS, i)
+
+    def get_open_shorts(self, i: int=None):
+        i = self.i if i is None else i
+        return self.d.to_dict_of_dicts('open_shorts', self.OPEN_KEYS, i)
+
+    def get_closed_longs(self, i: int=None):
+        i = self.i if i is None else i
+        return self.d.to_dict_of_dicts('closed_longs', self.CLOSED_KEYS, i)
+
+    def get_closed_shorts(self, i: int=None):
+        i = self.i if i is None else i
+        return self.d.to_dict_of_dicts('closed_shorts', self.CLOSED_KEYS, i)
+
+    def update_open_longs(self, open_longs: dict):
+        open_longs_tuple = dict()
+        for trade_no, trade in open_longs.items():
+            open_longs_tuple[trade_no] = tuple(trade.values())
+        self.d.update_fdata('open_longs', self.i, open_longs_tuple)
+
+    def update_open_shorts(self, open_shorts: dict):
+        open_shorts_tuple = dict()
+        for trade_no, trade in open_shorts.items():
+            open_shorts_tuple[trade_no] = tuple(trade.values())
+        self.d.update_fdata('open_shorts', self.i, open_shorts_tuple)
+
+    def update_closed_longs(self, closed_longs: dict):
+        closed_longs_tuple = dict()
+        for trade_no, trade in closed_longs.items():
+            closed_longs_tuple[trade_no] = tuple(trade.values())
+        self.d.update_fdata('closed_longs', self.i, closed_longs_tuple)
+
+    def update_closed_shorts(self, closed_shorts: dict):
+        closed_shorts_tuple = dict()
+        for trade_no, trade in closed_shorts.items():
+            closed_shorts_tuple[trade_no] = tuple(trade.values())
+        self.d.update_fdata('closed_shorts', self.i, closed_shorts_tuple)
+
+    def cum_long_position(self):
+        size = self.OPEN_KEYS.index('SIZE')
+        cum_long_position = 0
+        for trade in self.book('open_longs').values():
+            cum_long_position = cum_long_position + trade[size]
+        return cum_long_position
+
+    def cum_short_position(self):
+        size = self.OPEN_KEYS.index('SIZE')
+        cum_short_position = 0
+        for trade in self.book('open_shorts').values():
+            cum_short_position = cum_short_position + trade[size]
+        return cum_short_position
+
+    def unrealised_pnl(self):
+        size, entry = self.OPEN_KEYS.index('SIZE'), self.OPEN_KEYS.index('ENT')
+        long_price, short_price = self.d.fget(self.LONG_MARK, self.i), self.d.fget(self.SHORT_MARK, self.i)
+        pnl = 0
+        for trade in self.book('open_longs').values():
+            pnl = pnl + trade[size] * (long_price - trade[entry])
+        for trade in self.book('open_shorts').values():
+            pnl = pnl + trade[size] * (trade[entry] - short_price)
+        return round(pnl, 2)
+
+    def realised_pnl(self):
+        size, entry, exit = (self.CLOSED_KEYS.index(key) for key in ('SIZE', 'ENT', 'EXIT'))
+        pnl = 0
+        for trade in self.book('closed_longs').values():
+            pnl = pnl + trade[size] * (trade[exit] - trade[entry])
+        for trade in self.book('closed_shorts').values():
+            pnl = pnl + trade[size] * (trade[entry] - trade[exit])
+        return round(pnl, 2)
+
+    def current_ac_bal(self):
+        return self.d.fget('ac_bal', self.i-1) + self.d.fget('realised_pnl', self.i)
+
+    def current_ac_values(self):
+        margin_used = (self.d.fget('cum_long_position', self.i) +
+                       self.d.fget('cum_short_position', self.i)) * float(self.d.ticker['marginRate'])
+        net_bal = self.current_ac_bal() + self.d.fget('unrealised_pnl', self.i)
+        return net_bal, margin_used
+
+    def cash_transfer(self):
+        net_bal, _ = self.current_ac_values()
+        if self.cash_out_factor is not None:
+            self.d.update_fdata('cash_bal', self.i, self.d.fget('cash_bal', self.i-1))
+            cash_out_threshold = self.init_bal * self.cash_out_factor
+            events = self.d.fcell('events', self.i, list)
+            stop_loss = self.EVENT_SL in events or self.EVENT_MC in events
+            # Cash out / withdraw
+            if net_bal > cash_out_threshold:
+                cash_out = net_bal - cash_out_threshold
+                self.d.update_fdata('ac_bal', self.i, round(self.d.fget('ac_bal', self.i-1) - cash_out, 2))
+                self.d.update_fdata('cash_bal', self.i, round(self.d.fget('cash_bal', self.i) + cash_out, 2))
+                self.update_events(self.EVENT_CASH_OUT)
+                return cash_out
+            # Deposit money into a/c when net_bal < cash_out_threshold
+            elif stop_loss and net_bal < cash_out_threshold:
+                cash_in = min(cash_out_threshold - net_bal, self.d.fget('cash_bal', self.i))
+                if cash_in > 0:
+                    self.d.update_fdata('ac_bal', self.i, round(self.d.fget('ac_bal', self.i-1) + cash_in, 2))
+                    self.d.update_fdata('cash_bal', self.i, round(self.d.fget('cash_bal', self.i) - cash_in, 2))
+                    self.update_events(self.EVENT_CASH_IN)
+                    return cash_in
+
+    def carry_strategy_values(self):
+        '''Copy the variant's own columns from the previous bar, called by update_temp_ac_values(init=True)
+        '''
+
+    def update_strategy_values(self):
+        '''Recompute the variant's own columns after a trade, called by update_temp_ac_values()
+        '''
+
+    def update_temp_ac_values(self, init: bool=False):
+        if init:
+            self.d.update_fdata('open_longs', self.i, self.d.fget('open_longs', self.i-1))
+            self.d.update_fdata('open_shorts', self.i, self.d.fget('open_shorts', self.i-1))
+            self.d.update_fdata('cum_long_position', self.i, self.d.fget('cum_long_position', self.i-1))
+            self.d.update_fdata('cum_short_position', self.i, self.d.fget('cum_short_position', self.i-1))
+            self.d.update_fdata('open_long_count', self.i, len(self.book('open_longs', self.i-1)))
+            self.d.update_fdata('open_short_count', self.i, len(self.book('open_shorts', self.i-1)))
+            self.d.update_fdata('closed_long_count', self.i, len(self.book('closed_longs', self.i-1)))
+            self.d.update_fdata('closed_short_count', self.i, len(self.book('closed_shorts', self.i-1)))
+            self.carry_strategy_values()
+        else:
+            self.d.update_fdata('cum_long_position', self.i, self.cum_long_position())
+            self.d.update_fdata('cum_short_position', self.i, self.cum_short_position())
+            self.d.update_fdata('open_long_count', self.i, len(self.book('open_longs')))
+            self.d.update_fdata('open_short_count', self.i, len(self.book('open_shorts')))
+            self.d.update_fdata('closed_long_count', self.i, len(self.book('closed_longs')))
+            self.d.update_fdata('closed_short_count', self.i, len(self.book('closed_shorts')))
+            self.update_strategy_values()
+
+        self.d.update_fdata('unrealised_pnl', self.i, self.unrealised_pnl())
+        self.d.update_fdata('realised_pnl', self.i, self.realised_pnl())
+
+    def update_ac_values(self):
+        self.d.update_fdata('cum_long_position', self.i, self.cum_long_position())
+        self.d.update_fdata('cum_short_position', self.i, self.cum_short_position())
+        self.d.update_fdata('open_long_count', self.i, len(self.book('open_longs')))
+        self.d.update_fdata('open_short_count', self.i, len(self.book('open_shorts')))
+        self.d.update_fdata('closed_long_count', self.i, len(self.book('closed_longs')))
+        self.d.update_fdata('closed_short_count', self.i, len(self.book('closed_shorts')))
+        self.update_balances()
+
+    def update_balances(self):
+        self.d.update_fdata('unrealised_pnl', self.i, self.unrealised_pnl())
+        self.d.update_fdata('realised_pnl', self.i, self.realised_pnl())
+
+        # First candle
+        if self.i == 0:
+            self.d.update_fdata('ac_bal', self.i, self.init_bal)
+        # Subsequent candles
+        else:
+            events = self.d.fcell('events', self.i, list)
+            cash_transfer = self.EVENT_CASH_IN in events or self.EVENT_CASH_OUT in events
+            ac_bal = self.d.fget('ac_bal', self.i) if cash_transfer else self.d.fget('ac_bal', self.i-1)
+            self.d.update_fdata('ac_bal', self.i, round(ac_bal + self.d.fget('realised_pnl', self.i), 2))
+
+        self.d.update_fdata('net_bal', self.i, round(self.d.fget('ac_bal', self.i) + self.d.fget('unrealised_pnl', self.i), 2))
+        self.d.update_fdata('margin_used', self.i, \
+                            round((self.d.fget('cum_long_position', self.i) +
+                                   self.d.fget('cum_short_position', self.i)) * float(self.d.ticker['marginRate']), 2))
+
+        if self.cash_out_factor is not None:
+            self.d.update_fdata('gross_bal', self.i, round(self.d.fget('ac_bal', self.i) + self.d.fget('cash_bal', self.i), 2))
+        else:
+            self.d.update_fdata('gross_bal', self.i, self.d.fget('ac_bal', self.i))
+
+    def update_events(self, event):
+        events = self.d.fcell_copy('events', self.i, list)
+        if event not in events:
+            events.append(event)
+            self.d.update_fdata('events', self.i, events)
+
+    def margin_call(self):
+        net_bal, margin_used = self.current_ac_values()
+        traded = False
+        if net_bal < margin_used * self.MC_PERCENT:
+            for trade_no in list(self.book('open_longs')):
+                self.close_long(trade_no)
+                traded = True
+
+            for trade_no in list(self.book('open_shorts')):
+                self.close_short(trade_no)
+                traded = True
+
+        if traded:
+            self.update_temp_ac_values()
+            self.update_events(self.EVENT_MC)
+
+    def export(self, rows=None):
+        '''Result frame of this run, see Data.export
+        '''
+        return self.d.export(self.name, rows)
@@ -0,0 +1,486 @@
+'''Compiled bar loop of GridSimulator, selected with GridSimulator(kernel=True)
+The open trades are held in fixed arrays indexed by slot in trade order and every rule of a bar
+(trailing SL, margin call, stop loss, take profit, cash transfer, entry) is a loop over them, so a
+whole run is one call of run() that numba compiles in nopython mode. Without numba the same functions
+run as plain Python, slower than GridSimulator itself, which stays the reference implementation.
+Rounding, the order of float additions and the ledger records follow GridSimulator, results are identical.
+Supported: cover_stopped_loss None and every stop_loss_type but 'max_unrealised_pnl', see supports().
+'''
+from data import TradeLedger
+import numpy as np
+
+try:
+    from numba import njit
+    jit = njit(cache=True)
+except ImportError:
+    njit = None
+    jit = lambda f: f
+
+COMPILED = njit is not None
+STOP_LOSS_TYPES = ('grid_count', 'grid_count_on_margin', 'oldest_on_margin', 'farthest_on_margin',
+                   'max_unrealised_pnl_farthest', 'grid_count_max_unrealised_pnl')
+GRID_COUNT, GRID_COUNT_ON_MARGIN, OLDEST_ON_MARGIN, FARTHEST_ON_MARGIN, MAX_UNREALISED_PNL_FARTHEST, GRID_COUNT_MAX_UNREALISED_PNL = range(6)
+# Events of a bar as bits, in the order GridSimulator appends them
+ADJ, MC, SL, TP, CO, CI, ENT = (1 << k for k in range(7))
+# Output columns of run(), rows of out
+COLS = ('cum_long_position', 'cum_short_position', 'unrealised_pnl', 'realised_pnl', 'ac_bal', 'net_bal', 'margin_used', 'cash_bal', 'gross_bal')
+CUM_LONG, CUM_SHORT, UNREALISED, REALISED, AC_BAL, NET_BAL, MARGIN_USED, CASH_BAL, GROSS_BAL = range(len(COLS))
+# Rows of the prices / points / on_grid inputs
+MID, BID, ASK = 0, 1, 2
+LONG, SHORT = 0, 1
+# Trade fields, floats in trades (side, field, slot) and ints in ints (side, field, slot)
+ENTRY, TP_LEVEL, SL_LEVEL, TSL_LEVEL = 0, 1, 2, 3
+SIZE, POINTS, ON_GRID, ACTIVE = 0, 1, 2, 3
+# Running totals per side as in PositionTotals, totals (side, field)
+TOTAL_SIZE, TOTAL_COST, OFF_GRID, OPEN_TRADES = 0, 1, 2, 3
+# Nearest levels of the open trades, see update_levels()
+LONG_TP, SHORT_TP, LONG_SL, SHORT_SL, LONG_TSL, SHORT_TSL = range(6)
+# Ledger records, ints (record, field) and six values per record in the order of GridSimulator.OPEN_FIELDS / CLOSED_FIELDS,
+# sides are LONG / SHORT until GridSimulator.run_kernel() loads them into its TradeLedger
+BAR, KIND, SIDE, TRADE_NO = 0, 1, 2, 3
+OPEN, CLOSE, ADJUST = TradeLedger.OPEN, TradeLedger.CLOSE, TradeLedger.ADJUST
+# Counters of the run
+RECORDS, BAR_RECORDS, REALISED_POINTS, REALISED_EXACT, DIRTY = range(5)
+
+
+def supports(cover_stopped_loss: str, stop_loss_type: str) -> bool:
+    '''Whether a GridSimulator configuration can run through the kernel
+    Covering of stopped losses and the 'max_unrealised_pnl' loop stay with GridSimulator
+    '''
+    return cover_stopped_loss is None and stop_loss_type in STOP_LOSS_TYPES
+
+
+@jit
+def round_np(value, digits):
+    '''np.round() of a float64
+    '''
+    scale = 10.0 ** digits
+    return np.rint(value * scale) / scale
+
+
+@jit
+def two_product(a, b):
+    '''(a * b, error) with a * b + error the exact product, Dekker's splitting
+    '''
+    c = 134217729.0 * a
+    a_hi = c - (c - a)
+    a_lo = a - a_hi
+    c = 134217729.0 * b
+    b_hi = c - (c - b)
+    b_lo = b - b_hi
+    product = a * b
+    return product, ((a_hi * b_hi - product) + a_hi * b_lo + a_lo * b_hi) + a_lo * b_lo
+
+
+@jit
+def round_py(value, digits):
+    '''round() of a Python float, which rounds the exact binary value
+    np.round() away from a tie, near one the exact value x 2 x 10**digits is compared with the odd integer of the tie
+    '''
+    scale = 10.0 ** digits
+    scaled = value * scale
+    k = np.floor(scaled)
+    if abs(scaled - k - 0.5) >= 1e-6:
+        return np.rint(scaled) / scale
+    product, error = two_product(value, 2.0 * scale)
+    above = (product - (2.0 * k + 1.0)) + error
+    if above > 0 or (above == 0 and k % 2.0 == 1.0):
+        return (k + 1.0) / scale
+    return k / scale
+
+
+@jit
+def round_points(points, scale):
+    '''(value, tie) as data.round_points(), value 0.0 on a tie
+    '''
+    unit = scale // 100
+    if points % unit * 2 == unit:
+        return 0.0, True
+    return ((points + unit // 2) // unit) / 100, False
+
+
+@jit
+def unrealised_pnl(i, prices, points, on_grid, scale, trades, ints, totals, count):
+    '''GridSimulator.unrealised_pnl(), exact in points and the float sum in trade order on a tie or off the grid
+    '''
+    if on_grid[MID, i] and totals[LONG, OFF_GRID] == 0 and totals[SHORT, OFF_GRID] == 0 \
+            and totals[LONG, OPEN_TRADES] + totals[SHORT, OPEN_TRADES] > 0:
+        price_points = points[MID, i]
+        pnl, tie = round_points(totals[LONG, TOTAL_SIZE] * price_points - totals[LONG, TOTAL_COST]
+                                - (totals[SHORT, TOTAL_SIZE] * price_points - totals[SHORT, TOTAL_COST]), scale)
+        if not tie:
+            return pnl
+    price = prices[MID, i]
+    pnl = 0.0
+    for k in range(count):
+        if ints[LONG, ACTIVE, k]:
+            pnl = pnl + ints[LONG, SIZE, k] * (price - trades[LONG, ENTRY, k])
+    for k in range(count):
+        if ints[SHORT, ACTIVE, k]:
+            pnl = pnl + ints[SHORT, SIZE, k] * (trades[SHORT, ENTRY, k] - price)
+    return round_np(pnl, 2)
+
+
+@jit
+def realised_pnl(ledger_ints, ledger_values, counters, scale):
+    '''GridSimulator.realised_pnl() of the trades closed on this bar, longs then shorts in closing order on a tie
+    '''
+    if counters[REALISED_EXACT]:
+        pnl, tie = round_points(counters[REALISED_POINTS], scale)
+        if not tie:
+            return pnl
+    pnl = 0.0
+    for side in range(2):
+        for r in range(counters[BAR_RECORDS], counters[RECORDS]):
+            if ledger_ints[r, KIND] == CLOSE and ledger_ints[r, SIDE] == side:
+                size, entry, exit = ledger_values[r, 0], ledger_values[r, 1], ledger_values[r, 2]
+                pnl = pnl + (size * (exit - entry) if side == LONG else size * (entry - exit))
+    return round_np(pnl, 2)
+
+
+@jit
+def record(i, kind, side, trade_no, values, ledger_ints, ledger_values, counters):
+    r = counters[RECORDS]
+    ledger_ints[r, BAR], ledger_ints[r, KIND], ledger_ints[r, SIDE], ledger_ints[r, TRADE_NO] = i, kind, side, trade_no
+    for f in range(6):
+        ledger_values[r, f] = values[f]
+    counters[RECORDS] = r + 1
+
+
+@jit
+def update_levels(trades, ints, count, levels):
+    '''Lowest long TP, highest short TP, highest long SL / TSL and lowest short SL / TSL, unset levels of 0 left out
+    '''
+    levels[LONG_TP], levels[SHORT_TP], levels[LONG_SL], levels[SHORT_SL] = np.inf, -np.inf, -np.inf, np.inf
+    levels[LONG_TSL], levels[SHORT_TSL] = -np.inf, np.inf
+    for k in range(count):
+        if ints[LONG, ACTIVE, k]:
+            tp, sl, tsl = trades[LONG, TP_LEVEL, k], trades[LONG, SL_LEVEL, k], trades[LONG, TSL_LEVEL, k]
+            if tp != 0 and tp < levels[LONG_TP]:
+                levels[LONG_TP] = tp
+            if sl != 0 and sl > levels[LONG_SL]:
+                levels[LONG_SL] = sl
+            if tsl != 0 and tsl > levels[LONG_TSL]:
+                levels[LONG_TSL] = tsl
+        if ints[SHORT, ACTIVE, k]:
+            tp, sl, tsl = trades[SHORT, TP_LEVEL, k], trades[SHORT, SL_LEVEL, k], trades[SHORT, TSL_LEVEL, k]
+            if tp != 0 and tp > levels[SHORT_TP]:
+                levels[SHORT_TP] = tp
+            if sl != 0 and sl < levels[SHORT_SL]:
+                levels[SHORT_SL] = sl
+            if tsl != 0 and tsl < levels[SHORT_TSL]:
+                levels[SHORT_TSL] = tsl
+
+
+@jit
+def open_trade(i, side, k, size, entry, tp, sl, points, on_grid, trades, ints, totals, trade_nos, ledger_ints, ledger_values, counters):
+    '''Open the trade of side in slot k at the ask (long) or bid (short) of bar i
+    '''
+    quote = ASK if side == LONG else BID
+    trades[side, ENTRY, k], trades[side, TP_LEVEL, k], trades[side, SL_LEVEL, k], trades[side, TSL_LEVEL, k] = entry, tp, sl, 0.0
+    ints[side, SIZE, k], ints[side, ON_GRID, k], ints[side, ACTIVE, k] = size, on_grid[quote, i], 1
+    ints[side, POINTS, k] = points[quote, i] if on_grid[quote, i] else 0
+    totals[side, TOTAL_SIZE] += size
+    totals[side, OPEN_TRADES] += 1
+    if on_grid[quote, i]:
+        totals[side, TOTAL_COST] += size * points[quote, i]
+    else:
+        totals[side, OFF_GRID] += 1
+    counters[DIRTY] = 1
+    record(i, OPEN, side, trade_nos[k], (float(size), entry, tp, sl, 0.0, 0.0), ledger_ints, ledger_values, counters)
+
+
+@jit
+def close_trade(i, side, k, prices, points, on_grid, pip_factor, trades, ints, totals, trade_nos, ledger_ints, ledger_values, counters):
+    '''Close the trade of side in slot k at the bid (long) or ask (short) of bar i, see GridSimulator.close_long() / close_short()
+    '''
+    size, entry = ints[side, SIZE, k], trades[side, ENTRY, k]
+    entry_points, entry_on_grid = ints[side, POINTS, k], ints[side, ON_GRID, k]
+    if side == LONG:
+        exit, exit_points, exit_on_grid = prices[BID, i], points[BID, i], on_grid[BID, i]
+        pips = round_np((prices[ASK, i] - entry) * pip_factor, 1)
+        pnl_points = size * (exit_points - entry_points)
+    else:
+        exit, exit_points, exit_on_grid = prices[ASK, i], points[ASK, i], on_grid[ASK, i]
+        pips = round_np((entry - prices[BID, i]) * pip_factor, 1)
+        pnl_points = size * (entry_points - exit_points)
+    record(i, CLOSE, side, trade_nos[k], (float(size), entry, exit, pips, 0.0, 0.0), ledger_ints, ledger_values, counters)
+    if entry_on_grid and exit_on_grid:
+        counters[REALISED_POINTS] += pnl_points
+    else:
+        counters[REALISED_EXACT] = 0
+
+    ints[side, ACTIVE, k] = 0
+    totals[side, TOTAL_SIZE] -= size
+    totals[side, OPEN_TRADES] -= 1
+    if entry_on_grid:
+        totals[side, TOTAL_COST] -= size * entry_points
+    else:
+        totals[side, OFF_GRID] -= 1
+    counters[DIRTY] = 1
+
+
+@jit
+def update_trailing_sl(i, tp_move, prices, trades, ints, count, trade_nos, ledger_ints, ledger_values, counters):
+    '''GridSimulator.update_trailing_sl(), returns whether any trade was adjusted
+    '''
+    price = prices[MID, i]
+    adjusted = False
+    for side in range(2):
+        for k in range(count):
+            tp = trades[side, TP_LEVEL, k]
+            if not ints[side, ACTIVE, k] or tp == 0 or (tp > price if side == LONG else tp < price):
+                continue
+            entry, tsl = trades[side, ENTRY, k], trades[side, TSL_LEVEL, k]
+            if side == LONG:
+                next_tp = round_py(tp + tp_move, 5)
+                half = round_py(entry + (tp - entry) / 2, 5)
+            else:
+                next_tp = round_py(tp - tp_move, 5)
+                half = round_py(entry - (entry - tp) / 2, 5)
+            trades[side, TP_LEVEL, k] = next_tp
+            trades[side, TSL_LEVEL, k] = half if tsl == 0 else tp
+            record(i, ADJUST, side, trade_nos[k], (float(ints[side, SIZE, k]), entry, next_tp, trades[side, SL_LEVEL, k],
+                                                                0.0, trades[side, TSL_LEVEL, k]), ledger_ints, ledger_values, counters)
+            adjusted = True
+    if adjusted:
+        counters[DIRTY] = 1
+    return adjusted
+
+
+@jit
+def margin_call(i, prices, points, on_grid, pip_factor, trades, ints, totals, count, trade_nos, ledger_ints, ledger_values, counters):
+    '''Close every long, then every short, returns whether any was open
+    '''
+    traded = False
+    for side in range(2):
+        for k in range(count):
+            if ints[side, ACTIVE, k]:
+                close_trade(i, side, k, prices, points, on_grid, pip_factor, trades, ints, totals, trade_nos, ledger_ints, ledger_values, counters)
+                traded = True
+    return traded
+
+
+@jit
+def close_crossed(i, field, prices, points, on_grid, pip_factor, trades, ints, totals, count, trade_nos, ledger_ints, ledger_values, counters):
+    '''Close the longs with field >= price (SL / TSL) or <= price (TP), then the shorts the other way round
+    Unset levels of 0 never close, returns whether any trade was closed
+    '''
+    price = prices[MID, i]
+    traded = False
+    for side in range(2):
+        at_or_above = (side == LONG) != (field == TP_LEVEL)
+        for k in range(count):
+            level = trades[side, field, k]
+            if ints[side, ACTIVE, k] and level != 0 and (level >= price if at_or_above else level <= price):
+                close_trade(i, side, k, prices, points, on_grid, pip_factor, trades, ints, totals, trade_nos, ledger_ints, ledger_values, counters)
+                traded = True
+    return traded
+
+
+@jit
+def stop_loss_oldest(i, prices, points, on_grid, pip_factor, trades, ints, totals, count, trade_nos, ledger_ints, ledger_values, counters):
+    '''GridSimulator.stop_loss_oldest_on_margin() once the margin is hit, the long on a tie as both sides open together
+    '''
+    oldest_long, oldest_short = -1, -1
+    for k in range(count):
+        if oldest_long < 0 and ints[LONG, ACTIVE, k]:
+            oldest_long = k
+        if oldest_short < 0 and ints[SHORT, ACTIVE, k]:
+            oldest_short = k
+    if oldest_long < 0 and oldest_short < 0:
+        return False
+    if oldest_short < 0 or (oldest_long >= 0 and trade_nos[oldest_long] <= trade_nos[oldest_short]):
+        close_trade(i, LONG, oldest_long, prices, points, on_grid, pip_factor, trades, ints, totals, trade_nos, ledger_ints, ledger_values, counters)
+    else:
+        close_trade(i, SHORT, oldest_short, prices, points, on_grid, pip_factor, trades, ints, totals, trade_nos, ledger_ints, ledger_values, counters)
+    return True
+
+
+@jit
+def stop_loss_farthest(i, prices, points, on_grid, pip_factor, trades, ints, totals, count, trade_nos, ledger_ints, ledger_values, counters):
+    '''Long with the highest entry above price or short with the lowest entry below price, whichever is farther,
+    first in trade order on ties, see GridSimulator.farthest_trades()
+    '''
+    price = prices[MID, i]
+    farthest_long, farthest_long_price, farthest_short, farthest_short_price = -1, price, -1, price
+    for k in range(count):
+        if ints[LONG, ACTIVE, k] and trades[LONG, ENTRY, k] > farthest_long_price:
+            farthest_long, farthest_long_price = k, trades[LONG, ENTRY, k]
+        if ints[SHORT, ACTIVE, k] and trades[SHORT, ENTRY, k] < farthest_short_price:
+            farthest_short, farthest_short_price = k, trades[SHORT, ENTRY, k]
+    if farthest_long < 0 and farthest_short < 0:
+        return False
+    if farthest_short < 0 or (farthest_long >= 0 and farthest_long_price - price > price - farthest_short_price):
+        close_trade(i, LONG, farthest_long, prices, points, on_grid, pip_factor, trades, ints, totals, trade_nos, ledger_ints, ledger_values, counters)
+    else:
+        close_trade(i, SHORT, farthest_short, prices, points, on_grid, pip_factor, trades, ints, totals, trade_nos, ledger_ints, ledger_values, counters)
+    return True
+
+
+@jit
+def compact(trades, ints, trade_nos, count):
+    '''Squeeze the closed slots out keeping trade order, returns the new count
+    '''
+    j = 0
+    for k in range(count):
+        if ints[LONG, ACTIVE, k] or ints[SHORT, ACTIVE, k]:
+            if j != k:
+                trades[:, :, j] = trades[:, :, k]
+                ints[:, :, j] = ints[:, :, k]
+                trade_nos[j] = trade_nos[k]
+            j = j + 1
+    ints[:, :, j:count] = 0
+    return j
+
+
+@jit
+def run(prices, points, on_grid, scale, margin_rate, pip_factor, mc_percent, init_bal, init_trade_size, sizing_ratio, dynamic,
+        tp_move, sl_move, stop_loss_type, margin_sl_percent, max_unrealised_pnl, cash_out, cash_out_threshold, trailing, capacity):
+    '''GridSimulator.run_sim() over prices (mid, bid, ask) of shape (3, bars) and their points / on_grid, see data.to_points_array()
+    Returns (out, events, ledger_ints, ledger_values, trades, ints, trade_nos, count, trade_no, next_up_grid, next_down_grid):
+    out rows in the order of COLS, events as bits, the ledger records and the trades open at the end
+    '''
+    bars = prices.shape[1]
+    out = np.full((GROSS_BAL + 1, bars), np.nan)
+    events = np.zeros(bars, dtype=np.uint8)
+    trades = np.zeros((2, 4, capacity))
+    ints = np.zeros((2, 4, capacity), dtype=np.int64)
+    trade_nos = np.zeros(capacity, dtype=np.int64)
+    totals = np.zeros((2, 4), dtype=np.int64)
+    levels = np.zeros(6)
+    ledger_ints = np.zeros((1024, 4), dtype=np.int64)
+    ledger_values = np.zeros((1024, 6))
+    counters = np.zeros(5, dtype=np.int64)
+    count, trade_no = 0, 0
+    next_up_grid, next_down_grid = prices[MID, 0], prices[MID, 0]
+    cash_ac_bal = 0.0
+    update_levels(trades, ints, count, levels)
+
+    for i in range(bars):
+        price = prices[MID, i]
+        # Room for every record a bar can write: adjust and close each open trade, open a pair
+        while len(ledger_ints) - counters[RECORDS] < 4 * count + 2:
+            ledger_ints = np.concatenate((ledger_ints, np.zeros_like(ledger_ints)))
+            ledger_values = np.concatenate((ledger_values, np.zeros_like(ledger_values)))
+        counters[BAR_RECORDS], counters[REALISED_POINTS], counters[REALISED_EXACT] = counters[RECORDS], 0, 1
+        bar_events = 0
+        unrealised = unrealised_pnl(i, prices, points, on_grid, scale, trades, ints, totals, count)
+        realised = 0.0
+
+        if i > 0:
+            if counters[DIRTY]:
+                update_levels(trades, ints, count, levels)
+                counters[DIRTY] = 0
+            if trailing and (price >= levels[LONG_TP] or price <= levels[SHORT_TP]):
+                if update_trailing_sl(i, tp_move, prices, trades, ints, count, trade_nos, ledger_ints, ledger_values, counters):
+                    bar_events |= ADJ
+
+            net_bal = out[AC_BAL, i-1] + realised + unrealised
+            margin_used = float(totals[LONG, TOTAL_SIZE] + totals[SHORT, TOTAL_SIZE]) * margin_rate
+            if net_bal < margin_used * mc_percent:
+                if margin_call(i, prices, points, on_grid, pip_factor, trades, ints, totals, count, trade_nos, ledger_ints, ledger_values, counters):
+                    unrealised = unrealised_pnl(i, prices, points, on_grid, scale, trades, ints, totals, count)
+                    realised = realised_pnl(ledger_ints, ledger_values, counters, scale)
+                    bar_events |= MC
+
+            net_bal = out[AC_BAL, i-1] + realised + unrealised
+            margin_used = float(totals[LONG, TOTAL_SIZE] + totals[SHORT, TOTAL_SIZE]) * margin_rate
+            on_margin = net_bal < margin_used * margin_sl_percent
+            on_max_unrealised_pnl = net_bal * max_unrealised_pnl < -unrealised
+            stopped = False
+            if stop_loss_type == GRID_COUNT or (stop_loss_type == GRID_COUNT_ON_MARGIN and on_margin) \
+                    or (stop_loss_type == GRID_COUNT_MAX_UNREALISED_PNL and on_max_unrealised_pnl):
+                if counters[DIRTY]:
+                    update_levels(trades, ints, count, levels)
+                    counters[DIRTY] = 0
+                if price <= levels[LONG_SL] or price >= levels[SHORT_SL]:
+                    stopped = close_crossed(i, SL_LEVEL, prices, points, on_grid, pip_factor, trades, ints, totals, count, trade_nos,
+                                            ledger_ints, ledger_values, counters)
+            elif stop_loss_type == OLDEST_ON_MARGIN and on_margin:
+                stopped = stop_loss_oldest(i, prices, points, on_grid, pip_factor, trades, ints, totals, count, trade_nos,
+                                           ledger_ints, ledger_values, counters)
+            elif (stop_loss_type == FARTHEST_ON_MARGIN and on_margin) or (stop_loss_type == MAX_UNREALISED_PNL_FARTHEST and on_max_unrealised_pnl):
+                stopped = stop_loss_farthest(i, prices, points, on_grid, pip_factor, trades, ints, totals, count, trade_nos,
+                                             ledger_ints, ledger_values, counters)
+            if stopped:
+                unrealised = unrealised_pnl(i, prices, points, on_grid, scale, trades, ints, totals, count)
+                realised = realised_pnl(ledger_ints, ledger_values, counters, scale)
+                bar_events |= SL
+
+            if counters[DIRTY]:
+                update_levels(trades, ints, count, levels)
+                counters[DIRTY] = 0
+            traded = False
+            if trailing:
+                if price <= levels[LONG_TSL] or price >= levels[SHORT_TSL]:
+                    traded = close_crossed(i, TSL_LEVEL, prices, points, on_grid, pip_factor, trades, ints, totals, count, trade_nos,
+                                           ledger_ints, ledger_values, counters)
+            elif price >= levels[LONG_TP] or price <= levels[SHORT_TP]:
+                traded = close_crossed(i, TP_LEVEL, prices, points, on_grid, pip_factor, trades, ints, totals, count, trade_nos,
+                                       ledger_ints, ledger_values, counters)
+            if traded:
+                unrealised = unrealised_pnl(i, prices, points, on_grid, scale, trades, ints, totals, count)
+                realised = realised_pnl(ledger_ints, ledger_values, counters, scale)
+                bar_events |= TP
+
+            if cash_out:
+                net_bal = out[AC_BAL, i-1] + realised + unrealised
+                out[CASH_BAL, i] = out[CASH_BAL, i-1]
+                if net_bal > cash_out_threshold:
+                    cash = net_bal - cash_out_threshold
+                    cash_ac_bal = round_np(out[AC_BAL, i-1] - cash, 2)
+                    out[CASH_BAL, i] = round_np(out[CASH_BAL, i] + cash, 2)
+                    bar_events |= CO
+                elif (bar_events & (SL | MC)) != 0 and net_bal < cash_out_threshold:
+                    cash = min(cash_out_threshold - net_bal, out[CASH_BAL, i])
+                    if cash > 0:
+                        cash_ac_bal = round_np(out[AC_BAL, i-1] + cash, 2)
+                        out[CASH_BAL, i] = round_np(out[CASH_BAL, i] - cash, 2)
+                        bar_events |= CI
+        elif cash_out:
+            out[CASH_BAL, 0] = 0.0
+
+        # Entry
+        if price >= next_up_grid or price <= next_down_grid:
+            next_up_grid = round_np(price + tp_move, 5)
+            next_down_grid = round_np(price - tp_move, 5)
+            if i == 0:
+                trade_size = init_trade_size
+            else:
+                trade_size = int((out[AC_BAL, i-1] + realised + unrealised) * sizing_ratio) if dynamic else init_trade_size
+            if trade_size > 0:
+                if count == len(trade_nos):
+                    count = compact(trades, ints, trade_nos, count)
+                if count == len(trade_nos):
+                    trades = np.concatenate((trades, np.zeros_like(trades)), axis=2)
+                    ints = np.concatenate((ints, np.zeros_like(ints)), axis=2)
+                    trade_nos = np.concatenate((trade_nos, np.zeros_like(trade_nos)))
+                trade_no = trade_no + 1
+                trade_nos[count] = trade_no
+                open_trade(i, LONG, count, trade_size, prices[ASK, i], next_up_grid, round_np(price - sl_move, 5), points, on_grid,
+                           trades, ints, totals, trade_nos, ledger_ints, ledger_values, counters)
+                open_trade(i, SHORT, count, trade_size, prices[BID, i], next_down_grid, round_np(price + sl_move, 5), points, on_grid,
+                           trades, ints, totals, trade_nos, ledger_ints, ledger_values, counters)
+                count = count + 1
+                unrealised = unrealised_pnl(i, prices, points, on_grid, scale, trades, ints, totals, count)
+                realised = realised_pnl(ledger_ints, ledger_values, counters, scale)
+                bar_events |= ENT
+
+        # update_ac_values()
+        out[CUM_LONG, i] = totals[LONG, TOTAL_SIZE]
+        out[CUM_SHORT, i] = totals[SHORT, TOTAL_SIZE]
+        out[UNREALISED, i] = unrealised
+        out[REALISED, i] = realised
+        if i == 0:
+            ac_bal = init_bal
+        else:
+            ac_bal = round_np((cash_ac_bal if (bar_events & (CI | CO)) != 0 else out[AC_BAL, i-1]) + realised, 2)
+        out[AC_BAL, i] = ac_bal
+        out[NET_BAL, i] = round_np(ac_bal + unrealised, 2)
+        out[MARGIN_USED, i] = round_np((out[CUM_LONG, i] + out[CUM_SHORT, i]) * margin_rate, 2)
+        out[GROSS_BAL, i] = round_np(ac_bal + out[CASH_BAL, i], 2) if cash_out else ac_bal
+        events[i] = bar_events
+
+    n = counters[RECORDS]
+    return out, events, ledger_ints[:n], ledger_values[:n], trades, ints, trade_nos, count, trade_no, next_up_grid, next_down_grid
@@ -0,0 +1,594 @@
+from data import Data, TradeLedger, to_points_array, round_points_array
+from grid_simulator import GridSimulator
+from tqdm import tqdm
+import pandas as pd
+import numpy as np
+
+
+def round_float(values: np.ndarray, digits: int) -> np.ndarray:
+    '''round() of Python floats over an array, np.round except near a tie where the exact decimal value decides
+    '''
+    rounded = np.round(values, digits)
+    scaled = values * 10.0 ** digits
+    for j in np.flatnonzero(np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6).tolist():
+        rounded[j] = round(float(values[j]), digits)
+    return rounded
+
+
+class GridLockstep:
+    '''Many GridSimulator configurations moved through the same bars together
+    The open trades of all configurations are held in arrays shaped (side, configs, slots), slots in trade order,
+    and every rule of a bar (trailing SL, margin call, stop loss, take profit, cash transfer, entry) is applied
+    to all the configurations it concerns with array operations. Bars on which no configuration can trigger
+    anything are filled in bulk, as GridSimulator.skip() does for one.
+    Results are identical to GridSimulator run with the same parameters, see frame() / export().
+    Supported: every stop_loss_type but 'max_unrealised_pnl', cover_stopped_loss None, see supports().
+    '''
+
+    EVENTS = (GridSimulator.EVENT_ADJUST, GridSimulator.EVENT_MC, GridSimulator.EVENT_SL, GridSimulator.EVENT_TP,
+              GridSimulator.EVENT_CASH_OUT, GridSimulator.EVENT_CASH_IN, GridSimulator.EVENT_ENTRY)
+    ADJ, MC, SL, TP, CO, CI, ENT = (1 << k for k in range(len(EVENTS)))
+    STOP_LOSS_TYPES = ('grid_count', 'grid_count_on_margin', 'oldest_on_margin', 'farthest_on_margin',
+                       'max_unrealised_pnl_farthest', 'grid_count_max_unrealised_pnl')
+    LONG, SHORT = 0, 1
+    SIDES = (TradeLedger.LONG, TradeLedger.SHORT)
+    NUMERIC_COLS = ('cum_long_position', 'cum_short_position', 'unrealised_pnl', 'realised_pnl', 'ac_bal', 'net_bal',
+                    'margin_used', 'uncovered_pip_position', 'cash_bal', 'gross_bal')
+    SKIP_ROWS, SKIP_MAX_ROWS = 4, 8192
+
+    def __init__(
+            self,
+            name: str,
+            df: pd.DataFrame,
+            instruments: str,
+            ticker: str,
+            configs: list,
+            names: list=None,
+            capacity: int=64):
+        '''configs: GridSimulator parameters of each configuration as a dict
+        names: simulation name of each configuration, default {name}-{k}
+        '''
+        for k, config in enumerate(configs):
+            if not self.supports(config):
+                raise ValueError(f'Configuration {k} is not supported by GridLockstep, run it with GridSimulator: {config}')
+
+        self.name = name
+        self.configs = configs
+        self.names = names if names is not None else [f'{name}-{k}' for k in range(len(configs))]
+        self.n = len(configs)
+
+        self.d = Data(
+            source=df,
+            ticker=ticker,
+            cols=['time', 'mid_c', 'bid_c', 'ask_c'],
+            instruments=instruments
+        )
+        self.datalen = self.d.datalen
+        self.scale = self.d.price_scale()
+        self.margin_rate = float(self.d.ticker['marginRate'])
+        pip = pow(10, self.d.ticker['pipLocation'])
+        self.pip_factor = pow(10, -self.d.ticker['pipLocation'])
+
+        self.mid, self.bid, self.ask = (self.d.df['raw'][col].to_numpy() for col in ('mid_c', 'bid_c', 'ask_c'))
+        self.mid_points, self.mid_on_grid = to_points_array(self.mid, self.scale)
+        self.bid_points, self.bid_on_grid = to_points_array(self.bid, self.scale)
+        self.ask_points, self.ask_on_grid = to_points_array(self.ask, self.scale)
+
+        # Parameters, one value per configuration, computed as GridSimulator does with Python numbers
+        param = lambda f, dtype=np.float64: np.array([f(c) for c in configs], dtype=dtype)
+        none_nan = lambda v: np.nan if v is None else v
+        self.init_bal = param(lambda c: c['init_bal'])
+        self.init_trade_size = param(lambda c: c['init_trade_size'], np.int64)
+        self.sizing_ratio = param(lambda c: c['init_trade_size'] / c['init_bal'])
+        self.dynamic = param(lambda c: c['sizing'] == 'dynamic', bool)
+        self.tp_move = param(lambda c: c['grid_pips'] * pip)
+        self.sl_move = param(lambda c: c['grid_pips'] * c['sl_grid_count'] * pip)
+        self.margin_sl_percent = param(lambda c: none_nan(c['margin_sl_percent']))
+        self.max_unrealised_pnl = param(lambda c: none_nan(c['max_unrealised_pnl']))
+        self.cash_out = param(lambda c: c['cash_out_factor'] is not None, bool)
+        self.cash_out_threshold = param(lambda c: np.nan if c['cash_out_factor'] is None else c['init_bal'] * c['cash_out_factor'])
+        self.trailing = param(lambda c: bool(c['trailing_sl']), bool)
+        stop_loss_type = np.array([c['stop_loss_type'] for c in configs], dtype=object)
+        self.grid_count = stop_loss_type == 'grid_count'
+        self.grid_count_on_margin = stop_loss_type == 'grid_count_on_margin'
+        self.grid_count_max_unrealised_pnl = stop_loss_type == 'grid_count_max_unrealised_pnl'
+        self.oldest_on_margin = stop_loss_type == 'oldest_on_margin'
+        self.farthest_on_margin = stop_loss_type == 'farthest_on_margin'
+        self.max_unrealised_pnl_farthest = stop_loss_type == 'max_unrealised_pnl_farthest'
+        self.on_margin = self.grid_count_on_margin | self.oldest_on_margin | self.farthest_on_margin
+        self.on_max_unrealised_pnl = self.grid_count_max_unrealised_pnl | self.max_unrealised_pnl_farthest
+
+        # Open trades, slot k of a configuration holds its long and short opened together, slots in trade order
+        shape = (2, self.n, capacity)
+        self.size = np.zeros(shape, dtype=np.int64)
+        self.entry_price, self.tp, self.sl, self.tsl = (np.zeros(shape) for _ in range(4))
+        self.entry_points = np.zeros(shape, dtype=np.int64)
+        self.entry_on_grid = np.zeros(shape, dtype=bool)
+        self.active = np.zeros(shape, dtype=bool)
+        self.trade_nos = np.zeros((self.n, capacity), dtype=np.int64)
+        self.count = np.zeros(self.n, dtype=np.int64)
+        # Running totals per side as in PositionTotals
+        self.total_size = np.zeros((2, self.n), dtype=np.int64)
+        self.total_cost = np.zeros((2, self.n), dtype=np.int64)
+        self.off_grid = np.zeros((2, self.n), dtype=np.int64)
+
+        self.trade_no = np.zeros(self.n, dtype=np.int64)
+        self.next_up_grid = np.zeros(self.n)
+        self.next_down_grid = np.zeros(self.n)
+        # Nearest levels of the open trades, only ever looser than the trades while a bar closes some, see trigger_levels()
+        self.levels = {level: np.zeros(self.n) for level in ('long_tp', 'short_tp', 'long_sl', 'short_sl', 'long_tsl', 'short_tsl')}
+        self.up, self.down = np.full(self.n, np.inf), np.full(self.n, -np.inf)
+
+        # Values of the bar being simulated, as the temp values GridSimulator keeps in the bar's row
+        self.unrealised = np.zeros(self.n)
+        self.realised = np.zeros(self.n)
+        self.realised_points = np.zeros(self.n, dtype=np.int64)
+        self.realised_exact = np.ones(self.n, dtype=bool)
+        self.cash_ac_bal = np.zeros(self.n)
+        self.bar_events = np.zeros(self.n, dtype=np.uint8)
+        self.closes = []
+
+        self.out = {col: np.full((self.n, self.datalen), np.nan) for col in self.NUMERIC_COLS}
+        self.events = np.zeros((self.n, self.datalen), dtype=np.uint8)
+        # Ledger records of all configurations, split into one TradeLedger each by finish()
+        self.records = []
+        self.ledgers = None
+
+    @classmethod
+    def supports(cls, config: dict) -> bool:
+        '''Whether a GridSimulator configuration can run in lockstep
+        Covering of stopped losses and the 'max_unrealised_pnl' loop stay with GridSimulator
+        '''
+        return config['cover_stopped_loss'] is None and config['stop_loss_type'] in cls.STOP_LOSS_TYPES
+
+    def record(self, i: int, kind: int, side: int, rows: np.ndarray, slots: np.ndarray, values: list):
+        if len(rows) > 0:
+            self.records.append((rows, np.full(len(rows), i), kind, self.SIDES[side], self.trade_nos[rows, slots],
+                                 np.column_stack(values + [np.zeros(len(rows))] * (6 - len(values)))))
+
+    def current_ac_values(self, i: int, rows: np.ndarray) -> tuple:
+        ac_bal = self.out['ac_bal'][rows, i-1] + self.realised[rows]
+        margin_used = (self.total_size[self.LONG, rows] + self.total_size[self.SHORT, rows]).astype(np.float64) * self.margin_rate
+        net_bal = ac_bal + self.unrealised[rows]
+        return net_bal, margin_used
+
+    def unrealised_pnls(self, start: int, end: int, rows: np.ndarray) -> np.ndarray:
+        '''unrealised_pnl of rows at bars [start, end), shape (bars, rows)
+        Exact in points while the prices and entries are on the points grid, ties at half a cent and
+        anything off the grid are summed as floats in trade order like GridSimulator.unrealised_pnl()
+        '''
+        points = (self.total_size[self.LONG, rows] - self.total_size[self.SHORT, rows])[None, :] * self.mid_points[start:end, None] \
+            - (self.total_cost[self.LONG, rows] - self.total_cost[self.SHORT, rows])[None, :]
+        pnl, ties = round_points_array(points, self.scale)
+        exact = (self.off_grid[self.LONG, rows] == 0) & (self.off_grid[self.SHORT, rows] == 0)
+        slow = ties | ~self.mid_on_grid[start:end, None] | ~exact[None, :]
+        if slow.any():
+            bars, j = np.nonzero(slow)
+            c, prices = rows[j], self.mid[start + bars, None]
+            # Closed slots add 0.0, which leaves every partial sum as it is
+            values = np.concatenate((np.where(self.active[self.LONG, c], self.size[self.LONG, c] * (prices - self.entry_price[self.LONG, c]), 0.0),
+                                     np.where(self.active[self.SHORT, c], self.size[self.SHORT, c] * (self.entry_price[self.SHORT, c] - prices), 0.0)), axis=1)
+            pnl[bars, j] = np.round(values.cumsum(axis=1)[:, -1], 2)
+        return pnl
+
+    def realised_pnl(self, rows: np.ndarray) -> np.ndarray:
+        '''realised_pnl of rows for the trades closed on this bar, see GridSimulator.realised_pnl()
+        '''
+        pnl, ties = round_points_array(self.realised_points[rows], self.scale)
+        for j in np.flatnonzero(ties | ~self.realised_exact[rows]).tolist():
+            c = rows[j]
+            terms = [values[closed == c] for side in (self.LONG, self.SHORT) for s, closed, values in self.closes if s == side]
+            pnl[j] = np.round(np.concatenate([[0.0]] + terms).cumsum()[-1], 2)
+        return pnl
+
+    def update_temp_ac_values(self, i: int, rows: np.ndarray):
+        if len(rows) > 0:
+            self.unrealised[rows] = self.unrealised_pnls(i, i+1, rows)[0]
+            self.realised[rows] = self.realised_pnl(rows)
+
+    def trigger_levels(self, rows: np.ndarray):
+        '''Nearest TP / SL / TSL of the open trades of rows in self.levels, and up / down, see GridSimulator.trigger_levels()
+        '''
+        long, short = self.LONG, self.SHORT
+        active = self.active[:, rows]
+        level = lambda side, field, reduce, fill: reduce(np.where(active[side] & (field[side, rows] != 0), field[side, rows], fill), axis=1)
+        levels = self.levels
+        levels['long_tp'][rows] = level(long, self.tp, np.min, np.inf)
+        levels['short_tp'][rows] = level(short, self.tp, np.max, -np.inf)
+        levels['long_sl'][rows] = level(long, self.sl, np.max, -np.inf)
+        levels['short_sl'][rows] = level(short, self.sl, np.min, np.inf)
+        levels['long_tsl'][rows] = level(long, self.tsl, np.max, -np.inf)
+        levels['short_tsl'][rows] = level(short, self.tsl, np.min, np.inf)
+        self.up[rows] = np.minimum.reduce([self.next_up_grid[rows], levels['long_tp'][rows], levels['short_sl'][rows], levels['short_tsl'][rows]])
+        self.down[rows] = np.maximum.reduce([self.next_down_grid[rows], levels['short_tp'][rows], levels['long_sl'][rows], levels['long_tsl'][rows]])
+
+    def triggers(self, start: int, end: int, unrealised_pnl: np.ndarray) -> np.ndarray:
+        '''(bars, configs) mask of the bars in [start, end) on which a configuration can trigger anything, see GridSimulator.skip()
+        '''
+        prices = self.mid[start:end, None]
+        prev_ac_bal = np.round(self.out['ac_bal'][:, start-1] + 0.0, 2)[None, :].repeat(end - start, axis=0)
+        prev_ac_bal[0] = self.out['ac_bal'][:, start-1]
+        net_bal = prev_ac_bal + 0.0 + unrealised_pnl
+        margin_used = (self.total_size[self.LONG] + self.total_size[self.SHORT]).astype(np.float64) * self.margin_rate
+        triggers = (prices >= self.up) | (prices <= self.down) | (net_bal < margin_used * GridSimulator.MC_PERCENT)
+        triggers |= self.on_margin & (net_bal < margin_used * self.margin_sl_percent)
+        triggers |= self.on_max_unrealised_pnl & (net_bal * self.max_unrealised_pnl < -unrealised_pnl)
+        triggers |= self.cash_out & (net_bal > self.cash_out_threshold)
+        return triggers
+
+    def carry(self, start: int, end: int, rows: np.ndarray, unrealised_pnl: np.ndarray):
+        '''Fill bars [start, end) of rows that trigger nothing, unrealised_pnl of shape (bars, rows)
+        '''
+        if end <= start or len(rows) == 0:
+            return
+        out = self.out
+        unrealised_pnl = unrealised_pnl.T
+        prev_ac_bal = np.round(out['ac_bal'][rows, start-1] + 0.0, 2)[:, None].repeat(end - start, axis=1)
+        prev_ac_bal[:, 0] = out['ac_bal'][rows, start-1]
+        ac_bal = np.round(prev_ac_bal + 0.0, 2)
+        cum_long, cum_short = self.total_size[self.LONG, rows], self.total_size[self.SHORT, rows]
+        cols = rows, slice(start, end)
+        out['cum_long_position'][cols] = cum_long[:, None]
+        out['cum_short_position'][cols] = cum_short[:, None]
+        out['unrealised_pnl'][cols] = unrealised_pnl
+        out['realised_pnl'][cols] = 0
+        out['ac_bal'][cols] = ac_bal
+        out['net_bal'][cols] = np.round(ac_bal + unrealised_pnl, 2)
+        out['margin_used'][cols] = np.round((cum_long + cum_short).astype(np.float64) * self.margin_rate, 2)[:, None]
+        cash_bal = out['cash_bal'][rows, start-1][:, None]
+        out['cash_bal'][cols] = cash_bal
+        out['gross_bal'][cols] = np.where(self.cash_out[rows, None], np.round(ac_bal + cash_bal, 2), ac_bal)
+
+    def grow(self, rows: np.ndarray):
+        '''Room for one more slot in each of rows, closed slots are squeezed out first, keeping trade order
+        '''
+        for c in rows[self.count[rows] == self.trade_nos.shape[1]].tolist():
+            order = np.argsort(~(self.active[self.LONG, c] | self.active[self.SHORT, c]), kind='stable')
+            for col in (self.size, self.entry_price, self.tp, self.sl, self.tsl, self.entry_points, self.entry_on_grid, self.active):
+                col[:, c] = col[:, c, order]
+            self.trade_nos[c] = self.trade_nos[c, order]
+            self.count[c] = np.count_nonzero(self.active[self.LONG, c] | self.active[self.SHORT, c])
+        if self.count[rows].max(initial=0) == self.trade_nos.shape[1]:
+            extend = lambda col: np.concatenate((col, np.zeros_like(col)), axis=-1)
+            self.size, self.entry_price, self.tp, self.sl, self.tsl = map(extend, (self.size, self.entry_price, self.tp, self.sl, self.tsl))
+            self.entry_points, self.entry_on_grid, self.active = map(extend, (self.entry_points, self.entry_on_grid, self.active))
+            self.trade_nos = extend(self.trade_nos)
+
+    def open(self, i: int, side: int, rows: np.ndarray, slots: np.ndarray, size: np.ndarray, entry: float, tp: np.ndarray, sl: np.ndarray):
+        entry_points, on_grid = (self.ask_points[i], self.ask_on_grid[i]) if side == self.LONG else (self.bid_points[i], self.bid_on_grid[i])
+        self.size[side, rows, slots] = size
+        self.entry_price[side, rows, slots] = entry
+        self.tp[side, rows, slots] = tp
+        self.sl[side, rows, slots] = sl
+        self.tsl[side, rows, slots] = 0
+        self.entry_points[side, rows, slots] = entry_points
+        self.entry_on_grid[side, rows, slots] = on_grid
+        self.active[side, rows, slots] = True
+        self.total_size[side, rows] += size
+        if on_grid:
+            self.total_cost[side, rows] += size * entry_points
+        else:
+            self.off_grid[side, rows] += 1
+        self.record(i, TradeLedger.OPEN, side, rows, slots, [size, np.full(len(rows), entry), tp, sl])
+
+    def close(self, i: int, side: int, rows: np.ndarray, slots: np.ndarray):
+        '''Close the trades at (rows, slots), given in trade order within each configuration
+        '''
+        if len(rows) == 0:
+            return
+        size, entry = self.size[side, rows, slots], self.entry_price[side, rows, slots]
+        entry_points, entry_on_grid = self.entry_points[side, rows, slots], self.entry_on_grid[side, rows, slots]
+        if side == self.LONG:
+            exit, exit_points, exit_on_grid = self.bid[i], self.bid_points[i], self.bid_on_grid[i]
+            pips = np.round((self.ask[i] - entry) * self.pip_factor, 1)
+            pnl, points = size * (exit - entry), size * (exit_points - entry_points)
+        else:
+            exit, exit_points, exit_on_grid = self.ask[i], self.ask_points[i], self.ask_on_grid[i]
+            pips = np.round((entry - self.bid[i]) * self.pip_factor, 1)
+            pnl, points = size * (entry - exit), size * (entry_points - exit_points)
+        self.record(i, TradeLedger.CLOSE, side, rows, slots, [size, entry, np.full(len(rows), exit), pips])
+        self.active[side, rows, slots] = False
+
+        np.add.at(self.realised_points, rows, points)
+        self.realised_exact[rows[~entry_on_grid | ~exit_on_grid]] = False
+        self.closes.append((side, rows, pnl))
+        np.subtract.at(self.total_size[side], rows, size)
+        np.subtract.at(self.total_cost[side], rows[entry_on_grid], (size * entry_points)[entry_on_grid])
+        np.subtract.at(self.off_grid[side], rows[~entry_on_grid], 1)
+
+    def close_where(self, i: int, side: int, rows: np.ndarray, mask: np.ndarray) -> np.ndarray:
+        '''Close the trades of rows where mask (rows, slots), returns whether each row closed any
+        '''
+        traded = mask.any(axis=1)
+        if traded.any():
+            r, slots = np.nonzero(mask)
+            self.close(i, side, rows[r], slots)
+        return traded
+
+    def close_one(self, i: int, rows: np.ndarray, long_slot: np.ndarray, short_slot: np.ndarray, close_long: np.ndarray):
+        self.close(i, self.LONG, rows[close_long], long_slot[close_long])
+        self.close(i, self.SHORT, rows[~close_long], short_slot[~close_long])
+
+    def update_events(self, rows: np.ndarray, event: int):
+        self.bar_events[rows] |= event
+
+    def update_trailing_sl(self, i: int, rows: np.ndarray):
+        price = self.mid[i]
+        rows = rows[self.trailing[rows] & ((price >= self.levels['long_tp'][rows]) | (price <= self.levels['short_tp'][rows]))]
+        adjusted = np.zeros(len(rows), dtype=bool)
+        for side in (self.LONG, self.SHORT):
+            tp = self.tp[side, rows]
+            crossed = self.active[side, rows] & ((tp <= price) if side == self.LONG else (tp >= price))
+            if not crossed.any():
+                continue
+            r, slots = np.nonzero(crossed)
+            c = rows[r]
+            tp, entry, tsl = self.tp[side, c, slots], self.entry_price[side, c, slots], self.tsl[side, c, slots]
+            if side == self.LONG:
+                next_tp = round_float(tp + self.tp_move[c], 5)
+                half = round_float(entry + (tp - entry) / 2, 5)
+            else:
+                next_tp = round_float(tp - self.tp_move[c], 5)
+                half = round_float(entry - (entry - tp) / 2, 5)
+            self.tp[side, c, slots] = next_tp
+            self.tsl[side, c, slots] = np.where(tsl == 0, half, tp)
+            self.record(i, TradeLedger.ADJUST, side, c, slots, [self.size[side, c, slots], entry, next_tp, self.sl[side, c, slots],
+                                                                  np.zeros(len(c)), self.tsl[side, c, slots]])
+            adjusted |= crossed.any(axis=1)
+        self.update_events(rows[adjusted], self.ADJ)
+        self.trigger_levels(rows[adjusted])
+
+    def margin_call(self, i: int, rows: np.ndarray):
+        net_bal, margin_used = self.current_ac_values(i, rows)
+        rows = rows[net_bal < margin_used * GridSimulator.MC_PERCENT]
+        if len(rows) == 0:
+            return
+        traded = self.close_where(i, self.LONG, rows, self.active[self.LONG, rows])
+        traded |= self.close_where(i, self.SHORT, rows, self.active[self.SHORT, rows])
+        self.update_temp_ac_values(i, rows[traded])
+        self.update_events(rows[traded], self.MC)
+
+    def stop_loss_grid_count(self, i: int, rows: np.ndarray) -> np.ndarray:
+        '''Every long with SL >= price, then every short with SL <= price, returns the rows that closed any
+        '''
+        price = self.mid[i]
+        rows = rows[(price <= self.levels['long_sl'][rows]) | (price >= self.levels['short_sl'][rows])]
+        traded = self.close_where(i, self.LONG, rows, self.active[self.LONG, rows] & (self.sl[self.LONG, rows] >= price))
+        traded |= self.close_where(i, self.SHORT, rows, self.active[self.SHORT, rows] & (self.sl[self.SHORT, rows] <= price))
+        return rows[traded]
+
+    def stop_loss_oldest(self, i: int, rows: np.ndarray) -> np.ndarray:
+        '''Oldest trade of each row, the long on a tie as both sides open together
+        '''
+        long_open, short_open = self.active[self.LONG, rows], self.active[self.SHORT, rows]
+        has_long, has_short = long_open.any(axis=1), short_open.any(axis=1)
+        long_slot, short_slot = long_open.argmax(axis=1), short_open.argmax(axis=1)
+        traded = has_long | has_short
+        close_long = has_long & (~has_short | (self.trade_nos[rows, long_slot] <= self.trade_nos[rows, short_slot]))
+        self.close_one(i, rows[traded], long_slot[traded], short_slot[traded], close_long[traded])
+        return rows[traded]
+
+    def stop_loss_farthest(self, i: int, rows: np.ndarray) -> np.ndarray:
+        '''Long with the highest entry above price or short with the lowest entry below price, whichever is farther
+        '''
+        price = self.mid[i]
+        long_entry = np.where(self.active[self.LONG, rows], self.entry_price[self.LONG, rows], -np.inf)
+        short_entry = np.where(self.active[self.SHORT, rows], self.entry_price[self.SHORT, rows], np.inf)
+        long_slot, short_slot = long_entry.argmax(axis=1), short_entry.argmin(axis=1)
+        long_price = long_entry[np.arange(len(rows)), long_slot]
+        short_price = short_entry[np.arange(len(rows)), short_slot]
+        has_long, has_short = long_price > price, short_price < price
+        traded = has_long | has_short
+        close_long = has_long & (~has_short | (long_price - price > price - short_price))
+        self.close_one(i, rows[traded], long_slot[traded], short_slot[traded], close_long[traded])
+        return rows[traded]
+
+    def stop_loss(self, i: int, rows: np.ndarray):
+        net_bal, margin_used = self.current_ac_values(i, rows)
+        on_margin = net_bal < margin_used * self.margin_sl_percent[rows]
+        on_max_unrealised_pnl = net_bal * self.max_unrealised_pnl[rows] < -self.unrealised[rows]
+        groups = (
+            (self.stop_loss_grid_count, self.grid_count[rows] | (self.grid_count_on_margin[rows] & on_margin)
+                | (self.grid_count_max_unrealised_pnl[rows] & on_max_unrealised_pnl)),
+            (self.stop_loss_oldest, self.oldest_on_margin[rows] & on_margin),
+            (self.stop_loss_farthest, (self.farthest_on_margin[rows] & on_margin) | (self.max_unrealised_pnl_farthest[rows] & on_max_unrealised_pnl))
+        )
+        stopped = [close(i, rows[due]) for close, due in groups if due.any()]
+        if stopped:
+            stopped = np.sort(np.concatenate(stopped))
+            self.update_temp_ac_values(i, stopped)
+            self.update_events(stopped, self.SL)
+
+    def take_profit(self, i: int, rows: np.ndarray):
+        '''TP of the trades, or their TSL once set with trailing_sl
+        '''
+        price = self.mid[i]
+        levels = self.levels
+        rows = rows[np.where(self.trailing[rows], (price <= levels['long_tsl'][rows]) | (price >= levels['short_tsl'][rows]),
+                             (price >= levels['long_tp'][rows]) | (price <= levels['short_tp'][rows]))]
+        if len(rows) == 0:
+            return
+        trailing = self.trailing[rows, None]
+        long, short = self.LONG, self.SHORT
+        longs = np.where(trailing, (self.tsl[long, rows] != 0) & (self.tsl[long, rows] >= price), self.tp[long, rows] <= price)
+        shorts = np.where(trailing, (self.tsl[short, rows] != 0) & (self.tsl[short, rows] <= price), self.tp[short, rows] >= price)
+        traded = self.close_where(i, long, rows, self.active[long, rows] & longs)
+        traded |= self.close_where(i, short, rows, self.active[short, rows] & shorts)
+        self.update_temp_ac_values(i, rows[traded])
+        self.update_events(rows[traded], self.TP)
+
+    def cash_transfer(self, i: int, rows: np.ndarray):
+        rows = rows[self.cash_out[rows]]
+        if len(rows) == 0:
+            return
+        net_bal, _ = self.current_ac_values(i, rows)
+        prev_ac_bal, cash_bal = self.out['ac_bal'][rows, i-1], self.out['cash_bal'][rows, i-1]
+        threshold = self.cash_out_threshold[rows]
+        stop_loss = (self.bar_events[rows] & (self.SL | self.MC)) != 0
+        self.out['cash_bal'][rows, i] = cash_bal
+
+        out = net_bal > threshold
+        cash_out = net_bal[out] - threshold[out]
+        self.cash_ac_bal[rows[out]] = np.round(prev_ac_bal[out] - cash_out, 2)
+        self.out['cash_bal'][rows[out], i] = np.round(cash_bal[out] + cash_out, 2)
+        self.update_events(rows[out], self.CO)
+
+        cash_in = np.minimum(threshold - net_bal, cash_bal)
+        deposit = ~out & stop_loss & (net_bal < threshold) & (cash_in > 0)
+        self.cash_ac_bal[rows[deposit]] = np.round(prev_ac_bal[deposit] + cash_in[deposit], 2)
+        self.out['cash_bal'][rows[deposit], i] = np.round(cash_bal[deposit] - cash_in[deposit], 2)
+        self.update_events(rows[deposit], self.CI)
+
+    def entry(self, i: int, rows: np.ndarray) -> np.ndarray:
+        '''Returns the rows that moved to a next grid
+        '''
+        price = self.mid[i]
+        rows = rows[(price >= self.next_up_grid[rows]) | (price <= self.next_down_grid[rows])]
+        moved = rows
+        long_tp = np.round(price + self.tp_move[rows], 5)
+        short_tp = np.round(price - self.tp_move[rows], 5)
+        self.next_up_grid[rows] = long_tp
+        self.next_down_grid[rows] = short_tp
+
+        if i == 0:
+            trade_size = self.init_trade_size[rows]
+        else:
+            net_bal, _ = self.current_ac_values(i, rows)
+            trade_size = np.where(self.dynamic[rows], np.trunc(net_bal * self.sizing_ratio[rows]), self.init_trade_size[rows]).astype(np.int64)
+        trade = trade_size > 0
+        rows, trade_size, long_tp, short_tp = rows[trade], trade_size[trade], long_tp[trade], short_tp[trade]
+        if len(rows) == 0:
+            return moved
+        self.trade_no[rows] += 1
+        long_sl = np.round(price - self.sl_move[rows], 5)
+        short_sl = np.round(price + self.sl_move[rows], 5)
+        self.grow(rows)
+        slots = self.count[rows]
+        self.count[rows] += 1
+        self.trade_nos[rows, slots] = self.trade_no[rows]
+        self.open(i, self.LONG, rows, slots, trade_size, self.ask[i], long_tp, long_sl)
+        self.open(i, self.SHORT, rows, slots, trade_size, self.bid[i], short_tp, short_sl)
+        self.update_temp_ac_values(i, rows)
+        self.update_events(rows, self.ENT)
+        return moved
+
+    def update_ac_values(self, i: int, rows: np.ndarray):
+        out = self.out
+        cum_long, cum_short = self.total_size[self.LONG, rows], self.total_size[self.SHORT, rows]
+        out['cum_long_position'][rows, i] = cum_long
+        out['cum_short_position'][rows, i] = cum_short
+        out['unrealised_pnl'][rows, i] = self.unrealised[rows]
+        out['realised_pnl'][rows, i] = self.realised[rows]
+        if i == 0:
+            ac_bal = self.init_bal[rows]
+        else:
+            cash_transfer = (self.bar_events[rows] & (self.CI | self.CO)) != 0
+            ac_bal = np.round(np.where(cash_transfer, self.cash_ac_bal[rows], out['ac_bal'][rows, i-1]) + self.realised[rows], 2)
+        out['ac_bal'][rows, i] = ac_bal
+        out['net_bal'][rows, i] = np.round(ac_bal + self.unrealised[rows], 2)
+        out['margin_used'][rows, i] = np.round((cum_long.astype(np.float64) + cum_short) * self.margin_rate, 2)
+        out['gross_bal'][rows, i] = np.where(self.cash_out[rows], np.round(ac_bal + out['cash_bal'][rows, i], 2), ac_bal)
+        self.events[rows, i] = self.bar_events[rows]
+
+    def simulate(self, i: int, rows: np.ndarray, unrealised_pnl: np.ndarray=None):
+        '''One bar of GridSimulator.run_sim() for rows, unrealised_pnl of rows at the bar with the trades carried over
+        '''
+        self.realised_points[rows] = 0
+        self.realised_exact[rows] = True
+        self.realised[rows] = 0.0
+        self.bar_events[rows] = 0
+        self.closes = []
+        if i == 0:
+            self.trade_no[rows] = 0
+            self.next_up_grid[rows] = self.mid[0]
+            self.next_down_grid[rows] = self.mid[0]
+            self.out['cash_bal'][rows[self.cash_out[rows]], 0] = 0
+        else:
+            self.unrealised[rows] = unrealised_pnl
+            self.update_trailing_sl(i, rows)
+            self.margin_call(i, rows)
+            self.stop_loss(i, rows)
+            self.take_profit(i, rows)
+            self.cash_transfer(i, rows)
+        moved = self.entry(i, rows)
+        self.update_ac_values(i, rows)
+        # Trigger levels move with the trades and the next grid, cash transfers leave them
+        changed = (self.bar_events[rows] & (self.ADJ | self.MC | self.SL | self.TP)) != 0
+        self.trigger_levels(np.union1d(rows[changed], moved))
+
+    def run_sim(self):
+        '''Simulate all configurations over all bars, then build their ledgers, see frame() / export()
+        Between the bars that trigger something for some configuration, all configurations are filled in bulk;
+        on such a bar only the configurations it triggers are simulated, the others are carried over.
+        '''
+        everyone = np.arange(self.n)
+        progress = tqdm(total=self.datalen, desc=" Simulating... ")
+        self.simulate(0, everyone)
+        progress.update(1)
+        i, rows = 1, self.SKIP_ROWS
+        while i < self.datalen:
+            end = min(i + rows, self.datalen)
+            unrealised_pnl = self.unrealised_pnls(i, end, everyone)
+            triggers = self.triggers(i, end, unrealised_pnl)
+            hit = triggers.any(axis=1)
+            n = int(hit.argmax()) if hit.any() else end - i
+            self.carry(i, i + n, everyone, unrealised_pnl[:n])
+            if n < end - i:
+                triggered = triggers[n]
+                self.carry(i + n, i + n + 1, everyone[~triggered], unrealised_pnl[n:n+1, ~triggered])
+                self.simulate(i + n, everyone[triggered], unrealised_pnl[n, triggered])
+                n = n + 1
+                rows = 2 * n
+            else:
+                rows = min(rows * 2, self.SKIP_MAX_ROWS)
+            progress.update(n)
+            i = i + n
+        progress.close()
+        self.finish()
+
+    def finish(self):
+        '''One TradeLedger per configuration from the records of the run
+        '''
+        self.ledgers = [TradeLedger(fields=GridSimulator.OPEN_FIELDS, closed_fields=GridSimulator.CLOSED_FIELDS) for _ in range(self.n)]
+        if not self.records:
+            return
+        rows = np.concatenate([r[0] for r in self.records])
+        lengths = [len(r[0]) for r in self.records]
+        state = dict(
+            bar=np.concatenate([r[1] for r in self.records]),
+            kind=np.repeat(np.array([r[2] for r in self.records], dtype=np.int8), lengths),
+            side=np.repeat(np.array([r[3] for r in self.records], dtype=np.int8), lengths),
+            trade_no=np.concatenate([r[4] for r in self.records]),
+            parent=np.full(len(rows), -1, dtype=np.int64),
+            values=np.concatenate([r[5] for r in self.records]).astype(np.float64)
+        )
+        order = np.argsort(rows, kind='stable')
+        bounds = np.searchsorted(rows[order], np.arange(self.n + 1))
+        for c, ledger in enumerate(self.ledgers):
+            part = order[bounds[c]:bounds[c+1]]
+            ledger.load_state({attr: col[part] for attr, col in state.items()})
+
+    def frame(self, k: int) -> pd.DataFrame:
+        '''Component dataframe of configuration k in self.d, laid out as GridSimulator's, views over the result arrays
+        '''
+        name = self.names[k]
+        if name not in self.d.df:
+            columns = {col: self.d.df['raw'][col].to_numpy() for col in ('time', 'mid_c', 'bid_c', 'ask_c')}
+            # The trade book columns are only placeholders, export() rebuilds them from the ledger
+            for col in Data.LEDGER_COLUMNS:
+                columns[col] = np.full(self.datalen, np.nan, dtype=object)
+            columns['events'] = np.full(self.datalen, np.nan, dtype=object)
+            for j in np.flatnonzero(self.events[k]).tolist():
+                columns['events'][j] = [event for bit, event in enumerate(self.EVENTS) if self.events[k, j] >> bit & 1]
+            for col in self.NUMERIC_COLS:
+                columns[col] = self.out[col][k]
+            self.d.df[name] = pd.DataFrame(columns, copy=False)
+            self.d.offsets[name] = 0
+            self.d.ledgers[name] = self.ledgers[k]
+        return self.d.df[name]
+
+    def export(self, k: int, rows: np.ndarray=None) -> pd.DataFrame:
+        '''Result of configuration k as GridSimulator.d.export() returns it
+        '''
+        self.frame(k)
+        return self.d.export(self.names[k], rows)
@@ -1,9 +1,31 @@
 from grid_simulator import GridSimulator
+from grid_lockstep import GridLockstep
+import grid_simulator
+import grid_lockstep
+import grid_engine
+import grid_kernel
+import data
+from data import read_candles, time_window, save_result, SharedCandles, ResultsStore, ResultCache
+from parameter_space import ParameterSpace
 from tabulate import tabulate
+import multiprocessing
+from numpy import isnan, inf
+from math import ceil
 import pandas as pd
 
+# Parameters GridSimulator never reads for a configuration, GridOptimizer(prune=True) runs these with their first value only
+IRRELEVANT = dict(
+    cover_sl_ratio=lambda p: p['cover_stopped_loss'] is None,
+    margin_sl_percent=lambda p: p['cover_stopped_loss'] is None and
+                                p['stop_loss_type'] not in ('grid_count_on_margin', 'oldest_on_margin', 'farthest_on_margin'),
+    max_unrealised_pnl=lambda p: p['stop_loss_type'] not in ('max_unrealised_pnl', 'max_unrealised_pnl_farthest', 'grid_count_max_unrealised_pnl')
+)
+
 class GridOptimizer:
 
+    SHARED_COLS = ['time', 'mid_c', 'bid_c', 'ask_c']
+    INPUTS_HEADER = ['sim_name', 'config_id', 'init_trade_size', 'grid_pips', 'stop_loss_type', 'sl_grid_count', 'stoploss_pips', 'margin_sl_percent', 'sizing', 'cash_out_factor', 'covered_sl', 'cover_sl_ratio', 'max_unrealised_pnl', 'trailing_sl', 'gross_bal']
+
     def __init__(
             self,
             checkpoint: int,
@@ -30,7 +52,29 @@ class GridOptimizer:
             instruments: str,
             out_path: str,
             inputs_file: str,
-            dummyrun: bool):
+            dummyrun: bool,
+            shared: dict=None,
+            lockstep: int=None,
+            workers: int=None,
+            prune: bool=False,
+            shard: tuple=None,
+            results_file: str=None,
+            cache: str=None,
+            cache_gb: float=10,
+            halving_bars: int=None,
+            halving_keep: float=0.5,
+            halving_metric='gross_bal'):
+        '''lockstep: run the configurations GridLockstep supports that many at a time, see process_batch()
+        workers: run the configurations on a pool of that many processes, see run_pool()
+        prune: skip the configurations that only differ from one already run in parameters GridSimulator ignores, see IRRELEVANT
+        shard: (index, count), run only shard index of count, e.g. one per machine, see ParameterSpace.in_shard()
+        results_file: SQLite file in out_path the inputs rows are appended to instead of rewriting the inputs file, see ResultsStore
+        cache: directory of the ResultCache of the runs, looked up before simulating a configuration, at most cache_gb large
+        halving_bars: search by successive halving from rounds of that many bars, see run_halving()
+        halving_keep: fraction of the configurations ranked best by halving_metric that go on to the next round
+        halving_metric: column whose value at the last bar ranks a configuration, the higher the better, or a function of the
+        simulation dataframe (a module level one with workers)
+        '''
         
         self.dummyrun = dummyrun
         self.checkpoint = checkpoint
@@ -58,6 +102,27 @@ class GridOptimizer:
         self.out_path = out_path
         self.inputs_file = inputs_file
         self.inputs_list = list()
+        self.shared = shared
+        self.lockstep = lockstep
+        self.workers = workers
+        self.prune = prune
+        self.shard = shard
+        self.results_file = results_file
+        self.store = None if results_file is None else ResultsStore(out_path + results_file, ['ticker', 'frequency'] + self.INPUTS_HEADER)
+        self.halving_bars = halving_bars
+        self.halving_keep = halving_keep
+        self.halving_metric = halving_metric
+        self.cache = None if cache is None else ResultCache(cache, int(cache_gb * 2**30))
+        if cache is not None:
+            # A change to any of these (or to the instruments) makes new keys, see cache_key()
+            modules = [grid_simulator, grid_lockstep, grid_engine, grid_kernel, data]
+            self.version = ResultCache.file_hash([module.__file__ for module in modules] + [instruments])
+        # Hash of the candles of each (ticker, frequency)
+        self.data_keys = dict()
+        self.batch = list()
+        # Set in the pool workers: the candles of the current (ticker, frequency), nothing but results files written
+        self.frames = dict()
+        self.worker = False
     
     def __repr__(self) -> str:
         return str(
@@ -83,21 +148,92 @@ class GridOptimizer:
                 data_path = self.data_path,
                 instruments = self.instruments,
                 out_path = self.out_path,
-                inputs_file = self.inputs_file  
+                inputs_file = self.inputs_file,
+                lockstep = self.lockstep,
+                workers = self.workers,
+                prune = self.prune,
+                shard = self.shard,
+                results_file = self.results_file,
+                cache = None if self.cache is None else self.cache.path,
+                halving_bars = self.halving_bars,
+                halving_keep = self.halving_keep,
+                halving_metric = self.halving_metric
             )
         )
 
     def read_data(self, ticker: str, frequency: str):
-        df = pd.read_pickle(f"{self.data_path}{ticker}_{frequency}.pkl")
+        df = read_candles(self.data_path, ticker, frequency)
         return df
     
-    def save_files(self, inputs_df, ticker, frequency):
-        result = self.sim.d.df[self.sim.name].copy()
-        if 'events' in self.records:
-            result[~result.events.isnull()].to_csv(f'{self.out_path}{self.sim.name}-events.csv', index=False)
+    def share_data(self) -> dict:
+        '''Load each (ticker, frequency) window once into shared memory, see SharedCandles
+        Pass self.shared to the optimizers of the worker processes (shared=), they attach to the blocks instead of reading the data.
+        Returns the blocks, close() them when the workers are done.
+        '''
+        blocks = dict()
+        for tk in self.tickers:
+            for f in self.frequency:
+                blocks[(tk, f)] = SharedCandles(time_window(self.read_data(tk, f), self.start, self.end), cols=self.SHARED_COLS)
+        self.shared = {key: block.spec for key, block in blocks.items()}
+        return blocks
+
+    def window(self, ticker: str, frequency: str) -> pd.DataFrame:
+        '''Candles of the run, attached read-only from shared memory when the parent shared them
+        '''
+        if self.shared is not None and (ticker, frequency) in self.shared:
+            return SharedCandles.attach(self.shared[(ticker, frequency)])
+        return time_window(self.read_data(ticker, frequency), self.start, self.end)
+
+    def result(self, d, name: str) -> pd.DataFrame:
+        '''Rows of simulation name in d that are kept: every bar with 'all' in records, else the event rows
+        '''
         if 'all' in self.records:
-            result.to_csv(f'{self.out_path}{self.sim.name}-all.csv', index=False)
-        inputs_df.to_csv(f'{self.out_path}{ticker}-{frequency}-' + self.inputs_file, index=False)
+            return d.export(name)
+        return d.export(name, rows=d.df[name].events.notna().to_numpy())
+
+    def save_files(self, inputs_df, ticker, frequency, d=None, name=None, result=None):
+        '''Results of simulation name in d (self.sim by default) or in its result() frame, returns that frame
+        '''
+        name = self.sim.name if name is None else name
+        if result is None and (self.records or self.cache is not None):
+            result = self.result(self.sim.d if d is None else d, name)
+        if result is not None:
+            events = result[result.events.notna()] if 'all' in self.records else result
+            if 'npz' in self.records:
+                save_result(events, f'{self.out_path}{name}-events.npz')
+            if 'events' in self.records:
+                events.to_csv(f'{self.out_path}{name}-events.csv', index=False)
+            if 'all' in self.records:
+                result.to_csv(f'{self.out_path}{name}-all.csv', index=False)
+        if inputs_df is not None:
+            inputs_df.to_csv(f'{self.out_path}{ticker}-{frequency}-' + self.inputs_file, index=False)
+        return result
+
+    def cache_key(self, df: pd.DataFrame, ticker: str, frequency: str, params: dict) -> str:
+        '''Hash of the candles, the simulator code and instruments, ticker, records and params with the ones GridSimulator ignores
+        as None, so a configuration is found again by any sweep over the same candles
+        '''
+        if (ticker, frequency) not in self.data_keys:
+            self.data_keys[(ticker, frequency)] = ResultCache.data_hash(df, self.SHARED_COLS)
+        params = {param: None if param in IRRELEVANT and IRRELEVANT[param](params) else value for param, value in params.items()}
+        return ResultCache.key(self.data_keys[(ticker, frequency)], self.version, ticker, 'all' in self.records, params)
+
+    def cached(self, df: pd.DataFrame, ticker: str, frequency: str, params: dict) -> tuple:
+        '''(result() frame, gross_bal) of a configuration run before, None when it is not in the cache
+        '''
+        if self.cache is None:
+            return None
+        hit = self.cache.get(self.cache_key(df, ticker, frequency, params))
+        return None if hit is None else (hit[0], hit[1]['gross_bal'])
+
+    def save_cached(self, name: str, ticker: str, frequency: str, params: dict, hit: tuple):
+        result, gross_bal = hit
+        self.save_files(self.add_inputs(self.inputs(name, ticker, frequency, params, gross_bal), ticker, frequency), ticker, frequency,
+                        name=name, result=result)
+
+    def cache_result(self, df: pd.DataFrame, ticker: str, frequency: str, params: dict, result: pd.DataFrame, gross_bal: float):
+        if self.cache is not None:
+            self.cache.put(self.cache_key(df, ticker, frequency, params), result, dict(gross_bal=float(gross_bal)))
 
     def process_sim(self, 
                     df: pd.DataFrame,
@@ -118,6 +254,14 @@ class GridOptimizer:
                     trailing_sl: float):
         
         sim_name = f'{ticker}-{frequency}-{self.counter}'
+        params = dict(init_bal=init_bal, init_trade_size=init_trade_size, grid_pips=grid_pips, sl_grid_count=sl_grid_count,
+                      stop_loss_type=stop_loss_type, margin_sl_percent=margin_sl_percent, sizing=sizing, cash_out_factor=cash_out_factor,
+                      cover_stopped_loss=cover_stopped_loss, cover_sl_ratio=cover_sl_ratio, max_unrealised_pnl=max_unrealised_pnl,
+                      trailing_sl=trailing_sl)
+        hit = self.cached(df, ticker, frequency, params)
+        if hit is not None:
+            self.save_cached(sim_name, ticker, frequency, params, hit)
+            return
 
         self.sim = GridSimulator(
             name=sim_name,
@@ -145,61 +289,283 @@ class GridOptimizer:
         def inputs_list():
             gross_bal = self.sim.d.df[self.sim.name].iloc[-1]['gross_bal']
             # covered_sl_martingale = 'martingale' if martingale_sizing else 'covered_sl' if cover_stopped_loss else None
-            header = ['sim_name', 'init_trade_size', 'grid_pips', 'stop_loss_type', 'sl_grid_count', 'stoploss_pips', 'margin_sl_percent', 'sizing', 'cash_out_factor', 'covered_sl', 'cover_sl_ratio', 'max_unrealised_pnl', 'trailing_sl', 'gross_bal']
-            inputs = [sim_name, init_trade_size, grid_pips, stop_loss_type, sl_grid_count, grid_pips * sl_grid_count, margin_sl_percent, sizing, cash_out_factor, cover_stopped_loss, cover_sl_ratio, max_unrealised_pnl, trailing_sl, gross_bal]
-            print(tabulate([inputs], header, tablefmt='plain'))
-            self.inputs_list.append(inputs)
-            return pd.DataFrame(self.inputs_list, columns=header)
+            return self.add_inputs(self.inputs(sim_name, ticker, frequency, params, gross_bal), ticker, frequency)
 
         try:
             # header = ['sim_name', 'init_trade_size', 'grid_pips', 'stop_loss_type', 'sl_grid_count', 'stoploss_pips', 'margin_sl_percent', 'sizing', 'cash_out_factor', 'cover_stopped_loss', 'ac_bal']
             self.sim.run_sim()
             # self.inputs_list[-1][-1] = ac_bal
             # inputs_df.iloc[-1, -1] = ac_bal
-            self.save_files(inputs_list(), ticker, frequency)
+            result = self.save_files(inputs_list(), ticker, frequency)
+            self.cache_result(df, ticker, frequency, params, result, self.sim.d.df[self.sim.name].iloc[-1]['gross_bal'])
         except Exception as e:
             self.save_files(inputs_list(), ticker, frequency)
             raise e
 
 
+    def add_inputs(self, inputs: list, ticker: str, frequency: str) -> pd.DataFrame:
+        '''The inputs of the run so far to write to the inputs file, None when the row went to the results store or to the parent
+        of this pool worker
+        '''
+        if self.worker:
+            self.inputs_list.append(inputs)
+            return None
+        print(tabulate([inputs], self.INPUTS_HEADER, tablefmt='plain'))
+        if self.store is not None:
+            self.store.append([ticker, frequency] + inputs)
+            return None
+        self.inputs_list.append(inputs)
+        return pd.DataFrame(self.inputs_list, columns=self.INPUTS_HEADER)
+
+    def process_batch(self, df: pd.DataFrame, ticker: str, frequency: str):
+        '''Run the queued (counter, params) configurations not in the cache together through GridLockstep, results saved in counter
+        order as process_sim() does
+        '''
+        if not self.batch:
+            return
+        batch, self.batch = self.batch, list()
+        names = [f'{ticker}-{frequency}-{counter}' for counter, _ in batch]
+        hits = [self.cached(df, ticker, frequency, params) for _, params in batch]
+        # Position in the lockstep run of the configurations not in the cache
+        runs = {k: j for j, k in enumerate(k for k, hit in enumerate(hits) if hit is None)}
+        if runs:
+            sim = GridLockstep(name=f'{ticker}-{frequency}', df=df, instruments=self.instruments, ticker=ticker,
+                               configs=[batch[k][1] for k in runs], names=[names[k] for k in runs])
+            sim.run_sim()
+        for k, (name, (_, p)) in enumerate(zip(names, batch)):
+            if hits[k] is not None:
+                self.save_cached(name, ticker, frequency, p, hits[k])
+                continue
+            gross_bal = sim.frame(runs[k]).iloc[-1]['gross_bal']
+            result = self.save_files(self.add_inputs(self.inputs(name, ticker, frequency, p, gross_bal), ticker, frequency), ticker, frequency, sim.d, name)
+            self.cache_result(df, ticker, frequency, p, result, gross_bal)
+
+    def inputs(self, name: str, ticker: str, frequency: str, params: dict, gross_bal: float) -> list:
+        '''Row of the inputs file, INPUTS_HEADER order
+        '''
+        p = params
+        config_id = ParameterSpace.config_id(dict(ticker=ticker, frequency=frequency, **p))
+        return [name, config_id, p['init_trade_size'], p['grid_pips'], p['stop_loss_type'], p['sl_grid_count'], p['grid_pips'] * p['sl_grid_count'],
+                p['margin_sl_percent'], p['sizing'], p['cash_out_factor'], p['cover_stopped_loss'], p['cover_sl_ratio'],
+                p['max_unrealised_pnl'], p['trailing_sl'], gross_bal]
+
+    def run_sim(self, df: pd.DataFrame, ticker: str, frequency: str, params: dict):
+        '''One configuration, queued for process_batch() when lockstep is on and GridLockstep supports it
+        '''
+        if self.lockstep and GridLockstep.supports(params):
+            self.batch.append((self.counter, params))
+            if len(self.batch) >= self.lockstep:
+                self.process_batch(df, ticker, frequency)
+        else:
+            # Keep the results in counter order
+            self.process_batch(df, ticker, frequency)
+            self.process_sim(df=df, ticker=ticker, frequency=frequency, **params)
+
+    def parameter_space(self) -> ParameterSpace:
+        '''The sweep, counter order is its order. With prune or shard set, the configurations skipped still take their counter.
+        '''
+        return ParameterSpace(
+            dict(
+                ticker=self.tickers,
+                frequency=self.frequency,
+                init_bal=self.init_bal,
+                init_trade_size=self.init_trade_size,
+                sizing=self.sizing,
+                grid_pips=self.grid_pips,
+                cash_out_factor=self.cash_out_factor,
+                stop_loss_type=self.stop_loss_type,
+                margin_sl_percent=self.margin_sl_percent,
+                sl_grid_count=self.sl_grid_count,
+                cover_stopped_loss=self.cover_stopped_loss,
+                cover_sl_ratio=self.cover_sl_ratio,
+                # martingale_sizing=self.martigale_sizing,
+                max_unrealised_pnl=self.max_unrealised_pnl,
+                trailing_sl=self.trailing_sl
+            ),
+            irrelevant=IRRELEVANT if self.prune else None,
+            shard=self.shard
+        )
+
+    def configurations(self):
+        '''(counter, ticker, frequency, params) of every configuration of parameter_space() from the checkpoint on, in counter order
+        '''
+        counter, space = self.counter, self.parameter_space()
+        for index, params in space.items():
+            self.counter = counter + index
+            if self.counter >= self.checkpoint:
+                tk, f = params.pop('ticker'), params.pop('frequency')
+                yield self.counter, tk, f, params
+        self.counter = counter + space.size
+
+    def jobs(self, configurations: list=None) -> list:
+        '''(ticker, frequency, [(counter, params), ...]) units of work of run_pool() in counter order
+        Runs of configurations GridLockstep supports are cut into batches of lockstep, any other configuration is a job of its own.
+        configurations: (counter, ticker, frequency, params) to run, all of configurations() by default
+        '''
+        jobs = list()
+        for counter, tk, f, params in self.configurations() if configurations is None else configurations:
+            job = jobs[-1] if jobs else None
+            batch = self.lockstep and GridLockstep.supports(params)
+            if batch and job is not None and job[:2] == (tk, f) and job[3] and len(job[2]) < self.lockstep:
+                job[2].append((counter, params))
+            else:
+                jobs.append((tk, f, [(counter, params)], batch))
+        return [(tk, f, configs) for tk, f, configs, _ in jobs]
+
+    def run_job(self, ticker: str, frequency: str, configs: list) -> tuple:
+        '''Simulate configs [(counter, params), ...] in a pool worker, returns (inputs rows, [(counter, error), ...])
+        Results files are written here, the inputs file by the parent. A configuration that fails gets a gross_bal of None,
+        a lockstep batch that fails is run again one by one.
+        '''
+        if (ticker, frequency) not in self.frames:
+            # One (ticker, frequency) at a time, jobs come in ticker order
+            self.frames = {(ticker, frequency): self.window(ticker, frequency)}
+        df = self.frames[(ticker, frequency)]
+        self.inputs_list, errors = list(), list()
+        if len(configs) > 1:
+            try:
+                self.batch = list(configs)
+                self.process_batch(df, ticker, frequency)
+                return self.inputs_list, errors
+            except Exception:
+                self.batch, self.inputs_list = list(), list()
+        for counter, params in configs:
+            self.counter = counter
+            rows = len(self.inputs_list)
+            try:
+                self.process_sim(df=df, ticker=ticker, frequency=frequency, **params)
+            except Exception as e:
+                if len(self.inputs_list) == rows:
+                    self.inputs_list.append(self.inputs(f'{ticker}-{frequency}-{counter}', ticker, frequency, params, None))
+                self.inputs_list[-1][-1] = None
+                errors.append((counter, repr(e)))
+        return self.inputs_list, errors
+
+    def run_pool(self, configurations: list=None):
+        '''run_optimizer() on self.workers processes, of configurations only when given, see jobs()
+        The candles are shared once by this process (share_data) unless shared was given, each worker attaches to them once.
+        Results come back and the inputs file is written in counter order, failed configurations are reported and skipped.
+        '''
+        jobs = self.jobs(configurations)
+        blocks = self.share_data() if self.shared is None else dict()
+        errors = list()
+        try:
+            with multiprocessing.Pool(self.workers, initializer=init_worker, initargs=(self,)) as pool:
+                for (tk, f, _), (rows, failed) in zip(jobs, pool.imap(run_job, jobs)):
+                    for row in rows:
+                        inputs_df = self.add_inputs(row, tk, f)
+                    if inputs_df is not None:
+                        inputs_df.to_csv(f'{self.out_path}{tk}-{f}-' + self.inputs_file, index=False)
+                    for counter, error in failed:
+                        print(f'{tk}-{f}-{counter} failed: {error}')
+                    errors = errors + failed
+        finally:
+            for block in blocks.values():
+                block.close()
+        if errors:
+            print(f'{len(errors)} of {sum(len(configs) for _, _, configs in jobs)} configurations failed')
+        return errors
+
+    def score(self, frame: pd.DataFrame) -> float:
+        '''halving_metric of a simulation dataframe, NaN ranks last
+        '''
+        value = self.halving_metric(frame) if callable(self.halving_metric) else frame[self.halving_metric].iloc[-1]
+        return -inf if value is None or isnan(value) else value
+
+    def scores(self, df: pd.DataFrame, ticker: str, frequency: str, configurations: list) -> dict:
+        '''{counter: score()} of the configurations simulated over df, nothing saved, lockstep batches as in run_sim()
+        '''
+        scores = dict()
+        batch = [(counter, params) for counter, _, _, params in configurations if self.lockstep and GridLockstep.supports(params)]
+        for start in range(0, len(batch), self.lockstep or 1):
+            part = batch[start:start + self.lockstep]
+            sim = GridLockstep(name=f'{ticker}-{frequency}', df=df, instruments=self.instruments, ticker=ticker,
+                               configs=[params for _, params in part], names=[f'{ticker}-{frequency}-{counter}' for counter, _ in part])
+            sim.run_sim()
+            for k, (counter, _) in enumerate(part):
+                scores[counter] = self.score(sim.frame(k))
+        for counter, _, _, params in configurations:
+            if counter not in scores:
+                sim = GridSimulator(name=f'{ticker}-{frequency}-{counter}', df=df, instruments=self.instruments, ticker=ticker, **params)
+                sim.run_sim()
+                scores[counter] = self.score(sim.d.df[sim.name])
+        return scores
+
+    def run_halving(self):
+        '''Successive halving: the configurations of each (ticker, frequency) are simulated over the first halving_bars of the
+        window and ranked by halving_metric, the best halving_keep of them simulated again over 1 / halving_keep times more
+        bars and so on. The configurations left when the rounds reach the whole window run as run_optimizer() runs them,
+        results, names and cache the same as in a full sweep. The rounds and the bar evaluations saved are printed.
+        '''
+        survivors, rounds, evaluated, full = list(), list(), 0, 0
+        groups = dict()
+        for counter, tk, f, params in self.configurations():
+            groups.setdefault((tk, f), list()).append((counter, tk, f, params))
+        for (tk, f), group in groups.items():
+            df = self.window(tk, f)
+            full = full + len(df) * len(group)
+            bars = self.halving_bars
+            while bars < len(df) and len(group) > 1:
+                scores = self.scores(df.iloc[:bars], tk, f, group)
+                keep = sorted(group, key=lambda c: scores[c[0]], reverse=True)[:ceil(len(group) * self.halving_keep)]
+                rounds.append([f'{tk}-{f}', bars, len(group), len(keep), max(scores.values())])
+                evaluated = evaluated + bars * len(group)
+                group = sorted(keep, key=lambda c: c[0])
+                bars = int(bars / self.halving_keep)
+            evaluated = evaluated + len(df) * len(group)
+            survivors = survivors + group
+        metric = getattr(self.halving_metric, '__name__', self.halving_metric)
+        print(tabulate(rounds, ['window', 'bars', 'configurations', 'kept', f'best {metric}'], tablefmt='plain'))
+        print(f'{len(survivors)} configurations on the whole window, {evaluated} bar evaluations of {full} '
+              f'({1 - evaluated / full:.1%} saved)' if full else 'No configurations')
+        if self.workers:
+            return self.run_pool(survivors)
+        df, current = None, None
+        for counter, tk, f, params in survivors:
+            if (tk, f) != current:
+                if current is not None:
+                    self.process_batch(df, *current)
+                df, current = self.window(tk, f), (tk, f)
+            self.counter = counter
+            self.run_sim(df, tk, f, params)
+        if current is not None:
+            self.process_batch(df, *current)
+
     def run_optimizer(self):
-        for tk in self.tickers:
-            for f in self.frequency:
-                df = self.read_data(tk, f).iloc[self.start:self.end]
-                for ib in self.init_bal:
-                    for t in self.init_trade_size:
-                        for s in self.sizing:
-                            for g in self.grid_pips:
-                                for c in self.cash_out_factor:
-                                    for sl in self.stop_loss_type:
-                                        for mslp in self.margin_sl_percent:
-                                            for slgc in self.sl_grid_count:
-                                                for csl in self.cover_stopped_loss:
-                                                    for cslr in self.cover_sl_ratio:
-                                                        for pnl in self.max_unrealised_pnl:
-                                                            # for ms in self.martigale_sizing:
-                                                            for tsl in self.trailing_sl:
-                                                                if self.counter >= self.checkpoint:
-                                                                    # if not (ms and csl):
-                                                                    if not self.dummyrun:
-                                                                        self.process_sim(
-                                                                            df=df,
-                                                                            ticker=tk,
-                                                                            frequency=f,
-                                                                            init_bal=ib,
-                                                                            init_trade_size=t,
-                                                                            grid_pips=g,
-                                                                            sl_grid_count=slgc,
-                                                                            stop_loss_type=sl,
-                                                                            margin_sl_percent=mslp,
-                                                                            sizing=s,
-                                                                            cash_out_factor=c,
-                                                                            cover_stopped_loss=csl,
-                                                                            cover_sl_ratio=cslr,
-                                                                            # martingale_sizing=ms,
-                                                                            max_unrealised_pnl=pnl,
-                                                                            trailing_sl=tsl
-                                                                        )  
-                                                                self.counter =  self.counter + 1
-        if self.dummyrun:
-            print(f'{self.counter-1} dummies run successfully')
+        '''The sweep from the checkpoint on, the rows still buffered for the results store are written however it ends
+        '''
+        try:
+            if self.halving_bars and not self.dummyrun:
+                return self.run_halving()
+            if self.workers and not self.dummyrun:
+                return self.run_pool()
+            df, current, runs = None, None, 0
+            for counter, tk, f, params in self.configurations():
+                runs = runs + 1
+                if (tk, f) != current:
+                    if current is not None:
+                        self.process_batch(df, *current)
+                    df, current = self.window(tk, f), (tk, f)
+                if not self.dummyrun:
+                    self.run_sim(df, tk, f, params)
+            if current is not None:
+                self.process_batch(df, *current)
+            if self.dummyrun:
+                print(f'{self.counter-1} dummies run successfully, {runs} configurations to simulate')
+        finally:
+            if self.store is not None:
+                self.store.close()
+
+
+# GridOptimizer of a pool worker process, see GridOptimizer.run_pool()
+worker = None
+
+
+def init_worker(optimizer: GridOptimizer):
+    global worker
+    worker = optimizer
+    worker.worker = True
+
+
+def run_job(job: tuple) -> tuple:
+    return worker.run_job(*job)
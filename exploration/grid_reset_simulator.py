@@ -1,9 +1,10 @@
-from data import Data
+from data import Data, LevelIndex
+from grid_engine import GridEngine
 from tqdm import trange
 import pandas as pd
 from collections import deque
 
-class GridSimulator:
+class GridSimulator(GridEngine):
 
     EVENT_TP, EVENT_SL, EVENT_MC, EVENT_ENTRY, EVENT_TSL_ADJUST, EVENT_ENT_FAIL  = 'TP', 'SL', 'MC', 'ENT', 'TSLADJ', 'EFAIL'
     EVENT_CASH_IN, EVENT_CASH_OUT =  'CI', 'CO'
@@ -53,7 +54,7 @@ class GridSimulator:
         self.grid_reset = grid_reset
 
         self.d = Data(
-            source=df.copy(),
+            source=df,
             ticker=ticker,
             cols=['time', 'mid_c', 'bid_c', 'ask_c'],
             instruments=instruments
@@ -88,176 +89,27 @@ class GridSimulator:
 
         self.d.prepare_fast_data(name=name, add_cols=add_cols)
 
-    def get_open_longs(self, i: int=None):
-        i = self.i if i is None else i
-        return self.d.to_dict_of_dicts('open_longs', self.OPEN_KEYS, i)
-    
-    def get_open_shorts(self, i: int=None):
-        i = self.i if i is None else i
-        return self.d.to_dict_of_dicts('open_shorts', self.OPEN_KEYS, i)
-    
-    def get_closed_longs(self, i: int=None):
-        i = self.i if i is None else i
-        return self.d.to_dict_of_dicts('closed_longs', self.CLOSED_KEYS, i)
-    
-    def get_closed_shorts(self, i: int=None):
-        i = self.i if i is None else i
-        return self.d.to_dict_of_dicts('closed_shorts', self.CLOSED_KEYS, i)
-    
-    def update_open_longs(self, open_longs: dict):
-        open_longs_tuple = dict()
-        for trade_no, trade in open_longs.items():
-            open_longs_tuple[trade_no] = tuple(trade.values())
-        self.d.update_fdata('open_longs', self.i, open_longs_tuple)
+        # Open trades by entry, kept in step with the open_longs / open_shorts cells
+        self.long_entries, self.short_entries = LevelIndex(), LevelIndex()
 
-    def update_open_shorts(self, open_shorts: dict):
-        open_shorts_tuple = dict()
-        for trade_no, trade in open_shorts.items():
-            open_shorts_tuple[trade_no] = tuple(trade.values())
-        self.d.update_fdata('open_shorts', self.i, open_shorts_tuple)
-
-    def update_closed_longs(self, closed_longs: dict):
-        closed_longs_tuple = dict()
-        for trade_no, trade in closed_longs.items():
-            closed_longs_tuple[trade_no] = tuple(trade.values())
-        self.d.update_fdata('closed_longs', self.i, closed_longs_tuple)
-
-    def update_closed_shorts(self, closed_shorts: dict):
-        closed_shorts_tuple = dict()
-        for trade_no, trade in closed_shorts.items():
-            closed_shorts_tuple[trade_no] = tuple(trade.values())
-        self.d.update_fdata('closed_shorts', self.i, closed_shorts_tuple)
-    
-    def cum_long_position(self):
-        open_longs = self.get_open_longs()
-        cum_long_position = 0
-        for _, trade in open_longs.items():
-            cum_long_position = cum_long_position + trade['SIZE']
-        return cum_long_position
+    def carry_strategy_values(self):
+        self.d.update_fdata('moves_hist', self.i, self.d.fdata('moves_hist', self.i-1))
+        self.d.update_fdata('up_moves_ratio', self.i, self.d.fdata('up_moves_ratio', self.i-1))
+        self.d.update_fdata('down_moves_ratio', self.i, self.d.fdata('down_moves_ratio', self.i-1))
+        self.d.update_fdata('grid_trades_long', self.i, self.d.fdata('grid_trades_long', self.i-1))
+        self.d.update_fdata('grid_trades_short', self.i, self.d.fdata('grid_trades_short', self.i-1))
 
-    def cum_short_position(self):
-        open_shorts = self.get_open_shorts()
-        cum_short_position = 0
-        for _, trade in open_shorts.items():
-            cum_short_position = cum_short_position + trade['SIZE']
-        return cum_short_position
+    def update_strategy_values(self):
+        moves = self.d.fdata('moves_hist', self.i)
+        up_moves, down_moves = moves.count(self.EVENT_UP), moves.count(self.EVENT_DOWN)
+        self.d.update_fdata(f'up_moves_ratio', self.i, round(up_moves / len(moves), 2))
+        self.d.update_fdata(f'down_moves_ratio', self.i, round(down_moves / len(moves), 2))
 
-    def unrealised_pnl(self):
-        open_longs = self.get_open_longs()
-        open_shorts = self.get_open_shorts()
-        pnl = 0
-        for _, trade in open_longs.items():
-            pnl = pnl + trade['SIZE'] * (self.d.fdata('mid_c', self.i) - trade['ENT'])
-        for _, trade in open_shorts.items():
-            pnl = pnl + trade['SIZE'] * (trade['ENT'] - self.d.fdata('mid_c', self.i))
-        return round(pnl, 2)
-    
-    def realised_pnl(self):
-        closed_longs = self.get_closed_longs()
-        closed_shorts = self.get_closed_shorts()
-        pnl = 0
-        for _, trade in closed_longs.items():
-            pnl = pnl + trade['SIZE'] * (trade['EXIT'] - trade['ENT'])
-        for _, trade in closed_shorts.items():
-            pnl = pnl + trade['SIZE'] * (trade['ENT'] - trade['EXIT'])
-        return round(pnl, 2)
-    
-    def cash_transfer(self):
-        _, net_bal, _ = self.current_ac_values()
-        if self.cash_out_factor is not None:
-            self.d.update_fdata('cash_bal', self.i, self.d.fdata('cash_bal', self.i-1))
-            cash_out_threshold = self.init_bal * self.cash_out_factor
-            events = self.d.fdata('events', self.i) if type(self.d.fdata('events', self.i)) == list else list()
-            stop_loss = self.EVENT_SL in events or self.EVENT_MC in events
-            # Cash out / withdraw
-            if net_bal > cash_out_threshold:
-                cash_out = net_bal - cash_out_threshold
-                self.d.update_fdata('ac_bal', self.i, round(self.d.fdata('ac_bal', self.i-1) - cash_out, 2))
-                self.d.update_fdata('cash_bal', self.i, round(self.d.fdata('cash_bal', self.i) + cash_out, 2))
-                self.update_events(self.EVENT_CASH_OUT)
-                return cash_out
-            # Deposit money into a/c when net_bal < cash_out_threshold
-            elif stop_loss and net_bal < cash_out_threshold:
-                cash_in = min(cash_out_threshold - net_bal, self.d.fdata('cash_bal', self.i))
-                if cash_in > 0:
-                    self.d.update_fdata('ac_bal', self.i, round(self.d.fdata('ac_bal', self.i-1) + cash_in, 2))
-                    self.d.update_fdata('cash_bal', self.i, round(self.d.fdata('cash_bal', self.i) - cash_in, 2))
-                    self.update_events(self.EVENT_CASH_IN)    
-                    return cash_in  
-
-    def current_ac_values(self):
-        ac_bal = self.d.fdata('ac_bal', self.i-1) + self.d.fdata('realised_pnl', self.i)
-        margin_used = (self.d.fdata('cum_long_position', self.i) + 
-                       self.d.fdata('cum_short_position', self.i)) * float(self.d.ticker['marginRate'])
-        net_bal = ac_bal + self.d.fdata('unrealised_pnl', self.i)
-        return ac_bal, net_bal, margin_used      
-
-    def update_temp_ac_values(self, init: bool=False):
-        if init:
-            self.d.update_fdata('open_longs', self.i, self.d.fdata('open_longs', self.i-1))
-            self.d.update_fdata('open_shorts', self.i, self.d.fdata('open_shorts', self.i-1))
-            self.d.update_fdata('cum_long_position', self.i, self.d.fdata('cum_long_position', self.i-1))
-            self.d.update_fdata('cum_short_position', self.i, self.d.fdata('cum_short_position', self.i-1))
-            self.d.update_fdata('open_long_count', self.i, len(self.get_open_longs(self.i-1)))
-            self.d.update_fdata('open_short_count', self.i, len(self.get_open_shorts(self.i-1)))
-            self.d.update_fdata('closed_long_count', self.i, len(self.get_closed_longs(self.i-1)))
-            self.d.update_fdata('closed_short_count', self.i, len(self.get_closed_shorts(self.i-1)))
-            self.d.update_fdata('moves_hist', self.i, self.d.fdata('moves_hist', self.i-1))
-            self.d.update_fdata('up_moves_ratio', self.i, self.d.fdata('up_moves_ratio', self.i-1))
-            self.d.update_fdata('down_moves_ratio', self.i, self.d.fdata('down_moves_ratio', self.i-1))
-            self.d.update_fdata('grid_trades_long', self.i, self.d.fdata('grid_trades_long', self.i-1))
-            self.d.update_fdata('grid_trades_short', self.i, self.d.fdata('grid_trades_short', self.i-1))
-        else:
-            self.d.update_fdata('cum_long_position', self.i, self.cum_long_position())
-            self.d.update_fdata('cum_short_position', self.i, self.cum_short_position())
-            self.d.update_fdata('open_long_count', self.i, len(self.get_open_longs()))
-            self.d.update_fdata('open_short_count', self.i, len(self.get_open_shorts()))
-            self.d.update_fdata('closed_long_count', self.i, len(self.get_closed_longs()))
-            self.d.update_fdata('closed_short_count', self.i, len(self.get_closed_shorts()))
-            moves = self.d.fdata('moves_hist', self.i)
-            up_moves, down_moves = moves.count(self.EVENT_UP), moves.count(self.EVENT_DOWN)
-            self.d.update_fdata(f'up_moves_ratio', self.i, round(up_moves / len(moves), 2))
-            self.d.update_fdata(f'down_moves_ratio', self.i, round(down_moves / len(moves), 2))
-        
-        self.d.update_fdata('unrealised_pnl', self.i, self.unrealised_pnl())
-        self.d.update_fdata('realised_pnl', self.i, self.realised_pnl())
-
-    def update_ac_values(self):
-        self.d.update_fdata('cum_long_position', self.i, self.cum_long_position())
-        self.d.update_fdata('cum_short_position', self.i, self.cum_short_position())
-        self.d.update_fdata('open_long_count', self.i, len(self.get_open_longs()))
-        self.d.update_fdata('open_short_count', self.i, len(self.get_open_shorts()))
-        self.d.update_fdata('closed_long_count', self.i, len(self.get_closed_longs()))
-        self.d.update_fdata('closed_short_count', self.i, len(self.get_closed_shorts()))
-
-        self.d.update_fdata('unrealised_pnl', self.i, self.unrealised_pnl())
-        self.d.update_fdata('realised_pnl', self.i, self.realised_pnl())
-        
-        # First candle
-        if self.i == 0:               
-            self.d.update_fdata('ac_bal', self.i, self.init_bal)
-        # Subsequent candles
-        else:
-            events = self.d.fdata('events', self.i) if type(self.d.fdata('events', self.i)) == list else list()
-            cash_transfer = self.EVENT_CASH_IN in events or self.EVENT_CASH_OUT in events
-            ac_bal = self.d.fdata('ac_bal', self.i) if cash_transfer else self.d.fdata('ac_bal', self.i-1)
-            self.d.update_fdata('ac_bal', self.i, round(ac_bal + self.d.fdata('realised_pnl', self.i), 2))
-
-        self.d.update_fdata('net_bal', self.i, round(self.d.fdata('ac_bal', self.i) + self.d.fdata('unrealised_pnl', self.i), 2))
-        self.d.update_fdata('margin_used', self.i, \
-                            round((self.d.fdata('cum_long_position', self.i) + 
-                                   self.d.fdata('cum_short_position', self.i)) * float(self.d.ticker['marginRate']), 2))
-        
-        if self.cash_out_factor is not None:
-            self.d.update_fdata('gross_bal', self.i, round(self.d.fdata('ac_bal', self.i) + self.d.fdata('cash_bal', self.i), 2))
-        else:
-            self.d.update_fdata('gross_bal', self.i, self.d.fdata('ac_bal', self.i))
-           
     def calc_trade_size(self):
         if self.i == 0:
             trade_size = self.init_trade_size
         else:
-            _, net_bal, _ = self.current_ac_values()
+            net_bal, _ = self.current_ac_values()
             trade_size = int(net_bal * self.sizing_ratio) if self.sizing == 'dynamic' else self.init_trade_size
             
             if self.moves_for_weightage is None:
@@ -274,12 +126,6 @@ class GridSimulator:
             short_trade_size = int(trade_size * 2 * self.d.fdata('down_moves_ratio', self.i))
         return long_trade_size, short_trade_size
     
-    def update_events(self, event):
-        events = self.d.fdata('events', self.i) if type(self.d.fdata('events', self.i)) == list else list()
-        if event not in events:
-            events.append(event)
-            self.d.update_fdata('events', self.i, events)
-
     def update_moves_hist(self):
         if self.up_grid or self.down_grid:
             move = self.EVENT_UP if self.up_grid else self.EVENT_DOWN
@@ -294,6 +140,7 @@ class GridSimulator:
         closing_long = open_longs[trade_no]
         del open_longs[trade_no]
         self.update_open_longs(open_longs)
+        self.long_entries.discard(trade_no)
 
         # Append to closed longs
         pips = round((self.d.fdata('bid_c',  self.i) - closing_long['ENT']) * pow(10, -self.d.ticker['pipLocation']), 1)
@@ -325,6 +172,7 @@ class GridSimulator:
         closing_short = open_shorts[trade_no]
         del open_shorts[trade_no]
         self.update_open_shorts(open_shorts)
+        self.short_entries.discard(trade_no)
 
         # Append to closed shorts
         pips = round((closing_short['ENT'] - self.d.fdata('ask_c',  self.i)) * pow(10, -self.d.ticker['pipLocation']), 1)
@@ -354,8 +202,8 @@ class GridSimulator:
         traded = False
         if self.up_grid or self.down_grid:
             # self.trigger = self.next_up_grid if self.up_grid else self.next_down_grid
-            long_tp = round(self.trigger + self.tp_pips * pow(10, self.d.ticker['pipLocation']), 5)
-            short_tp = round(self.trigger - self.tp_pips * pow(10, self.d.ticker['pipLocation']), 5)  
+            long_tp = self.level(self.trigger, self.tp_pips)
+            short_tp = self.level(self.trigger, -self.tp_pips)  
 
             long_trade_size, short_trade_size = self.calc_trade_size()
             open_longs = self.get_open_longs()
@@ -372,8 +220,8 @@ class GridSimulator:
             else:
                 self.trade_no = self.trade_no + 1
 
-                long_sl = round(self.trigger - self.sl_pips * pow(10, self.d.ticker['pipLocation']), 5)
-                short_sl = round(self.trigger + self.sl_pips * pow(10, self.d.ticker['pipLocation']), 5)
+                long_sl = self.level(self.trigger, -self.sl_pips)
+                short_sl = self.level(self.trigger, self.sl_pips)
 
                 if long_trade_size > 0:
                     if self.max_trades_per_grid is not None:
@@ -398,6 +246,7 @@ class GridSimulator:
                             TSL=0
                         )
                         self.update_open_longs(open_longs)
+                        self.long_entries.add(self.trade_no, open_longs[self.trade_no]['ENT'])
                         if self.max_trades_per_grid is not None:
                             self.d.update_fdata('grid_trades_long', self.i, grid_trades_long)
                         traded = True
@@ -427,6 +276,7 @@ class GridSimulator:
                             TSL=0
                         )
                         self.update_open_shorts(open_shorts)
+                        self.short_entries.add(self.trade_no, open_shorts[self.trade_no]['ENT'])
                         if self.max_trades_per_grid is not None:
                             self.d.update_fdata('grid_trades_short', self.i, grid_trades_short)
                         traded = True
@@ -478,42 +328,40 @@ class GridSimulator:
                 short_stopped = True
 
         if self.grid_reset and (long_stopped or short_stopped):
-            long_sl_entry = round(self.trigger + self.grid_reset_pips * pow(10, self.d.ticker['pipLocation']), 5)
-            short_sl_entry = round(self.trigger - self.grid_reset_pips * pow(10, self.d.ticker['pipLocation']), 5)
+            long_sl_entry = self.level(self.trigger, self.grid_reset_pips)
+            short_sl_entry = self.level(self.trigger, -self.grid_reset_pips)
 
             # Close long positions grid reset
             if long_stopped:
-                open_longs = self.get_open_longs()
-                for trade_no, trade in open_longs.items():
-                    if trade['ENT'] >= long_sl_entry:
-                        self.close_long(trade_no)
+                for trade_no in self.long_entries.at_or_above(long_sl_entry):
+                    self.close_long(trade_no)
 
             # Close short positions grid reset
             if short_stopped:
-                open_shorts = self.get_open_shorts()
-                for trade_no, trade in open_shorts.items():
-                    if trade['ENT'] <= short_sl_entry:
-                        self.close_short(trade_no)
+                for trade_no in self.short_entries.at_or_below(short_sl_entry):
+                    self.close_short(trade_no)
         
         return long_stopped or short_stopped
     
+    def farthest_trades(self, price: float):
+        '''Long with the highest entry above price and short with the lowest entry below price
+        First in trade order on ties, None when no trade is beyond price
+        '''
+        farthest_long, farthest_long_price, farthest_short, farthest_short_price = None, price, None, price
+        top = self.long_entries.top()
+        if top is not None and top[0] > price:
+            farthest_long_price, farthest_long = top
+        bottom = self.short_entries.bottom()
+        if bottom is not None and bottom[0] < price:
+            farthest_short_price, farthest_short = bottom
+        return farthest_long, farthest_long_price, farthest_short, farthest_short_price
+
     def stop_loss_max_unrealised_pnl(self):
         traded = False
         price = self.d.fdata('mid_c', self.i)
-        ac_bal, _, _ = self.current_ac_values()
+        ac_bal = self.current_ac_bal()
         while ac_bal * self.max_unrealised_pnl < -self.d.fdata('unrealised_pnl', self.i):
-            farthest_long_price, farthest_short_price = price, price
-            farthest_long, farthest_short = None, None
-            open_longs = self.get_open_longs(self.i)
-            for long, trade in open_longs.items():
-                if trade['ENT'] > farthest_long_price:
-                    farthest_long_price = trade['ENT']
-                    farthest_long = long
-            open_shorts = self.get_open_shorts(self.i)
-            for short, trade in open_shorts.items():
-                if trade['ENT'] < farthest_short_price:
-                    farthest_short_price = trade['ENT']
-                    farthest_short = short
+            farthest_long, farthest_long_price, farthest_short, farthest_short_price = self.farthest_trades(price)
             if farthest_long == None and farthest_short == None:
                 pass
             else:
@@ -527,7 +375,7 @@ class GridSimulator:
                     else:
                         self.close_short(farthest_short)
                 self.update_temp_ac_values()
-                ac_bal, _, _ = self.current_ac_values()
+                ac_bal = self.current_ac_bal()
                 traded = True
 
         return traded
@@ -537,13 +385,7 @@ class GridSimulator:
         price = self.d.fdata('mid_c', self.i)
 
         while self.d.fdata('open_long_count', self.i) >= self.max_trades_per_side:
-            farthest_long_price = price
-            farthest_long = None
-            open_longs = self.get_open_longs(self.i)
-            for long, trade in open_longs.items():
-                if trade['ENT'] > farthest_long_price:
-                    farthest_long_price = trade['ENT']
-                    farthest_long = long
+            farthest_long, _, _, _ = self.farthest_trades(price)
 
             if farthest_long is None:
                 break
@@ -553,13 +395,7 @@ class GridSimulator:
                 traded = True
 
         while self.d.fdata('open_short_count', self.i) >= self.max_trades_per_side:
-            farthest_short_price = price
-            farthest_short = None
-            open_shorts = self.get_open_shorts(self.i)
-            for short, trade in open_shorts.items():
-                if trade['ENT'] < farthest_short_price:
-                    farthest_short_price = trade['ENT']
-                    farthest_short = short
+            _, _, farthest_short, _ = self.farthest_trades(price)
 
             if farthest_short is None:
                 break
@@ -583,24 +419,6 @@ class GridSimulator:
             self.update_temp_ac_values()
             self.update_events(self.EVENT_SL)
     
-    def margin_call(self):
-        _, net_bal, margin_used = self.current_ac_values()
-        traded = False
-        if net_bal < margin_used * self.MC_PERCENT:
-            open_longs = self.get_open_longs()
-            for trade_no, trade in open_longs.items():
-                self.close_long(trade_no)
-                traded = True
-
-            open_shorts = self.get_open_shorts()
-            for trade_no, trade in open_shorts.items():
-                self.close_short(trade_no)
-                traded = True
-
-        if traded:
-            self.update_temp_ac_values()
-            self.update_events(self.EVENT_MC)
-
     def update_trailing_sl(self):
         adjusted = False
         # Update long positions, update next_tp, TSL
@@ -610,7 +428,7 @@ class GridSimulator:
                 # next_tp = round(trade['TP'] + self.grid_pips * pow(10, self.d.ticker['pipLocation']), 5)
                 next_tp = self.next_up_grid
                 # tsl = round(trade['ENT'] + (trade['TP'] - trade['ENT']) / 2, 5) if trade['TSL'] == 0 else trade['TP']  
-                tsl = round(next_tp - self.grid_pips * 2 * pow(10, self.d.ticker['pipLocation']), 5)             
+                tsl = self.level(next_tp, -self.grid_pips * 2)             
                 open_longs[trade_no]['TP'] = next_tp
                 open_longs[trade_no]['TSL'] = tsl
                 adjusted = True
@@ -623,7 +441,7 @@ class GridSimulator:
                 # next_tp = round(trade['TP'] - self.grid_pips * pow(10, self.d.ticker['pipLocation']), 5)
                 next_tp = self.next_down_grid
                 # tsl = round(trade['ENT'] - (trade['ENT'] - trade['TP']) / 2, 5) if trade['TSL'] == 0 else trade['TP']
-                tsl = round(next_tp + self.grid_pips * 2 * pow(10, self.d.ticker['pipLocation']), 5)    
+                tsl = self.level(next_tp, self.grid_pips * 2)    
                 open_shorts[trade_no]['TP'] = next_tp
                 open_shorts[trade_no]['TSL'] = tsl
                 adjusted = True
@@ -674,12 +492,12 @@ class GridSimulator:
             up_grids = int(up_pips / self.grid_pips) if self.i > 1 else 0
             down_grids = int(down_pips / self.grid_pips) if self.i > 1 else 0
             if self.up_grid:
-                self.trigger = round(self.next_up_grid + up_grids * self.grid_pips * pow(10, self.d.ticker['pipLocation']), 5)
+                self.trigger = self.level(self.next_up_grid, up_grids * self.grid_pips)
             else:
-                self.trigger = round(self.next_down_grid - down_grids * self.grid_pips * pow(10, self.d.ticker['pipLocation']), 5)
+                self.trigger = self.level(self.next_down_grid, -down_grids * self.grid_pips)
             # self.trigger = self.next_up_grid if self.up_grid else self.next_down_grid
-            self.next_up_grid = round(self.trigger + self.grid_pips * pow(10, self.d.ticker['pipLocation']), 5)
-            self.next_down_grid = round(self.trigger - self.grid_pips * pow(10, self.d.ticker['pipLocation']), 5)
+            self.next_up_grid = self.level(self.trigger, self.grid_pips)
+            self.next_down_grid = self.level(self.trigger, -self.grid_pips)
 
             self.d.update_fdata('trigger', self.i, self.trigger)
         
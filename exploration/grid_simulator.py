@@ -1,18 +1,33 @@
-from data import Data
+from data import Data, to_points, round_points, to_points_array, to_datetime
 from tqdm import tqdm
 import pandas as pd
 from numpy import isnan
+import numpy as np
+from grid_engine import GridEngine
+import grid_kernel
+import json
+import glob
+import os
 
 
-class GridSimulator:
+class GridSimulator(GridEngine):
 
     EVENT_TP, EVENT_SL, EVENT_MC, EVENT_ENTRY, EVENT_COVER, EVENT_ADJUST = 'TP', 'SL', 'MC', 'ENT', 'COV', 'ADJ'
     EVENT_CASH_IN, EVENT_CASH_OUT =  'CI', 'CO'
     SIZE, ENTRY, TP, SL, COVERED, TSL = 0, 1, 2, 3, 4, 5
+    OPEN_FIELDS = ('SIZE', 'ENTRY', 'TP', 'SL', 'COVERED', 'TSL')
+    CLOSED_FIELDS = ('SIZE', 'ENTRY', 'EXIT', 'PIPS', 'COVERED')
+    LEVEL_FIELDS = ('ENTRY', 'TP', 'SL', 'TSL')
     EXIT, PIPS = 2, 3
     LONG, SHORT = 1, -1
     ORIG_TRADE, COVERED_TRADE = 0, 1
     MC_PERCENT = 0.50
+    SKIP_ROWS, SKIP_MAX_ROWS = 64, 8192
+    SNAPSHOT_PARAMS = ('init_bal', 'init_trade_size', 'tp_pips', 'sl_pips', 'stop_loss_type', 'margin_sl_percent', 'sizing',
+                       'cash_out_factor', 'cover_stopped_loss', 'cover_sl_ratio', 'max_unrealised_pnl', 'trailing_sl', 'intrabar')
+    PRICE_COLS = ('mid_c', 'bid_c', 'ask_c')
+    STREAM_COLS = ('mid_c', 'cum_long_position', 'cum_short_position', 'unrealised_pnl', 'realised_pnl', 'ac_bal', 'net_bal',
+                   'margin_used', 'cash_bal', 'gross_bal')
 
     def __init__(
             self,
@@ -32,8 +47,19 @@ class GridSimulator:
             cover_sl_ratio: float,
             # martingale_sizing: bool,
             max_unrealised_pnl: float,
-            trailing_sl: float):
-        
+            trailing_sl: float,
+            skip_bars: bool=True,
+            kernel: bool=False,
+            intrabar=None):
+        '''kernel: run through the compiled bar loop of grid_kernel, see run_kernel()
+        intrabar: finer candles of the ticker (DataFrame, .pkl or CandleStore directory, e.g. S5) to trade the levels the high / low
+        of a bar touch before its close, see intrabar_prices(). df then needs mid_h and mid_l.
+        '''
+        if kernel and not grid_kernel.supports(cover_stopped_loss, stop_loss_type):
+            raise ValueError(f'grid_kernel does not support cover_stopped_loss={cover_stopped_loss}, stop_loss_type={stop_loss_type}')
+        if kernel and intrabar is not None:
+            raise ValueError('grid_kernel does not support intrabar')
+
         self.name = name
         self.init_bal = init_bal
         self.init_trade_size = init_trade_size
@@ -49,13 +75,21 @@ class GridSimulator:
         # self.martingale_sizing = martingale_sizing,
         self.max_unrealised_pnl = max_unrealised_pnl
         self.trailing_sl = trailing_sl
+        self.skip_bars = skip_bars
+        self.kernel = kernel
+        self.intrabar = intrabar is not None
 
         self.d = Data(
-            source=df.copy(),
+            source=df,
             ticker=ticker,
-            cols=['time', 'mid_c', 'bid_c', 'ask_c'],
+            cols=['time', 'mid_c', 'bid_c', 'ask_c'] + (['mid_h', 'mid_l'] if self.intrabar else []),
             instruments=instruments
         )
+        if self.intrabar:
+            self.d.add_candles('intrabar', intrabar, cols=['time'] + list(self.PRICE_COLS))
+        # Bars traded at one touched level, bars drilled down into their intrabar candles and how many, bars without any
+        self.intrabar_counts = dict(fills=0, drills=0, sub_bars=0, missing=0)
+        self.prices = None
 
         add_cols = dict(
             open_longs=object,
@@ -76,80 +110,59 @@ class GridSimulator:
         )
 
         self.d.prepare_fast_data(name=name, start=0, end=self.d.datalen, add_cols=add_cols)
+        self.add_cols = list(add_cols.keys())
+
+        # Open trades live in array backed books and every change goes to the ledger,
+        # the trade book columns stay empty during the run and are rebuilt by self.d.export()
+        self.longs = self.d.add_trade_book('open_longs', fields=self.OPEN_FIELDS, levels=self.LEVEL_FIELDS, totals=True)
+        self.shorts = self.d.add_trade_book('open_shorts', fields=self.OPEN_FIELDS, levels=self.LEVEL_FIELDS, totals=True)
+        self.ledger = self.d.add_ledger(name, fields=self.OPEN_FIELDS, closed_fields=self.CLOSED_FIELDS)
+        self.closed_longs, self.closed_shorts = dict(), dict()
+        # Realised pnl of the bar in price points, None once a price is off the points grid
+        self.scale = self.d.price_scale()
+        self.realised_points = 0
+
+    def price(self, col: str) -> float:
+        '''mid_c / bid_c / ask_c of bar self.i, or of the intrabar step being traded
+        '''
+        return self.d.fget(col, self.i) if self.prices is None else self.prices[col]
 
     def cum_long_position(self):
-        open_longs = self.d.fdata('open_longs', self.i).copy() if type(self.d.fdata('open_longs', self.i)) == dict else dict()
-        cum_long_position = 0
-        for _, trade in open_longs.items():
-            cum_long_position = cum_long_position + trade[self.SIZE]
-        return cum_long_position
+        return self.longs.totals.size
 
     def cum_short_position(self):
-        open_shorts = self.d.fdata('open_shorts', self.i).copy() if type(self.d.fdata('open_shorts', self.i)) == dict else dict()
-        cum_short_position = 0
-        for _, trade in open_shorts.items():
-            cum_short_position = cum_short_position + trade[self.SIZE]
-        return cum_short_position
+        return self.shorts.totals.size
 
     def unrealised_pnl(self):
-        open_longs = self.d.fdata('open_longs', self.i).copy() if type(self.d.fdata('open_longs', self.i)) == dict else dict()
-        open_shorts = self.d.fdata('open_shorts', self.i).copy() if type(self.d.fdata('open_shorts', self.i)) == dict else dict()
-        pnl = 0
-        for _, trade in open_longs.items():
-            pnl = pnl + trade[self.SIZE] * (self.d.fdata('mid_c', self.i) - trade[self.ENTRY])
-        for _, trade in open_shorts.items():
-            pnl = pnl + trade[self.SIZE] * (trade[self.ENTRY] - self.d.fdata('mid_c', self.i))
-        return round(pnl, 2)
+        price = self.price('mid_c')
+        points = to_points(price, self.scale)
+        if points is not None and self.longs.totals.exact and self.shorts.totals.exact and len(self.longs) + len(self.shorts) > 0:
+            pnl = round_points(self.longs.totals.value(points) - self.shorts.totals.value(points), self.scale)
+            if pnl is not None:
+                return pnl
+        # Ties at half a cent are rounded as the float sum in trade order always did
+        pnl = np.concatenate((self.longs.values('SIZE') * (price - self.longs.values('ENTRY')),
+                              self.shorts.values('SIZE') * (self.shorts.values('ENTRY') - price)))
+        # cumsum adds in trade order like the old loop, so the rounded value is unchanged
+        return round(pnl.cumsum()[-1], 2) if len(pnl) > 0 else 0
     
     def realised_pnl(self):
-        closed_longs = self.d.fdata('closed_longs', self.i).copy() if type(self.d.fdata('closed_longs', self.i)) == dict else dict()
-        closed_shorts = self.d.fdata('closed_shorts', self.i).copy() if type(self.d.fdata('closed_shorts', self.i)) == dict else dict()
+        if self.realised_points is not None:
+            pnl = round_points(self.realised_points, self.scale)
+            if pnl is not None:
+                return pnl
         pnl = 0
-        for _, trade in closed_longs.items():
+        for _, trade in self.closed_longs.items():
             pnl = pnl + trade[self.SIZE] * (trade[self.EXIT] - trade[self.ENTRY])
-        for _, trade in closed_shorts.items():
+        for _, trade in self.closed_shorts.items():
             pnl = pnl + trade[self.SIZE] * (trade[self.ENTRY] - trade[self.EXIT])
         return round(pnl, 2)
     
-    def cash_transfer(self):
-        net_bal, _ = self.current_ac_values()
-        if self.cash_out_factor is not None:
-            self.d.update_fdata('cash_bal', self.i, self.d.fdata('cash_bal', self.i-1))
-            cash_out_threshold = self.init_bal * self.cash_out_factor
-            events = self.d.fdata('events', self.i) if type(self.d.fdata('events', self.i)) == list else list()
-            stop_loss = self.EVENT_SL in events or self.EVENT_MC in events
-            # Cash out / withdraw
-            if net_bal > cash_out_threshold:
-                cash_out = net_bal - cash_out_threshold
-                self.d.update_fdata('ac_bal', self.i, round(self.d.fdata('ac_bal', self.i-1) - cash_out, 2))
-                self.d.update_fdata('cash_bal', self.i, round(self.d.fdata('cash_bal', self.i) + cash_out, 2))
-                # self.update_temp_ac_values()
-                self.update_events(self.EVENT_CASH_OUT)
-                return cash_out
-            # Deposit money into a/c when net_bal < cash_out_threshold
-            elif stop_loss and net_bal < cash_out_threshold:
-                cash_in = min(cash_out_threshold - net_bal, self.d.fdata('cash_bal', self.i))
-                if cash_in > 0:
-                    self.d.update_fdata('ac_bal', self.i, round(self.d.fdata('ac_bal', self.i-1) + cash_in, 2))
-                    self.d.update_fdata('cash_bal', self.i, round(self.d.fdata('cash_bal', self.i) - cash_in, 2))
-                    # self.update_temp_ac_values()
-                    self.update_events(self.EVENT_CASH_IN)    
-                    return cash_in  
-
-    def current_ac_values(self):
-        ac_bal = self.d.fdata('ac_bal', self.i-1) + self.d.fdata('realised_pnl', self.i)
-        margin_used = (self.d.fdata('cum_long_position', self.i) + 
-                       self.d.fdata('cum_short_position', self.i)) * float(self.d.ticker['marginRate'])
-        net_bal = ac_bal + self.d.fdata('unrealised_pnl', self.i)
-        return net_bal, margin_used      
-
     def update_temp_ac_values(self, init: bool=False):
         if init:
-            self.d.update_fdata('open_longs', self.i, self.d.fdata('open_longs', self.i-1))
-            self.d.update_fdata('open_shorts', self.i, self.d.fdata('open_shorts', self.i-1))
-            self.d.update_fdata('cum_long_position', self.i, self.d.fdata('cum_long_position', self.i-1))
-            self.d.update_fdata('cum_short_position', self.i, self.d.fdata('cum_short_position', self.i-1))
-            self.d.update_fdata('uncovered_pip_position', self.i, self.d.fdata('uncovered_pip_position', self.i-1))
+            self.d.update_fdata('cum_long_position', self.i, self.d.fget('cum_long_position', self.i-1))
+            self.d.update_fdata('cum_short_position', self.i, self.d.fget('cum_short_position', self.i-1))
+            self.d.update_fdata('uncovered_pip_position', self.i, self.d.fget('uncovered_pip_position', self.i-1))
         else:
             self.d.update_fdata('cum_long_position', self.i, self.cum_long_position())
             self.d.update_fdata('cum_short_position', self.i, self.cum_short_position())
@@ -160,28 +173,7 @@ class GridSimulator:
     def update_ac_values(self):
         self.d.update_fdata('cum_long_position', self.i, self.cum_long_position())
         self.d.update_fdata('cum_short_position', self.i, self.cum_short_position())
-        self.d.update_fdata('unrealised_pnl', self.i, self.unrealised_pnl())
-        self.d.update_fdata('realised_pnl', self.i, self.realised_pnl())
-        
-        # First candle
-        if self.i == 0:               
-            self.d.update_fdata('ac_bal', self.i, self.init_bal)
-        # Subsequent candles
-        else:
-            events = self.d.fdata('events', self.i) if type(self.d.fdata('events', self.i)) == list else list()
-            cash_transfer = self.EVENT_CASH_IN in events or self.EVENT_CASH_OUT in events
-            ac_bal = self.d.fdata('ac_bal', self.i) if cash_transfer else self.d.fdata('ac_bal', self.i-1)
-            self.d.update_fdata('ac_bal', self.i, round(ac_bal + self.d.fdata('realised_pnl', self.i), 2))
-
-        self.d.update_fdata('net_bal', self.i, round(self.d.fdata('ac_bal', self.i) + self.d.fdata('unrealised_pnl', self.i), 2))
-        self.d.update_fdata('margin_used', self.i, \
-                            round((self.d.fdata('cum_long_position', self.i) + 
-                                   self.d.fdata('cum_short_position', self.i)) * float(self.d.ticker['marginRate']), 2))
-        
-        if self.cash_out_factor is not None:
-            self.d.update_fdata('gross_bal', self.i, round(self.d.fdata('ac_bal', self.i) + self.d.fdata('cash_bal', self.i), 2))
-        else:
-            self.d.update_fdata('gross_bal', self.i, self.d.fdata('ac_bal', self.i))
+        self.update_balances()
     
     def trade_size(self):
         cov_trade_size = 0
@@ -190,8 +182,8 @@ class GridSimulator:
         else:
             net_bal, margin_used = self.current_ac_values()
             calc_trade_size = int(net_bal * self.sizing_ratio) + 1 if self.sizing == 'dynamic' else self.init_trade_size
-            uncovered_pip_position = 0 if isnan(self.d.fdata('uncovered_pip_position', self.i)) \
-                else self.d.fdata('uncovered_pip_position', self.i)
+            uncovered_pip_position = 0 if isnan(self.d.fget('uncovered_pip_position', self.i)) \
+                else self.d.fget('uncovered_pip_position', self.i)
             if self.cover_stopped_loss is not None and uncovered_pip_position > 0:
                 sl_cover_trade_size = uncovered_pip_position / self.tp_pips * self.cover_sl_ratio
                 required_trade_size = max(calc_trade_size, sl_cover_trade_size)
@@ -208,8 +200,8 @@ class GridSimulator:
         else:
             net_bal, margin_used = self.current_ac_values()
             trade_size = int(net_bal * self.sizing_ratio) if self.sizing == 'dynamic' else self.init_trade_size
-            uncovered_pip_position = 0 if isnan(self.d.fdata('uncovered_pip_position', self.i)) \
-                else self.d.fdata('uncovered_pip_position', self.i)
+            uncovered_pip_position = 0 if isnan(self.d.fget('uncovered_pip_position', self.i)) \
+                else self.d.fget('uncovered_pip_position', self.i)
             if self.cover_stopped_loss is not None and uncovered_pip_position > 0:
                 sl_cover_trade_size = uncovered_pip_position / self.tp_pips * self.cover_sl_ratio
                 required_trade_size = max(trade_size, sl_cover_trade_size)
@@ -226,51 +218,45 @@ class GridSimulator:
     #     net_bal, _ = self.current_ac_values()
     #     return int(net_bal * self.sizing_ratio)   
     
-    def update_events(self, event):
-        events = self.d.fdata('events', self.i).copy() if type(self.d.fdata('events', self.i)) == list else list()
-        if event not in events:
-            events.append(event)
-            self.d.update_fdata('events', self.i, events)
-
     def close_long(self, trade_no: int):
         # Remove from open longs
-        open_longs = self.d.fdata('open_longs',  self.i).copy()
-        closing_long = open_longs[trade_no]
-        del open_longs[trade_no]
-        self.d.update_fdata('open_longs', self.i, open_longs)
+        closing_long = self.longs.close(trade_no)
 
         # Append to closed longs
-        pips = (self.d.fdata('ask_c',  self.i) - closing_long[self.ENTRY]) * pow(10, -self.d.ticker['pipLocation'])
-        closed_longs = self.d.fdata('closed_longs',  self.i).copy() if type(self.d.fdata('closed_longs',  self.i)) == dict else dict()
-        closed_longs[trade_no] = (closing_long[self.SIZE], closing_long[self.ENTRY], self.d.fdata('bid_c',  self.i), round(pips, 1), closing_long[self.COVERED]) # (SIZE, ENTRY, EXIT, PIPS, COVERED)
-
-        self.d.update_fdata('closed_longs', self.i, closed_longs)
+        pips = (self.price('ask_c') - closing_long[self.ENTRY]) * pow(10, -self.d.ticker['pipLocation'])
+        self.closed_longs[trade_no] = (closing_long[self.SIZE], closing_long[self.ENTRY], self.price('bid_c'), round(pips, 1), closing_long[self.COVERED]) # (SIZE, ENTRY, EXIT, PIPS, COVERED)
+        self.add_realised(closing_long[self.SIZE], closing_long[self.ENTRY], self.price('bid_c'))
+        self.ledger.close(self.i, self.LONG, trade_no, self.closed_longs[trade_no])
 
     def close_short(self, trade_no: int):
         # Remove from open shorts
-        open_shorts = self.d.fdata('open_shorts',  self.i).copy()
-        closing_short = open_shorts[trade_no]
-        del open_shorts[trade_no]
-        self.d.update_fdata('open_shorts', self.i, open_shorts)
+        closing_short = self.shorts.close(trade_no)
 
         # Append to closed shorts
-        pips = (closing_short[self.ENTRY] - self.d.fdata('bid_c',  self.i)) * pow(10, -self.d.ticker['pipLocation'])
-        closed_shorts = self.d.fdata('closed_shorts',  self.i).copy() if type(self.d.fdata('closed_shorts',  self.i)) == dict else dict()
-        closed_shorts[trade_no] = (closing_short[self.SIZE], closing_short[self.ENTRY], self.d.fdata('ask_c',  self.i), round(pips, 1), closing_short[self.COVERED]) # (SIZE, ENTRY, EXIT, PIPS, COVERED)
-
-        self.d.update_fdata('closed_shorts', self.i, closed_shorts)
+        pips = (closing_short[self.ENTRY] - self.price('bid_c')) * pow(10, -self.d.ticker['pipLocation'])
+        self.closed_shorts[trade_no] = (closing_short[self.SIZE], closing_short[self.ENTRY], self.price('ask_c'), round(pips, 1), closing_short[self.COVERED]) # (SIZE, ENTRY, EXIT, PIPS, COVERED)
+        self.add_realised(-closing_short[self.SIZE], closing_short[self.ENTRY], self.price('ask_c'))
+        self.ledger.close(self.i, self.SHORT, trade_no, self.closed_shorts[trade_no])
+
+    def add_realised(self, size: int, entry: float, exit: float):
+        '''Add size x (exit - entry) of a closed trade to the realised pnl of the bar, size < 0 for shorts
+        '''
+        entry, exit = to_points(entry, self.scale), to_points(exit, self.scale)
+        if self.realised_points is None or entry is None or exit is None:
+            self.realised_points = None
+        else:
+            self.realised_points = self.realised_points + size * (exit - entry)
 
     def update_uncovered_pip_position(self, trade_no, event: int):
-        uncovered_pip_position = 0 if isnan(self.d.fdata('uncovered_pip_position', self.i)) \
-            else self.d.fdata('uncovered_pip_position', self.i)
+        uncovered_pip_position = 0 if isnan(self.d.fget('uncovered_pip_position', self.i)) \
+            else self.d.fget('uncovered_pip_position', self.i)
         # if uncovered_pip_position == 0 and event == self.EVENT_COVER:
         #     return
         if event == self.EVENT_SL or event == self.EVENT_MC: # Add on stop loss
-            if type(self.d.fdata('closed_longs', self.i)) == dict and \
-                trade_no in self.d.fdata('closed_longs', self.i):
-                stopped_trade = self.d.fdata('closed_longs', self.i)[trade_no]
+            if trade_no in self.closed_longs:
+                stopped_trade = self.closed_longs[trade_no]
             else:
-                stopped_trade = self.d.fdata('closed_shorts', self.i)[trade_no]
+                stopped_trade = self.closed_shorts[trade_no]
             # self.sl_pip_position = self.sl_pip_position - stopped_trade[self.SIZE] * stopped_trade[self.PIPS]
             if stopped_trade[self.PIPS] < 0 and stopped_trade[self.COVERED] == self.COVERED_TRADE:
                 self.d.update_fdata('uncovered_pip_position', self.i, 
@@ -278,27 +264,27 @@ class GridSimulator:
                                           stopped_trade[self.SIZE] * stopped_trade[self.PIPS], 2)) # subtraction because of negative sign of stopped trade pips
         elif event == self.EVENT_COVER: # Reduce on entry
             if self.cover_stopped_loss == '2-way':
-                covered_pip_position = self.d.fdata('open_longs', self.i)[trade_no][self.SIZE] * self.tp_pips * 2
+                covered_pip_position = self.longs.get(trade_no, 'SIZE') * self.tp_pips * 2
             elif self.cover_stopped_loss == '1-way':
                 if self.cover_sl_direction == self.LONG:
-                    covered_pip_position = self.d.fdata('open_longs', self.i)[trade_no][self.SIZE] * self.tp_pips
+                    covered_pip_position = self.longs.get(trade_no, 'SIZE') * self.tp_pips
                 elif self.cover_sl_direction == self.SHORT:
-                    covered_pip_position = self.d.fdata('open_shorts', self.i)[trade_no][self.SIZE] * self.tp_pips
+                    covered_pip_position = self.shorts.get(trade_no, 'SIZE') * self.tp_pips
             uncovered_pip_position = max(0, uncovered_pip_position - covered_pip_position)
             self.d.update_fdata('uncovered_pip_position', self.i, round(uncovered_pip_position, 2) if uncovered_pip_position > 0 else None)
 
     def entry(self):
-        next_grid = self.d.fdata('mid_c', self.i) >= self.next_up_grid or self.d.fdata('mid_c', self.i) <= self.next_down_grid
-        if next_grid or self.d.fdata('uncovered_pip_position', self.i) > 0:
-            long_tp = round(self.d.fdata('mid_c', self.i) + self.tp_pips * pow(10, self.d.ticker['pipLocation']), 5)
-            short_tp = round(self.d.fdata('mid_c', self.i) - self.tp_pips * pow(10, self.d.ticker['pipLocation']), 5)
+        next_grid = self.price('mid_c') >= self.next_up_grid or self.price('mid_c') <= self.next_down_grid
+        if next_grid or self.d.fget('uncovered_pip_position', self.i) > 0:
+            long_tp = self.level(self.price('mid_c'), self.tp_pips)
+            short_tp = self.level(self.price('mid_c'), -self.tp_pips)
 
             if next_grid:
                 self.next_up_grid = long_tp
                 self.next_down_grid = short_tp
 
-            # long_ssl = round(self.d.fdata('mid_c', self.i) - self.sl_pips / 2 * pow(10, self.d.ticker['pipLocation']), 5)
-            # short_ssl = round(self.d.fdata('mid_c', self.i) + self.sl_pips / 2 * pow(10, self.d.ticker['pipLocation']), 5)
+            # long_ssl = round(self.price('mid_c') - self.sl_pips / 2 * pow(10, self.d.ticker['pipLocation']), 5)
+            # short_ssl = round(self.price('mid_c') + self.sl_pips / 2 * pow(10, self.d.ticker['pipLocation']), 5)
 
             # if self.i == 0:
             #     trade_size = self.init_trade_size
@@ -306,8 +292,6 @@ class GridSimulator:
             #     trade_size = self.dynamic_trade_size() if self.sizing == 'dynamic' else self.init_trade_size
 
             trade_size, cov_trade_size = self.trade_size()
-            open_longs = self.d.fdata('open_longs', self.i).copy() if type(self.d.fdata('open_longs', self.i)) == dict else dict()
-            open_shorts = self.d.fdata('open_shorts', self.i).copy() if type(self.d.fdata('open_shorts', self.i)) == dict else dict()
             
             # required_margin = round(trade_size * float(self.d.ticker['marginRate']) * 2, 2)
             # net_bal, margin_used = self.current_ac_values()
@@ -315,33 +299,35 @@ class GridSimulator:
             if trade_size > 0:
                 self.trade_no = self.trade_no + 1
                 # if self.stop_loss_type == 'grid_count_max_unrealised_pnl':
-                #     open_longs[self.trade_no] = (trade_size, self.d.fdata('ask_c', self.i), self.next_up_grid, long_sl, long_ssl) # (SIZE, ENTRY, TP, SL, SSL)
-                #     open_shorts[self.trade_no] = (trade_size, self.d.fdata('bid_c', self.i), self.next_down_grid, short_sl, short_ssl) # (SIZE, ENTRY, TP, SL,SSL)
+                #     open_longs[self.trade_no] = (trade_size, self.price('ask_c'), self.next_up_grid, long_sl, long_ssl) # (SIZE, ENTRY, TP, SL, SSL)
+                #     open_shorts[self.trade_no] = (trade_size, self.price('bid_c'), self.next_down_grid, short_sl, short_ssl) # (SIZE, ENTRY, TP, SL,SSL)
                 # else:
                 covered_long, covered_short = self.ORIG_TRADE, self.ORIG_TRADE
-                long_sl = round(self.d.fdata('mid_c', self.i) - self.sl_pips * pow(10, self.d.ticker['pipLocation']), 5)
-                short_sl = round(self.d.fdata('mid_c', self.i) + self.sl_pips * pow(10, self.d.ticker['pipLocation']), 5)
+                long_sl = self.level(self.price('mid_c'), -self.sl_pips)
+                short_sl = self.level(self.price('mid_c'), self.sl_pips)
                 if self.cover_stopped_loss is None or cov_trade_size == 0:
                     long_size, short_size = trade_size, trade_size
                 elif self.cover_stopped_loss == '2-way':
                     long_size, short_size = cov_trade_size, cov_trade_size
                     covered_long, covered_short = self.COVERED_TRADE, self.COVERED_TRADE
-                    long_sl = round(self.d.fdata('mid_c', self.i) - self.tp_pips * pow(10, self.d.ticker['pipLocation']), 5)
-                    short_sl = round(self.d.fdata('mid_c', self.i) + self.tp_pips * pow(10, self.d.ticker['pipLocation']), 5)
+                    long_sl = self.level(self.price('mid_c'), -self.tp_pips)
+                    short_sl = self.level(self.price('mid_c'), self.tp_pips)
                 elif self.cover_stopped_loss == '1-way':
                     if self.cover_sl_direction == self.LONG:
                         long_size, short_size = cov_trade_size, trade_size
                         covered_long = self.COVERED_TRADE
-                        long_sl = round(self.d.fdata('mid_c', self.i) - self.tp_pips * pow(10, self.d.ticker['pipLocation']), 5)
+                        long_sl = self.level(self.price('mid_c'), -self.tp_pips)
                     elif self.cover_sl_direction == self.SHORT:
                         long_size, short_size = trade_size, cov_trade_size
                         covered_short = self.COVERED_TRADE
-                        short_sl = round(self.d.fdata('mid_c', self.i) + self.tp_pips * pow(10,     self.d.ticker['pipLocation']), 5)
+                        short_sl = self.level(self.price('mid_c'), self.tp_pips)
                 
-                open_longs[self.trade_no] = (long_size, self.d.fdata('ask_c', self.i), long_tp, long_sl, covered_long, 0) # (SIZE, ENTRY, TP, SL, COVERED, TSL)
-                open_shorts[self.trade_no] = (short_size, self.d.fdata('bid_c', self.i), short_tp, short_sl, covered_short, 0) # (SIZE, ENTRY, TP, SL, COVERED, TSL)
-                self.d.update_fdata('open_longs', self.i, open_longs)
-                self.d.update_fdata('open_shorts', self.i, open_shorts)
+                open_long = (long_size, self.price('ask_c'), long_tp, long_sl, covered_long, 0) # (SIZE, ENTRY, TP, SL, COVERED, TSL)
+                open_short = (short_size, self.price('bid_c'), short_tp, short_sl, covered_short, 0) # (SIZE, ENTRY, TP, SL, COVERED, TSL)
+                self.longs.open(self.trade_no, open_long)
+                self.shorts.open(self.trade_no, open_short)
+                self.ledger.open(self.i, self.LONG, self.trade_no, open_long)
+                self.ledger.open(self.i, self.SHORT, self.trade_no, open_short)
                 
                 self.update_temp_ac_values()
                 # self.update_events(self.EVENT_ENTRY)
@@ -354,19 +340,16 @@ class GridSimulator:
 
     def take_profit(self):     
         traded = False
+        price = self.price('mid_c')
         # Close long positions take profit
-        open_longs = self.d.fdata('open_longs', self.i).copy() if type(self.d.fdata('open_longs', self.i)) == dict else dict()
-        for trade_no, trade in open_longs.items():
-            if self.d.fdata('mid_c', self.i) >= trade[self.TP]:
-                self.close_long(trade_no)
-                traded = True
+        for trade_no in self.longs.levels['TP'].at_or_below(price):
+            self.close_long(trade_no)
+            traded = True
 
         # Close short positions take profit
-        open_shorts = self.d.fdata('open_shorts', self.i).copy() if type(self.d.fdata('open_shorts', self.i)) == dict else dict()
-        for trade_no, trade in open_shorts.items():
-            if self.d.fdata('mid_c', self.i) <= trade[self.TP]:
-                self.close_short(trade_no)
-                traded = True
+        for trade_no in self.shorts.levels['TP'].at_or_above(price):
+            self.close_short(trade_no)
+            traded = True
 
         if traded:
             self.update_temp_ac_values()
@@ -375,25 +358,22 @@ class GridSimulator:
 
     def stop_loss_grid_count(self):
         traded = False
+        price = self.price('mid_c')
         # Close long positions stop loss
-        open_longs = self.d.fdata('open_longs', self.i).copy()
-        for trade_no, trade in open_longs.items():
-            if self.d.fdata('mid_c', self.i) <= trade[self.SL]:
-                self.close_long(trade_no)
-                if self.cover_stopped_loss is not None:
-                    self.cover_sl_direction = self.SHORT
-                    self.update_uncovered_pip_position(trade_no, self.EVENT_SL)
-                traded = True
+        for trade_no in self.longs.levels['SL'].at_or_above(price):
+            self.close_long(trade_no)
+            if self.cover_stopped_loss is not None:
+                self.cover_sl_direction = self.SHORT
+                self.update_uncovered_pip_position(trade_no, self.EVENT_SL)
+            traded = True
 
         # Close short positions stop loss
-        open_shorts = self.d.fdata('open_shorts', self.i).copy()
-        for trade_no, trade in open_shorts.items():
-            if self.d.fdata('mid_c', self.i) >= trade[self.SL]:
-                self.close_short(trade_no)
-                if self.cover_stopped_loss is not None:
-                    self.cover_sl_direction = self.LONG
-                    self.update_uncovered_pip_position(trade_no, self.EVENT_SL)
-                traded = True
+        for trade_no in self.shorts.levels['SL'].at_or_below(price):
+            self.close_short(trade_no)
+            if self.cover_stopped_loss is not None:
+                self.cover_sl_direction = self.LONG
+                self.update_uncovered_pip_position(trade_no, self.EVENT_SL)
+            traded = True
 
         return traded
 
@@ -406,10 +386,8 @@ class GridSimulator:
     def stop_loss_oldest_on_margin(self, net_bal: float, margin_used: float):
         traded = False
         if net_bal < margin_used * self.margin_sl_percent:
-            longs = list(self.d.fdata('open_longs', self.i).keys())
-            shorts = list(self.d.fdata('open_shorts', self.i).keys())
-            oldest_long = longs[0] if len(longs) > 0 else None
-            oldest_short = shorts[0] if len(shorts) > 0 else None
+            oldest_long = self.longs.oldest()
+            oldest_short = self.shorts.oldest()
             if oldest_long == None and oldest_short == None:
                 pass
             else:
@@ -437,20 +415,24 @@ class GridSimulator:
                 traded = True
         return traded
 
+    def farthest_trades(self, price: float):
+        '''Long with the highest entry above price and short with the lowest entry below price
+        First in trade order on ties, None when no trade is beyond price
+        '''
+        farthest_long, farthest_long_price, farthest_short, farthest_short_price = None, price, None, price
+        top = self.longs.levels['ENTRY'].top()
+        if top is not None and top[0] > price:
+            farthest_long_price, farthest_long = top
+        bottom = self.shorts.levels['ENTRY'].bottom()
+        if bottom is not None and bottom[0] < price:
+            farthest_short_price, farthest_short = bottom
+        return farthest_long, farthest_long_price, farthest_short, farthest_short_price
+
     def stop_loss_farthest_on_margin(self, net_bal: float, margin_used: float):
         traded = False
-        price = self.d.fdata('mid_c', self.i)
+        price = self.price('mid_c')
         if net_bal < margin_used * self.margin_sl_percent:
-            farthest_long_price, farthest_short_price = price, price
-            farthest_long, farthest_short = None, None
-            for long, trade in self.d.fdata('open_longs', self.i).items():
-                if trade[self.ENTRY] > farthest_long_price:
-                    farthest_long_price = trade[self.ENTRY]
-                    farthest_long = long
-            for short, trade in self.d.fdata('open_shorts', self.i).items():
-                if trade[self.ENTRY] < farthest_short_price:
-                    farthest_short_price = trade[self.ENTRY]
-                    farthest_short = short
+            farthest_long, farthest_long_price, farthest_short, farthest_short_price = self.farthest_trades(price)
             if farthest_long == None and farthest_short == None:
                 pass
             else:
@@ -480,18 +462,9 @@ class GridSimulator:
     
     def stop_loss_max_unrealised_pnl(self, net_bal):
         traded = False
-        price = self.d.fdata('mid_c', self.i)
-        while net_bal * self.max_unrealised_pnl < -self.d.fdata('unrealised_pnl', self.i):
-            farthest_long_price, farthest_short_price = price, price
-            farthest_long, farthest_short = None, None
-            for long, trade in self.d.fdata('open_longs', self.i).items():
-                if trade[self.ENTRY] > farthest_long_price:
-                    farthest_long_price = trade[self.ENTRY]
-                    farthest_long = long
-            for short, trade in self.d.fdata('open_shorts', self.i).items():
-                if trade[self.ENTRY] < farthest_short_price:
-                    farthest_short_price = trade[self.ENTRY]
-                    farthest_short = short
+        price = self.price('mid_c')
+        while net_bal * self.max_unrealised_pnl < -self.d.fget('unrealised_pnl', self.i):
+            farthest_long, farthest_long_price, farthest_short, farthest_short_price = self.farthest_trades(price)
             if farthest_long == None and farthest_short == None:
                 pass
             else:
@@ -524,18 +497,9 @@ class GridSimulator:
     
     def stop_loss_max_unrealised_pnl_farthest(self, net_bal):
         traded = False
-        price = self.d.fdata('mid_c', self.i)
-        if net_bal * self.max_unrealised_pnl < -self.d.fdata('unrealised_pnl', self.i):
-            farthest_long_price, farthest_short_price = price, price
-            farthest_long, farthest_short = None, None
-            for long, trade in self.d.fdata('open_longs', self.i).items():
-                if trade[self.ENTRY] > farthest_long_price:
-                    farthest_long_price = trade[self.ENTRY]
-                    farthest_long = long
-            for short, trade in self.d.fdata('open_shorts', self.i).items():
-                if trade[self.ENTRY] < farthest_short_price:
-                    farthest_short_price = trade[self.ENTRY]
-                    farthest_short = short
+        price = self.price('mid_c')
+        if net_bal * self.max_unrealised_pnl < -self.d.fget('unrealised_pnl', self.i):
+            farthest_long, farthest_long_price, farthest_short, farthest_short_price = self.farthest_trades(price)
             if farthest_long == None and farthest_short == None:
                 pass
             else:
@@ -568,26 +532,8 @@ class GridSimulator:
         # traded = self.stop_loss_grid_count()
 
         traded = False
-        if net_bal * self.max_unrealised_pnl < -self.d.fdata('unrealised_pnl', self.i):
-            # Close long positions stop loss
-            open_longs = self.d.fdata('open_longs', self.i).copy()
-            for trade_no, trade in open_longs.items():
-                if self.d.fdata('mid_c', self.i) <= trade[self.SL]:
-                    self.close_long(trade_no)
-                    if self.cover_stopped_loss is not None:
-                        self.cover_sl_direction = self.SHORT
-                        self.update_uncovered_pip_position(trade_no, self.EVENT_SL)
-                    traded = True
-
-            # Close short positions stop loss
-            open_shorts = self.d.fdata('open_shorts', self.i).copy()
-            for trade_no, trade in open_shorts.items():
-                if self.d.fdata('mid_c', self.i) >= trade[self.SL]:
-                    self.close_short(trade_no)
-                    if self.cover_stopped_loss is not None:
-                        self.cover_sl_direction = self.LONG
-                        self.update_uncovered_pip_position(trade_no, self.EVENT_SL)
-                    traded = True
+        if net_bal * self.max_unrealised_pnl < -self.d.fget('unrealised_pnl', self.i):
+            traded = self.stop_loss_grid_count()
 
         return traded
     
@@ -615,32 +561,30 @@ class GridSimulator:
             # self.update_ac_values()
 
     def cum_sl_pips(self):
-        closed_longs = self.d.fdata('closed_longs', self.i).copy()
         cum_sl_longs = 0
-        for trade_no, trade in closed_longs.items():
+        for trade_no, trade in self.closed_longs.items():
             if trade[self.PIPS] < 0:
                 cum_sl_longs = cum_sl_longs + trade[self.PIPS]
-        closed_shorts = self.d.fdata('closed_shorts', self.i).copy()
         cum_sl_shorts = 0
-        for trade_no, trade in closed_shorts.items():
+        for trade_no, trade in self.closed_shorts.items():
             if trade[self.PIPS] < 0:
                 cum_sl_shorts = cum_sl_shorts + trade[self.PIPS]
         return cum_sl_longs, cum_sl_shorts
     
     def margin_call(self):
         net_bal, margin_used = self.current_ac_values()
-        # cum_position = self.d.fdata('cum_long_position', self.i) + self.d.fdata('cum_short_position', self.i)
+        # cum_position = self.d.fget('cum_long_position', self.i) + self.d.fget('cum_short_position', self.i)
         traded = False
         if net_bal < margin_used * self.MC_PERCENT:
-            open_longs = self.d.fdata('open_longs', self.i).copy()
-            for trade_no, trade in open_longs.items():
+            open_longs = self.longs.trade_nos()
+            for trade_no in open_longs:
                 self.close_long(trade_no)
                 if self.cover_stopped_loss is not None:
                     self.update_uncovered_pip_position(trade_no, self.EVENT_MC)
                 traded = True
 
-            open_shorts = self.d.fdata('open_shorts', self.i).copy()
-            for trade_no, trade in open_shorts.items():
+            open_shorts = self.shorts.trade_nos()
+            for trade_no in open_shorts:
                 self.close_short(trade_no)
                 if self.cover_stopped_loss is not None:
                     self.update_uncovered_pip_position(trade_no, self.EVENT_MC)
@@ -662,44 +606,42 @@ class GridSimulator:
 
     def update_trailing_sl(self):
         adjusted = False
+        price = self.price('mid_c')
         # Update long positions, update TSL
-        open_longs = self.d.fdata('open_longs', self.i).copy() if type(self.d.fdata('open_longs', self.i)) == dict else dict()
-        for trade_no, trade in open_longs.items():
-            if self.d.fdata('mid_c', self.i) >= trade[self.TP]:
-                next_tp = round(trade[self.TP] + self.tp_pips * pow(10, self.d.ticker['pipLocation']), 5)
-                tsl = round(trade[self.ENTRY] + (trade[self.TP] - trade[self.ENTRY]) / 2, 5) if trade[self.TSL] == 0 else trade[self.TP]               
-                open_longs[trade_no] = (trade[self.SIZE], trade[self.ENTRY], next_tp, trade[self.SL], trade[self.COVERED], tsl)
-                self.d.update_fdata('open_longs', self.i, open_longs)
-                adjusted = True
+        for trade_no in self.longs.levels['TP'].at_or_below(price):
+            trade = self.longs.record(self.longs.slot_of[trade_no])
+            next_tp = self.level(trade[self.TP], self.tp_pips)
+            tsl = self.midpoint(trade[self.ENTRY], trade[self.TP]) if trade[self.TSL] == 0 else trade[self.TP]
+            self.longs.update(trade_no, 'TP', next_tp)
+            self.longs.update(trade_no, 'TSL', tsl)
+            self.ledger.adjust(self.i, self.LONG, trade_no, self.longs.record(self.longs.slot_of[trade_no]))
+            adjusted = True
 
         # Update short positions, update TSL
-        open_shorts = self.d.fdata('open_shorts', self.i).copy() if type(self.d.fdata('open_shorts', self.i)) == dict else dict()
-        for trade_no, trade in open_shorts.items():
-            if self.d.fdata('mid_c', self.i) <= trade[self.TP]:
-                next_tp = round(trade[self.TP] - self.tp_pips * pow(10, self.d.ticker['pipLocation']), 5)
-                tsl = round(trade[self.ENTRY] - (trade[self.ENTRY] - trade[self.TP]) / 2, 5) if trade[self.TSL] == 0 else trade[self.TP]
-                open_shorts[trade_no] = (trade[self.SIZE], trade[self.ENTRY], next_tp, trade[self.SL], trade[self.COVERED], tsl)
-                self.d.update_fdata('open_shorts', self.i, open_shorts)
-                adjusted = True
+        for trade_no in self.shorts.levels['TP'].at_or_above(price):
+            trade = self.shorts.record(self.shorts.slot_of[trade_no])
+            next_tp = self.level(trade[self.TP], -self.tp_pips)
+            tsl = self.midpoint(trade[self.ENTRY], trade[self.TP]) if trade[self.TSL] == 0 else trade[self.TP]
+            self.shorts.update(trade_no, 'TP', next_tp)
+            self.shorts.update(trade_no, 'TSL', tsl)
+            self.ledger.adjust(self.i, self.SHORT, trade_no, self.shorts.record(self.shorts.slot_of[trade_no]))
+            adjusted = True
 
         if adjusted:
             self.update_events(self.EVENT_ADJUST)  
 
     def take_profit_tsl(self):
         traded = False
-        # Close long positions take profit
-        open_longs = self.d.fdata('open_longs', self.i).copy()
-        for trade_no, trade in open_longs.items():
-            if self.d.fdata('mid_c', self.i) <= trade[self.TSL] and trade[self.TSL] != 0:
-                self.close_long(trade_no)
-                traded = True
+        price = self.price('mid_c')
+        # Close long positions take profit, an unset TSL of 0 is not in the index
+        for trade_no in self.longs.levels['TSL'].at_or_above(price):
+            self.close_long(trade_no)
+            traded = True
 
         # Close short positions take profit
-        open_shorts = self.d.fdata('open_shorts', self.i).copy()
-        for trade_no, trade in open_shorts.items():
-            if self.d.fdata('mid_c', self.i) >= trade[self.TSL] and trade[self.TSL] != 0:
-                self.close_short(trade_no)
-                traded = True
+        for trade_no in self.shorts.levels['TSL'].at_or_below(price):
+            self.close_short(trade_no)
+            traded = True
 
         if traded:
             self.update_temp_ac_values()
@@ -707,32 +649,364 @@ class GridSimulator:
     
     def update_init_values(self):
         self.trade_no = 0
-        self.next_up_grid = self.d.fdata('mid_c', 0)
-        self.next_down_grid = self.d.fdata('mid_c', 0)
+        self.next_up_grid = self.d.fget('mid_c', 0)
+        self.next_down_grid = self.d.fget('mid_c', 0)
         if self.cash_out_factor is not None:
             self.d.update_fdata('cash_bal', self.i, 0)
         self.cover_sl_direction = None
-    
-    def run_sim(self):
-        for i in tqdm(range(self.d.fdatalen), desc=" Simulating... "):
-            self.i = i
-            # self.calculate_values(init=True)
-            if self.i == 0:
-                self.update_init_values()
-            else:
-                self.update_temp_ac_values(init=True)
-                if self.trailing_sl:
-                    self.update_trailing_sl()
-                self.margin_call()
-                self.stop_loss()
-                if self.trailing_sl:
-                    self.take_profit_tsl()
-                else:
-                    self.take_profit()
-                self.cash_transfer()
+
+    def trigger_levels(self) -> tuple:
+        '''(up, down) nearest price levels at which a bar can trade or adjust a trade, mid_c >= up or mid_c <= down
+        Next grid, TP and SL of the open trades and their TSL once set
+        '''
+        longs, shorts = self.longs.levels, self.shorts.levels
+        up = min(self.next_up_grid, longs['TP'].lowest(), shorts['SL'].lowest(), shorts['TSL'].lowest())
+        down = max(self.next_down_grid, shorts['TP'].highest(), longs['SL'].highest(), longs['TSL'].highest())
+        return up, down
+
+    def touched_levels(self, low: float, high: float) -> set:
+        '''Distinct next grid, TP, SL and TSL levels in [low, high]
+        '''
+        levels = {level for level in (self.next_up_grid, self.next_down_grid) if low <= level <= high}
+        for book in (self.longs, self.shorts):
+            for field in ('TP', 'SL', 'TSL'):
+                levels |= book.levels[field].between(low, high)
+        return levels
+
+    def intrabar_prices(self) -> list:
+        '''(mid, bid, ask) at which bar self.i trades before its close, found from its high and low
+        No level within the high / low: none, the close alone sees everything.
+        One level, and no room in the bar to reach a level that a fill there creates: that level, at the spread of the close.
+        Otherwise the closes of the intrabar candles of the bar, found by time, give the order in which the levels were touched.
+        '''
+        high, low = self.d.fget('mid_h', self.i), self.d.fget('mid_l', self.i)
+        levels = self.touched_levels(low, high)
+        if len(levels) == 0:
+            return []
+        mid, bid, ask = (self.d.fget(col, self.i) for col in self.PRICE_COLS)
+        if len(levels) == 1:
+            level = levels.pop()
+            # A fill opens trades a grid away, trailing sets a TSL about half a grid away
+            grid = self.tp_pips * pow(10, self.d.ticker['pipLocation'])
+            gap = (grid / 2 if self.trailing_sl else grid) - (ask - bid)
+            if max(high - level, level - low) < gap:
+                self.intrabar_counts['fills'] += 1
+                digits = self.d.ticker['displayPrecision'] + 1
+                return [(level, round(level - (mid - bid), digits), round(level + (ask - mid), digits))]
+
+        time = self.d.fview('time')
+        end = time[self.i+1] if self.i + 1 < self.d.fdatalen else 2 * time[self.i] - time[self.i-1]
+        start, end = self.d.index_of(time[self.i], source='intrabar'), self.d.index_of(end, source='intrabar')
+        if start >= end:
+            self.intrabar_counts['missing'] += 1
+            return []
+        self.intrabar_counts['drills'] += 1
+        self.intrabar_counts['sub_bars'] += end - start
+        candles = self.d.df['intrabar']
+        return list(zip(*(candles[col].to_numpy()[start:end] for col in self.PRICE_COLS)))
+
+    def intrabar_steps(self):
+        '''Trade bar self.i at each of its intrabar_prices() as if it were a bar, then back at its close
+        Balances are only moved once, on the close.
+        '''
+        prices = self.intrabar_prices()
+        if len(prices) == 0:
+            return
+        for values in prices:
+            self.prices = dict(zip(self.PRICE_COLS, values))
+            self.update_temp_ac_values()
+            self.trade_rules()
             self.entry()
-            self.update_ac_values()
+        self.prices = None
+        self.update_temp_ac_values()
+
+    def unrealised_pnls(self, prices: np.ndarray) -> np.ndarray:
+        '''unrealised_pnl() of the open trades at each of prices, same order of additions and rounding
+        '''
+        pnl = np.concatenate((self.longs.values('SIZE') * (prices[:, None] - self.longs.values('ENTRY')),
+                              self.shorts.values('SIZE') * (self.shorts.values('ENTRY') - prices[:, None])), axis=1)
+        return np.round(pnl.cumsum(axis=1)[:, -1], 2) if pnl.shape[1] > 0 else np.zeros(len(prices))
+
+    def equity_triggers(self, net_bal: np.ndarray, unrealised_pnl: np.ndarray, margin_used: float) -> np.ndarray:
+        '''Bars on which margin call, a margin / max unrealised pnl stop loss or cash out can fire
+        '''
+        triggers = net_bal < margin_used * self.MC_PERCENT
+        if self.stop_loss_type in ('grid_count_on_margin', 'oldest_on_margin', 'farthest_on_margin'):
+            triggers |= net_bal < margin_used * self.margin_sl_percent
+        elif self.stop_loss_type in ('max_unrealised_pnl', 'max_unrealised_pnl_farthest', 'grid_count_max_unrealised_pnl'):
+            triggers |= net_bal * self.max_unrealised_pnl < -unrealised_pnl
+        if self.cash_out_factor is not None:
+            triggers |= net_bal > self.init_bal * self.cash_out_factor
+        return triggers
+
+    def skip(self, start: int, end: int) -> int:
+        '''Fill bars [start, end) in bulk up to the first one that can trigger anything, returns that bar
+        A bar triggers nothing while mid_c (its high / low with intrabar) stays between the trigger_levels() and no equity_triggers()
+        fires, such a bar only carries the positions over and moves unrealised_pnl and net_bal with the price.
+        Covering of stopped losses enters on every bar, so nothing is skipped while uncovered_pip_position > 0.
+        '''
+        mid = self.d.fview('mid_c')
+        high, low = (self.d.fview('mid_h'), self.d.fview('mid_l')) if self.intrabar else (mid, mid)
+        if start >= end or self.d.fget('uncovered_pip_position', start-1) > 0:
+            return start
+        up, down = self.trigger_levels()
+        if high[start] >= up or low[start] <= down:
+            return start
+
+        cum_long_position = self.d.fget('cum_long_position', start-1)
+        cum_short_position = self.d.fget('cum_short_position', start-1)
+        margin_used = (cum_long_position + cum_short_position) * float(self.d.ticker['marginRate'])
+        i, rows = start, self.SKIP_ROWS
+        while i < end:
+            j = min(i + rows, end)
+            prices = mid[i:j]
+            crossed = (high[i:j] >= up) | (low[i:j] <= down)
+            n = int(crossed.argmax()) if crossed.any() else len(prices)
+            # ac_bal of the previous bar plus a realised_pnl of 0, as in current_ac_values()
+            prev_ac_bal = np.full(n, round(self.d.fget('ac_bal', i-1) + 0.0, 2))
+            prev_ac_bal[:1] = self.d.fget('ac_bal', i-1)
+            unrealised_pnl = self.unrealised_pnls(prices[:n])
+            triggers = self.equity_triggers(prev_ac_bal + 0.0 + unrealised_pnl, unrealised_pnl, margin_used)
+            if triggers.any():
+                n = int(triggers.argmax())
+            if n == 0:
+                break
+
+            ac_bal = np.round(prev_ac_bal[:n] + 0.0, 2)
+            self.d.fill_fdata('cum_long_position', i, i+n, cum_long_position)
+            self.d.fill_fdata('cum_short_position', i, i+n, cum_short_position)
+            self.d.fill_fdata('uncovered_pip_position', i, i+n, self.d.fget('uncovered_pip_position', i-1))
+            self.d.fill_fdata('unrealised_pnl', i, i+n, unrealised_pnl[:n])
+            self.d.fill_fdata('realised_pnl', i, i+n, 0)
+            self.d.fill_fdata('ac_bal', i, i+n, ac_bal)
+            self.d.fill_fdata('net_bal', i, i+n, np.round(ac_bal + unrealised_pnl[:n], 2))
+            self.d.fill_fdata('margin_used', i, i+n, round(margin_used, 2))
+            if self.cash_out_factor is not None:
+                self.d.fill_fdata('cash_bal', i, i+n, self.d.fget('cash_bal', i-1))
+                self.d.fill_fdata('gross_bal', i, i+n, np.round(ac_bal + self.d.fget('cash_bal', i-1), 2))
+            else:
+                self.d.fill_fdata('gross_bal', i, i+n, ac_bal)
+            i = i + n
+            if n < len(prices):
+                break
+            rows = min(rows * 2, self.SKIP_MAX_ROWS)
+        return i
+
+    def snapshot(self, path: str, max_bytes: int=None):
+        '''Write all state at the end of bar self.i to {path}/{name}-{i}.npz
+        With max_bytes, the oldest snapshots of this simulation are deleted while they take more than max_bytes, the newest is always kept
+        '''
+        os.makedirs(path, exist_ok=True)
+        state = self.d.save_state(self.i, cols=self.add_cols)
+        state['sim'] = np.array(json.dumps(dict(
+            name=self.name,
+            datalen=self.d.fdatalen,
+            params={p: getattr(self, p) for p in self.SNAPSHOT_PARAMS},
+            trade_no=self.trade_no,
+            next_up_grid=float(self.next_up_grid),
+            next_down_grid=float(self.next_down_grid),
+            cover_sl_direction=self.cover_sl_direction
+        ), default=lambda v: v.item()))
+        file = os.path.join(path, f'{self.name}-{self.i:010d}.npz')
+        # Write then rename so a crash while writing never leaves a broken latest snapshot
+        with open(f'{file}.tmp', 'wb') as f:
+            np.savez_compressed(f, **state)
+        os.replace(f'{file}.tmp', file)
+
+        if max_bytes is not None:
+            snapshots = self.snapshots(path)
+            while len(snapshots) > 1 and sum(os.path.getsize(f) for f in snapshots) > max_bytes:
+                os.remove(snapshots.pop(0))
+        return file
+
+    def snapshots(self, path: str) -> list:
+        '''Snapshot files of this simulation in path, oldest first
+        '''
+        return sorted(glob.glob(os.path.join(glob.escape(path), f'{glob.escape(self.name)}-*.npz')))
+
+    def restore(self, file: str) -> int:
+        '''Load a snapshot written by snapshot(), returns the bar it was taken at
+        '''
+        with np.load(file, allow_pickle=False) as npz:
+            state = {k: npz[k] for k in npz.files}
+        sim = json.loads(state.pop('sim').item())
+        assert sim['datalen'] == self.d.fdatalen, f"Snapshot of {sim['datalen']} bars, data has {self.d.fdatalen}"
+        params = {p: getattr(self, p) for p in self.SNAPSHOT_PARAMS}
+        assert sim['params'] == params, f"Snapshot params {sim['params']} differ from {params}"
+        self.i = self.d.load_state(state)
+        self.trade_no = sim['trade_no']
+        self.next_up_grid = sim['next_up_grid']
+        self.next_down_grid = sim['next_down_grid']
+        self.cover_sl_direction = sim['cover_sl_direction']
+        return self.i
+
+    def resume(self, snapshot: str, snapshot_every: int=None, snapshot_max_bytes: int=None):
+        '''Continue a run from a snapshot file, or the latest snapshot of this simulation in a directory
+        The simulator must be created with the same data and parameters as the interrupted run
+        '''
+        if os.path.isdir(snapshot):
+            snapshots = self.snapshots(snapshot)
+            assert len(snapshots) > 0, f'No snapshot of {self.name} in {snapshot}'
+            snapshot = snapshots[-1]
+        i = self.restore(snapshot)
+        self.run_sim(start=i+1, snapshot_path=os.path.dirname(snapshot) if snapshot_every else None,
+                     snapshot_every=snapshot_every, snapshot_max_bytes=snapshot_max_bytes)
+
+    def run_kernel(self):
+        '''The whole run as one call of grid_kernel.run(), columns, events, ledger and open trades left as run_sim() leaves them
+        '''
+        prices = np.vstack([self.d.fview(col) for col in ('mid_c', 'bid_c', 'ask_c')]).astype(np.float64)
+        points, on_grid = to_points_array(prices, self.scale)
+        none_nan = lambda v: np.nan if v is None else float(v)
+        out, events, ledger_ints, ledger_values, trades, ints, trade_nos, count, trade_no, next_up_grid, next_down_grid = grid_kernel.run(
+            prices, points, on_grid, self.scale, float(self.d.ticker['marginRate']), float(pow(10, -self.d.ticker['pipLocation'])),
+            self.MC_PERCENT, float(self.init_bal), int(self.init_trade_size), float(self.sizing_ratio), self.sizing == 'dynamic',
+            float(self.tp_pips * pow(10, self.d.ticker['pipLocation'])), float(self.sl_pips * pow(10, self.d.ticker['pipLocation'])),
+            grid_kernel.STOP_LOSS_TYPES.index(self.stop_loss_type), none_nan(self.margin_sl_percent), none_nan(self.max_unrealised_pnl),
+            self.cash_out_factor is not None, np.nan if self.cash_out_factor is None else float(self.init_bal * self.cash_out_factor),
+            bool(self.trailing_sl), 64)
+
+        for col, values in zip(grid_kernel.COLS, out):
+            self.d.fill_fdata(col, 0, self.d.fdatalen, values)
+        names = (self.EVENT_ADJUST, self.EVENT_MC, self.EVENT_SL, self.EVENT_TP, self.EVENT_CASH_OUT, self.EVENT_CASH_IN, self.EVENT_ENTRY)
+        for i in np.flatnonzero(events).tolist():
+            self.d.update_fdata('events', i, [name for bit, name in enumerate(names) if events[i] >> bit & 1])
+
+        self.ledger.load_state(dict(
+            bar=ledger_ints[:, grid_kernel.BAR],
+            kind=ledger_ints[:, grid_kernel.KIND].astype(np.int8),
+            side=np.where(ledger_ints[:, grid_kernel.SIDE] == grid_kernel.LONG, self.LONG, self.SHORT).astype(np.int8),
+            trade_no=ledger_ints[:, grid_kernel.TRADE_NO],
+            parent=np.full(len(ledger_ints), -1, dtype=np.int64),
+            values=ledger_values
+        ))
+        for side, book in ((grid_kernel.LONG, self.longs), (grid_kernel.SHORT, self.shorts)):
+            for k in np.flatnonzero(ints[side, grid_kernel.ACTIVE, :count]).tolist():
+                book.open(int(trade_nos[k]), (int(ints[side, grid_kernel.SIZE, k]), trades[side, grid_kernel.ENTRY, k], trades[side, grid_kernel.TP_LEVEL, k],
+                                              trades[side, grid_kernel.SL_LEVEL, k], self.ORIG_TRADE, trades[side, grid_kernel.TSL_LEVEL, k]))
+        self.i = self.d.fdatalen - 1
+        self.trade_no, self.next_up_grid, self.next_down_grid = trade_no, next_up_grid, next_down_grid
+        self.cover_sl_direction = None
+
+    def trade_rules(self):
+        '''Trailing SL, margin call, stop loss and take profit of bar self.i at its prices
+        '''
+        if self.trailing_sl:
+            self.update_trailing_sl()
+        self.margin_call()
+        self.stop_loss()
+        if self.trailing_sl:
+            self.take_profit_tsl()
+        else:
+            self.take_profit()
+
+    def step(self):
+        '''Simulate bar self.i
+        '''
+        # Trades closed on this bar, the ledger keeps the history
+        self.closed_longs, self.closed_shorts = dict(), dict()
+        self.realised_points = 0
+        # self.calculate_values(init=True)
+        if self.i == 0:
+            self.update_init_values()
+        else:
+            self.update_temp_ac_values(init=True)
+            if self.intrabar:
+                self.intrabar_steps()
+            self.trade_rules()
+            self.cash_transfer()
+        self.entry()
+        self.update_ac_values()
+
+    def run_sim(self, start: int=0, snapshot_path: str=None, snapshot_every: int=None, snapshot_max_bytes: int=None):
+        '''start > 0 only through resume()
+        snapshot_path / snapshot_every: write a snapshot every snapshot_every bars, capped at snapshot_max_bytes on disk
+        With skip_bars, the bars after each simulated bar that cannot trigger anything are filled in bulk by skip()
+        With kernel, a run from the first bar without snapshots goes through run_kernel()
+        With intrabar, the levels a bar touches between closes are traded first, see intrabar_steps()
+        '''
+        snapshots = snapshot_path is not None and snapshot_every
+        if self.kernel and start == 0 and not snapshots:
+            return self.run_kernel()
+        progress = tqdm(initial=start, total=self.d.fdatalen, desc=" Simulating... ")
+        i = start
+        while i < self.d.fdatalen:
+            self.i = i
+            self.step()
             # print(i, self.d.df[self.name].iloc[self.i])
             # print(self.d.print_row(self.i))
+            if snapshots and (i + 1) % snapshot_every == 0 and i + 1 < self.d.fdatalen:
+                self.snapshot(snapshot_path, max_bytes=snapshot_max_bytes)
+
+            next_i = i + 1
+            if self.skip_bars:
+                # Never skip over a snapshot bar, it is simulated so the snapshot is taken there
+                end = min(self.d.fdatalen, ((i + 1) // snapshot_every + 1) * snapshot_every - 1) if snapshots else self.d.fdatalen
+                next_i = self.skip(i + 1, end)
+            progress.update(next_i - i)
+            i = next_i
+        progress.close()
 
         # return self.d.df[self.name].copy()
+
+    def stream_record(self, i: int, kind: str) -> dict:
+        '''Record of row i of the current chunk, kind 'event' (with its events and closed trades) or 'equity'
+        '''
+        record = dict(kind=kind, bar=self.d.offsets[self.name] + i, time=str(to_datetime(self.d.fget('time', i))))
+        record.update({col: float(self.d.fget(col, i)) for col in self.STREAM_COLS})
+        if kind == 'event':
+            record['events'] = list(self.d.fcell('events', i, list))
+            record['closed_longs'] = {int(trade_no): trade for trade_no, trade in self.closed_longs.items()}
+            record['closed_shorts'] = {int(trade_no): trade for trade_no, trade in self.closed_shorts.items()}
+            record['open_longs'], record['open_shorts'] = len(self.longs), len(self.shorts)
+        return record
+
+    def stream(self, chunks, sample_every: int=None):
+        '''Generator of the records of a run over df, then over each following candle frame of chunks (see data.read_chunks)
+        Yields an 'event' record for every bar with events and an 'equity' record every sample_every bars, in bar order.
+        Only one chunk of bars is held at a time and the ledger is cleared after each, so memory stays flat over any history.
+        Nothing is kept for export(), the records are the result.
+        '''
+        if self.intrabar:
+            raise ValueError('stream does not support intrabar')
+        chunks = iter(chunks)
+        progress = tqdm(desc=" Streaming... ")
+        start = 0
+        while True:
+            records = list()
+            i = start
+            while i < self.d.fdatalen:
+                self.i = i
+                self.step()
+                if len(self.d.fcell('events', i, list)) > 0:
+                    records.append(self.stream_record(i, 'event'))
+                i = self.skip(i + 1, self.d.fdatalen) if self.skip_bars else i + 1
+            if sample_every:
+                rows = np.arange(start, self.d.fdatalen)
+                rows = rows[(self.d.offsets[self.name] + rows) % sample_every == 0]
+                records = records + [self.stream_record(i, 'equity') for i in rows.tolist()]
+            records.sort(key=lambda record: record['bar'])
+            yield from records
+            progress.update(self.d.fdatalen - start)
+
+            chunk = next(chunks, None)
+            if chunk is None:
+                break
+            self.ledger.clear()
+            self.d.next_chunk(self.name, chunk)
+            start = 1
+        progress.close()
+
+    def run_stream(self, chunks, sink, sample_every: int=None) -> int:
+        '''Write the records of stream() to sink, returns how many
+        sink: path of a json lines file (appended to), a queue (put) or a callable taking each record
+        '''
+        if type(sink) == str:
+            with open(sink, 'a') as f:
+                return self.run_stream(chunks, lambda record: f.write(json.dumps(record, default=lambda v: v.item()) + '\n'), sample_every)
+        emit = sink.put if hasattr(sink, 'put') else sink
+        count = 0
+        for record in self.stream(chunks, sample_every):
+            emit(record)
+            count = count + 1
+        return count
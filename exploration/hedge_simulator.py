@@ -1,9 +1,10 @@
 from data import Data
+from grid_engine import GridEngine
 from tqdm import trange
 import pandas as pd
 from random import choice
 
-class GridSimulator:
+class GridSimulator(GridEngine):
 
     EVENT_ENTRY, EVENT_HEDGE_ENTRY, EVENT_PENDING, EVENT_CANCEL_PEND = 'ENT', 'HEDGE', 'PEND', 'PENDC'
     EVENT_TP, EVENT_REDUCE, EVENT_SQUEEZE, EVENT_MC = 'TP', 'RED', 'SQ', 'MC'
@@ -12,6 +13,7 @@ class GridSimulator:
     OPEN_KEYS = ('SIZE', 'ENT', 'TP', 'HEDGE')
     PEND_KEYS = ('SIZE', 'ENT')
     CLOSED_KEYS = ('SIZE', 'ENT', 'EXIT', 'PIPS')
+    LONG_MARK, SHORT_MARK = 'bid_c', 'ask_c'
     LONG, SHORT = 1, -1
     MC_PERCENT = 0.50
 
@@ -47,7 +49,7 @@ class GridSimulator:
         self.keep_percent = keep_percent
 
         self.d = Data(
-            source=df.copy(),
+            source=df,
             ticker=ticker,
             cols=['time', 'mid_c', 'bid_c', 'ask_c', 'atr_c'],
             instruments=instruments
@@ -82,14 +84,6 @@ class GridSimulator:
 
         self.d.prepare_fast_data(name=name, add_cols=add_cols)
 
-    def get_open_longs(self, i: int=None):
-        i = self.i if i is None else i
-        return self.d.to_dict_of_dicts('open_longs', self.OPEN_KEYS, i)
-    
-    def get_open_shorts(self, i: int=None):
-        i = self.i if i is None else i
-        return self.d.to_dict_of_dicts('open_shorts', self.OPEN_KEYS, i)
-    
     def get_pending_longs(self, i: int=None):
         i = self.i if i is None else i
         return self.d.to_dict_of_dicts('pending_longs', self.PEND_KEYS, i)
@@ -98,26 +92,6 @@ class GridSimulator:
         i = self.i if i is None else i
         return self.d.to_dict_of_dicts('pending_shorts', self.PEND_KEYS, i)
     
-    def get_closed_longs(self, i: int=None):
-        i = self.i if i is None else i
-        return self.d.to_dict_of_dicts('closed_longs', self.CLOSED_KEYS, i)
-    
-    def get_closed_shorts(self, i: int=None):
-        i = self.i if i is None else i
-        return self.d.to_dict_of_dicts('closed_shorts', self.CLOSED_KEYS, i)
-    
-    def update_open_longs(self, open_longs: dict):
-        open_longs_tuple = dict()
-        for trade_no, trade in open_longs.items():
-            open_longs_tuple[trade_no] = tuple(trade.values())
-        self.d.update_fdata('open_longs', self.i, open_longs_tuple)
-
-    def update_open_shorts(self, open_shorts: dict):
-        open_shorts_tuple = dict()
-        for trade_no, trade in open_shorts.items():
-            open_shorts_tuple[trade_no] = tuple(trade.values())
-        self.d.update_fdata('open_shorts', self.i, open_shorts_tuple)
-
     def update_pending_longs(self, pending_longs: dict):
         pending_longs_tuple = dict()
         for trade_no, trade in pending_longs.items():
@@ -130,32 +104,6 @@ class GridSimulator:
             pending_shorts_tuple[trade_no] = tuple(trade.values())
         self.d.update_fdata('pending_shorts', self.i, pending_shorts_tuple)
 
-    def update_closed_longs(self, closed_longs: dict):
-        closed_longs_tuple = dict()
-        for trade_no, trade in closed_longs.items():
-            closed_longs_tuple[trade_no] = tuple(trade.values())
-        self.d.update_fdata('closed_longs', self.i, closed_longs_tuple)
-
-    def update_closed_shorts(self, closed_shorts: dict):
-        closed_shorts_tuple = dict()
-        for trade_no, trade in closed_shorts.items():
-            closed_shorts_tuple[trade_no] = tuple(trade.values())
-        self.d.update_fdata('closed_shorts', self.i, closed_shorts_tuple)
-    
-    def cum_long_position(self):
-        open_longs = self.get_open_longs()
-        cum_long_position = 0
-        for _, trade in open_longs.items():
-            cum_long_position = cum_long_position + trade['SIZE']
-        return cum_long_position
-
-    def cum_short_position(self):
-        open_shorts = self.get_open_shorts()
-        cum_short_position = 0
-        for _, trade in open_shorts.items():
-            cum_short_position = cum_short_position + trade['SIZE']
-        return cum_short_position
-
     def cum_long_pending(self):
         pending_longs = self.get_pending_longs()
         cum_long_pending = 0
@@ -170,54 +118,6 @@ class GridSimulator:
             cum_short_pending = cum_short_pending + trade['SIZE']
         return cum_short_pending
 
-    def unrealised_pnl(self):
-        open_longs = self.get_open_longs()
-        open_shorts = self.get_open_shorts()
-        pnl = 0
-        for _, trade in open_longs.items():
-            pnl = pnl + trade['SIZE'] * (self.d.fdata('bid_c', self.i) - trade['ENT'])
-        for _, trade in open_shorts.items():
-            pnl = pnl + trade['SIZE'] * (trade['ENT'] - self.d.fdata('ask_c', self.i))
-        return round(pnl, 2)
-    
-    def realised_pnl(self):
-        closed_longs = self.get_closed_longs()
-        closed_shorts = self.get_closed_shorts()
-        pnl = 0
-        for _, trade in closed_longs.items():
-            pnl = pnl + trade['SIZE'] * (trade['EXIT'] - trade['ENT'])
-        for _, trade in closed_shorts.items():
-            pnl = pnl + trade['SIZE'] * (trade['ENT'] - trade['EXIT'])
-        return round(pnl, 2)
-
-    def current_ac_values(self):
-        ac_bal = self.d.fdata('ac_bal', self.i-1) + self.d.fdata('realised_pnl', self.i)
-        margin_used = (self.d.fdata('cum_long_position', self.i) + 
-                       self.d.fdata('cum_short_position', self.i)) * float(self.d.ticker['marginRate'])
-        net_bal = ac_bal + self.d.fdata('unrealised_pnl', self.i)
-        return ac_bal, net_bal, margin_used      
-
-    def update_temp_ac_values(self, init: bool=False):
-        if init:
-            self.d.update_fdata('open_longs', self.i, self.d.fdata('open_longs', self.i-1))
-            self.d.update_fdata('open_shorts', self.i, self.d.fdata('open_shorts', self.i-1))
-            self.d.update_fdata('cum_long_position', self.i, self.d.fdata('cum_long_position', self.i-1))
-            self.d.update_fdata('cum_short_position', self.i, self.d.fdata('cum_short_position', self.i-1))
-            self.d.update_fdata('open_long_count', self.i, len(self.get_open_longs(self.i-1)))
-            self.d.update_fdata('open_short_count', self.i, len(self.get_open_shorts(self.i-1)))
-            self.d.update_fdata('closed_long_count', self.i, len(self.get_closed_longs(self.i-1)))
-            self.d.update_fdata('closed_short_count', self.i, len(self.get_closed_shorts(self.i-1)))
-        else:
-            self.d.update_fdata('cum_long_position', self.i, self.cum_long_position())
-            self.d.update_fdata('cum_short_position', self.i, self.cum_short_position())
-            self.d.update_fdata('open_long_count', self.i, len(self.get_open_longs()))
-            self.d.update_fdata('open_short_count', self.i, len(self.get_open_shorts()))
-            self.d.update_fdata('closed_long_count', self.i, len(self.get_closed_longs()))
-            self.d.update_fdata('closed_short_count', self.i, len(self.get_closed_shorts()))
-        
-        self.d.update_fdata('unrealised_pnl', self.i, self.unrealised_pnl())
-        self.d.update_fdata('realised_pnl', self.i, self.realised_pnl())
-
     def update_ac_values(self):
         self.d.update_fdata('cum_long_position', self.i, self.cum_long_position())
         self.d.update_fdata('cum_short_position', self.i, self.cum_short_position())
@@ -247,12 +147,6 @@ class GridSimulator:
     def calc_trade_size(self):
         return 10
     
-    def update_events(self, event):
-        events = self.d.fdata('events', self.i) if type(self.d.fdata('events', self.i)) == list else list()
-        if event not in events:
-            events.append(event)
-            self.d.update_fdata('events', self.i, events)
-
     def close_long(self, trade_no: int):
         # Remove from open longs
         open_longs = self.get_open_longs()
@@ -311,8 +205,8 @@ class GridSimulator:
                 if dir == self.LONG:
                     self.trigger = self.d.fdata('ask_c', self.i)
                     
-                    long_tp = round(self.trigger + tp_pips * pow(10, self.d.ticker['pipLocation']), 5)
-                    long_hedge = round(self.trigger - hedge_pips * pow(10, self.d.ticker['pipLocation']), 5)
+                    long_tp = self.level(self.trigger, tp_pips)
+                    long_hedge = self.level(self.trigger, -hedge_pips)
                     open_longs[self.trade_no] = dict(
                         SIZE=trade_size,
                         ENT=self.d.fdata('ask_c', self.i),
@@ -324,8 +218,8 @@ class GridSimulator:
 
                 if dir == self.SHORT:
                     self.trigger = self.d.fdata('bid_c', self.i)
-                    short_tp = round(self.trigger - tp_pips * pow(10, self.d.ticker['pipLocation']), 5)  
-                    short_hedge = round(self.trigger + hedge_pips * pow(10, self.d.ticker['pipLocation']), 5)
+                    short_tp = self.level(self.trigger, -tp_pips)  
+                    short_hedge = self.level(self.trigger, hedge_pips)
                     open_shorts[self.trade_no] = dict(
                         SIZE=trade_size,
                         ENT=self.d.fdata('bid_c', self.i),
@@ -362,24 +256,6 @@ class GridSimulator:
     def reduce(self):
         pass
 
-    def margin_call(self):
-        _, net_bal, margin_used = self.current_ac_values()
-        traded = False
-        if net_bal < margin_used * self.MC_PERCENT:
-            open_longs = self.get_open_longs()
-            for trade_no, trade in open_longs.items():
-                self.close_long(trade_no)
-                traded = True
-
-            open_shorts = self.get_open_shorts()
-            for trade_no, trade in open_shorts.items():
-                self.close_short(trade_no)
-                traded = True
-
-        if traded:
-            self.update_temp_ac_values()
-            self.update_events(self.EVENT_MC)               
-
     def update_init_values(self):
         self.trade_no = 0
         self.next_up_grid = self.d.fdata('mid_c', 0)
@@ -1,4 +1,5 @@
 from hedged_grid_simulator import GridSimulator
+from data import read_candles, time_window, parse_cell, save_result
 from tabulate import tabulate
 import pandas as pd
 
@@ -80,12 +81,12 @@ class GridOptimizer:
         )
 
     def read_data(self, ticker: str, frequency: str):
-        df = pd.read_pickle(f"{self.data_path}{ticker}_{frequency}.pkl")
+        df = read_candles(self.data_path, ticker, frequency)
         return df
     
     def to_dict(self, data):
         if type(data) == str:
-            data = eval(data)
+            data = parse_cell(data)
         elif type(data) == dict:
             data = data
         else:
@@ -101,7 +102,9 @@ class GridOptimizer:
         return result
     
     def save_files(self, inputs_df, ticker, frequency):
-        result = self.sim.d.df[self.sim.name].copy()
+        result = self.sim.d.export(self.sim.name)
+        if 'npz' in self.records:
+            save_result(result[~result.events.isnull()], f'{self.out_path}{self.sim.name}-events.npz')
         if 'events' in self.records:
             result[~result.events.isnull()].to_csv(f'{self.out_path}{self.sim.name}-events.csv', index=False)
             result = self.trade_no_only(result)
@@ -150,7 +153,7 @@ class GridOptimizer:
 
         def inputs_list():
             gross_bal = self.sim.d.df[self.sim.name].iloc[-1]['gross_bal']
-            start, end = self.sim.d.df[self.sim.name].iloc[0]['time'], self.sim.d.df[self.sim.name].iloc[-1]['time']
+            start, end = self.sim.d.time_range(self.sim.name)
             header = ['sim_name', 'start', 'end', 'init_bal', 'init_trade_size', 'grid_pips', 'sl_grid_count', 'stoploss_pips', 'notrade_margin_percent', 'notrade_count', 'tp_factor', 'sizing', 'cash_out_factor', 'trailing_sl', 'gross_bal']
             inputs = [sim_name, start, end, init_bal, init_trade_size, grid_pips, sl_grid_count, grid_pips * sl_grid_count, notrade_margin_percent, notrade_count, tp_factor, sizing, cash_out_factor, trailing_sl, gross_bal]
             print(tabulate([inputs], header, tablefmt='plain'))
@@ -169,7 +172,7 @@ class GridOptimizer:
     def run_optimizer(self):
         for tk in self.tickers:
             for f in self.frequency:
-                df = self.read_data(tk, f).iloc[self.start:self.end]
+                df = time_window(self.read_data(tk, f), self.start, self.end)
                 for ib in self.init_bal:
                     for t in self.init_trade_size:
                         for s in self.sizing:
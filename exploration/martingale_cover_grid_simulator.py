@@ -1,10 +1,11 @@
 from data import Data
+from grid_engine import GridEngine
 from tqdm import trange
 import pandas as pd
 from collections import deque
 from random import choice
 
-class GridSimulator:
+class GridSimulator(GridEngine):
 
     EVENT_ENTRY, EVENT_COVER = 'ENT', 'COV'
     EVENT_TP, EVENT_SL, EVENT_MC, EVENT_TSL_ADJUST = 'TP', 'SL', 'MC', 'TSLADJ'
@@ -50,7 +51,7 @@ class GridSimulator:
         self.trailing_sl = trailing_sl
 
         self.d = Data(
-            source=df.copy(),
+            source=df,
             ticker=ticker,
             cols=['time', 'mid_c', 'bid_c', 'ask_c'],
             instruments=instruments
@@ -80,178 +81,16 @@ class GridSimulator:
 
         self.d.prepare_fast_data(name=name, add_cols=add_cols)
 
-    def get_open_longs(self, i: int=None):
-        i = self.i if i is None else i
-        return self.d.to_dict_of_dicts('open_longs', self.OPEN_KEYS, i)
-    
-    def get_open_shorts(self, i: int=None):
-        i = self.i if i is None else i
-        return self.d.to_dict_of_dicts('open_shorts', self.OPEN_KEYS, i)
-    
-    def get_closed_longs(self, i: int=None):
-        i = self.i if i is None else i
-        return self.d.to_dict_of_dicts('closed_longs', self.CLOSED_KEYS, i)
-    
-    def get_closed_shorts(self, i: int=None):
-        i = self.i if i is None else i
-        return self.d.to_dict_of_dicts('closed_shorts', self.CLOSED_KEYS, i)
-    
-    def update_open_longs(self, open_longs: dict):
-        open_longs_tuple = dict()
-        for trade_no, trade in open_longs.items():
-            open_longs_tuple[trade_no] = tuple(trade.values())
-        self.d.update_fdata('open_longs', self.i, open_longs_tuple)
-
-    def update_open_shorts(self, open_shorts: dict):
-        open_shorts_tuple = dict()
-        for trade_no, trade in open_shorts.items():
-            open_shorts_tuple[trade_no] = tuple(trade.values())
-        self.d.update_fdata('open_shorts', self.i, open_shorts_tuple)
-
-    def update_closed_longs(self, closed_longs: dict):
-        closed_longs_tuple = dict()
-        for trade_no, trade in closed_longs.items():
-            closed_longs_tuple[trade_no] = tuple(trade.values())
-        self.d.update_fdata('closed_longs', self.i, closed_longs_tuple)
-
-    def update_closed_shorts(self, closed_shorts: dict):
-        closed_shorts_tuple = dict()
-        for trade_no, trade in closed_shorts.items():
-            closed_shorts_tuple[trade_no] = tuple(trade.values())
-        self.d.update_fdata('closed_shorts', self.i, closed_shorts_tuple)
-    
-    def cum_long_position(self):
-        open_longs = self.get_open_longs()
-        cum_long_position = 0
-        for _, trade in open_longs.items():
-            cum_long_position = cum_long_position + trade['SIZE']
-        return cum_long_position
-
-    def cum_short_position(self):
-        open_shorts = self.get_open_shorts()
-        cum_short_position = 0
-        for _, trade in open_shorts.items():
-            cum_short_position = cum_short_position + trade['SIZE']
-        return cum_short_position
-
-    def unrealised_pnl(self):
-        open_longs = self.get_open_longs()
-        open_shorts = self.get_open_shorts()
-        pnl = 0
-        for _, trade in open_longs.items():
-            pnl = pnl + trade['SIZE'] * (self.d.fdata('mid_c', self.i) - trade['ENT'])
-        for _, trade in open_shorts.items():
-            pnl = pnl + trade['SIZE'] * (trade['ENT'] - self.d.fdata('mid_c', self.i))
-        return round(pnl, 2)
-    
-    def realised_pnl(self):
-        closed_longs = self.get_closed_longs()
-        closed_shorts = self.get_closed_shorts()
-        pnl = 0
-        for _, trade in closed_longs.items():
-            pnl = pnl + trade['SIZE'] * (trade['EXIT'] - trade['ENT'])
-        for _, trade in closed_shorts.items():
-            pnl = pnl + trade['SIZE'] * (trade['ENT'] - trade['EXIT'])
-        return round(pnl, 2)
-    
-    def cash_transfer(self):
-        _, net_bal, _ = self.current_ac_values()
-        if self.cash_out_factor is not None:
-            self.d.update_fdata('cash_bal', self.i, self.d.fdata('cash_bal', self.i-1))
-            cash_out_threshold = self.init_bal * self.cash_out_factor
-            events = self.d.fdata('events', self.i) if type(self.d.fdata('events', self.i)) == list else list()
-            stop_loss = self.EVENT_SL in events or self.EVENT_MC in events
-            # Cash out / withdraw
-            if net_bal > cash_out_threshold:
-                cash_out = net_bal - cash_out_threshold
-                self.d.update_fdata('ac_bal', self.i, round(self.d.fdata('ac_bal', self.i-1) - cash_out, 2))
-                self.d.update_fdata('cash_bal', self.i, round(self.d.fdata('cash_bal', self.i) + cash_out, 2))
-                self.update_events(self.EVENT_CASH_OUT)
-                return cash_out
-            # Deposit money into a/c when net_bal < cash_out_threshold
-            elif stop_loss and net_bal < cash_out_threshold:
-                cash_in = min(cash_out_threshold - net_bal, self.d.fdata('cash_bal', self.i))
-                if cash_in > 0:
-                    self.d.update_fdata('ac_bal', self.i, round(self.d.fdata('ac_bal', self.i-1) + cash_in, 2))
-                    self.d.update_fdata('cash_bal', self.i, round(self.d.fdata('cash_bal', self.i) - cash_in, 2))
-                    self.update_events(self.EVENT_CASH_IN)    
-                    return cash_in  
-
-    def current_ac_values(self):
-        ac_bal = self.d.fdata('ac_bal', self.i-1) + self.d.fdata('realised_pnl', self.i)
-        margin_used = (self.d.fdata('cum_long_position', self.i) + 
-                       self.d.fdata('cum_short_position', self.i)) * float(self.d.ticker['marginRate'])
-        net_bal = ac_bal + self.d.fdata('unrealised_pnl', self.i)
-        return ac_bal, net_bal, margin_used      
-
-    def update_temp_ac_values(self, init: bool=False):
-        if init:
-            self.d.update_fdata('open_longs', self.i, self.d.fdata('open_longs', self.i-1))
-            self.d.update_fdata('open_shorts', self.i, self.d.fdata('open_shorts', self.i-1))
-            self.d.update_fdata('cum_long_position', self.i, self.d.fdata('cum_long_position', self.i-1))
-            self.d.update_fdata('cum_short_position', self.i, self.d.fdata('cum_short_position', self.i-1))
-            self.d.update_fdata('open_long_count', self.i, len(self.get_open_longs(self.i-1)))
-            self.d.update_fdata('open_short_count', self.i, len(self.get_open_shorts(self.i-1)))
-            self.d.update_fdata('closed_long_count', self.i, len(self.get_closed_longs(self.i-1)))
-            self.d.update_fdata('closed_short_count', self.i, len(self.get_closed_shorts(self.i-1)))
-        else:
-            self.d.update_fdata('cum_long_position', self.i, self.cum_long_position())
-            self.d.update_fdata('cum_short_position', self.i, self.cum_short_position())
-            self.d.update_fdata('open_long_count', self.i, len(self.get_open_longs()))
-            self.d.update_fdata('open_short_count', self.i, len(self.get_open_shorts()))
-            self.d.update_fdata('closed_long_count', self.i, len(self.get_closed_longs()))
-            self.d.update_fdata('closed_short_count', self.i, len(self.get_closed_shorts()))
-        
-        self.d.update_fdata('unrealised_pnl', self.i, self.unrealised_pnl())
-        self.d.update_fdata('realised_pnl', self.i, self.realised_pnl())
-
-    def update_ac_values(self):
-        self.d.update_fdata('cum_long_position', self.i, self.cum_long_position())
-        self.d.update_fdata('cum_short_position', self.i, self.cum_short_position())
-        self.d.update_fdata('open_long_count', self.i, len(self.get_open_longs()))
-        self.d.update_fdata('open_short_count', self.i, len(self.get_open_shorts()))
-        self.d.update_fdata('closed_long_count', self.i, len(self.get_closed_longs()))
-        self.d.update_fdata('closed_short_count', self.i, len(self.get_closed_shorts()))
-
-        self.d.update_fdata('unrealised_pnl', self.i, self.unrealised_pnl())
-        self.d.update_fdata('realised_pnl', self.i, self.realised_pnl())
-        
-        # First candle
-        if self.i == 0:               
-            self.d.update_fdata('ac_bal', self.i, self.init_bal)
-        # Subsequent candles
-        else:
-            events = self.d.fdata('events', self.i) if type(self.d.fdata('events', self.i)) == list else list()
-            cash_transfer = self.EVENT_CASH_IN in events or self.EVENT_CASH_OUT in events
-            ac_bal = self.d.fdata('ac_bal', self.i) if cash_transfer else self.d.fdata('ac_bal', self.i-1)
-            self.d.update_fdata('ac_bal', self.i, round(ac_bal + self.d.fdata('realised_pnl', self.i), 2))
-
-        self.d.update_fdata('net_bal', self.i, round(self.d.fdata('ac_bal', self.i) + self.d.fdata('unrealised_pnl', self.i), 2))
-        self.d.update_fdata('margin_used', self.i, \
-                            round((self.d.fdata('cum_long_position', self.i) + 
-                                   self.d.fdata('cum_short_position', self.i)) * float(self.d.ticker['marginRate']), 2))
-        
-        if self.cash_out_factor is not None:
-            self.d.update_fdata('gross_bal', self.i, round(self.d.fdata('ac_bal', self.i) + self.d.fdata('cash_bal', self.i), 2))
-        else:
-            self.d.update_fdata('gross_bal', self.i, self.d.fdata('ac_bal', self.i))
-           
     def calc_trade_size(self):
         open_longs, open_shorts = self.get_open_longs(), self.get_open_shorts()
         self.init = True #if len(open_longs) + len(open_shorts) == 0 else False
         if self.init:
-            _, net_bal, _ = self.current_ac_values()
+            net_bal, _ = self.current_ac_values()
             trade_size = int(net_bal * self.sizing_ratio) if self.sizing == 'dynamic' else self.init_trade_size
             return trade_size, trade_size
         else:
             return 0, 0
     
-    def update_events(self, event):
-        events = self.d.fdata('events', self.i) if type(self.d.fdata('events', self.i)) == list else list()
-        if event not in events:
-            events.append(event)
-            self.d.update_fdata('events', self.i, events)
-
     def close_long(self, trade_no: int):
         # Remove from open longs
         open_longs = self.get_open_longs()
@@ -315,11 +154,11 @@ class GridSimulator:
             if long_trade_size + short_trade_size > 0:
                 self.trade_no = self.trade_no + 1
                 
-                long_tp = round(self.trigger + self.tp_pips * pow(10, self.d.ticker['pipLocation']), 5)
-                short_tp = round(self.trigger - self.tp_pips * pow(10, self.d.ticker['pipLocation']), 5) 
+                long_tp = self.level(self.trigger, self.tp_pips)
+                short_tp = self.level(self.trigger, -self.tp_pips) 
 
-                long_sl = round(self.trigger - self.sl_pips * pow(10, self.d.ticker['pipLocation']), 5)
-                short_sl = round(self.trigger + self.sl_pips * pow(10, self.d.ticker['pipLocation']), 5)
+                long_sl = self.level(self.trigger, -self.sl_pips)
+                short_sl = self.level(self.trigger, self.sl_pips)
 
                 # if long_trade_size > 0 and len(open_longs) == 0:
                 if long_trade_size > 0:
@@ -366,11 +205,11 @@ class GridSimulator:
         # Long cover entries
         for trade_no, trade in open_shorts.items():
             # if self.d.fdata('mid_c', self.i) >= self.trigger and self.d.fdata('mid_c', self.i-1) < self.trigger and self.trigger not in trade['COVS']:
-            cov_trigger = round(trade['TRIG'] + self.cov_pips * pow(10, self.d.ticker['pipLocation']), 5)
+            cov_trigger = self.level(trade['TRIG'], self.cov_pips)
             if cov_trigger <= self.trigger and self.trigger not in trade['COVS']:
                 self.trade_no = self.trade_no + 1
-                long_tp = round(self.trigger + self.tp_pips * pow(10, self.d.ticker['pipLocation']), 5)
-                long_sl = round(self.trigger - self.sl_pips * pow(10, self.d.ticker['pipLocation']), 5)
+                long_tp = self.level(self.trigger, self.tp_pips)
+                long_sl = self.level(self.trigger, -self.sl_pips)
                 open_longs[self.trade_no] = dict(
                     SIZE=trade['SIZE'],
                     TRIG=self.trigger,
@@ -395,11 +234,11 @@ class GridSimulator:
         # Short cover entries
         for trade_no, trade in open_longs.items():
             # if self.d.fdata('mid_c', self.i) <= self.trigger and self.d.fdata('mid_c', self.i-1) > self.trigger and self.trigger not in trade['COVS']:
-            cov_trigger = round(trade['TRIG'] - self.cov_pips * pow(10, self.d.ticker['pipLocation']), 5)
+            cov_trigger = self.level(trade['TRIG'], -self.cov_pips)
             if cov_trigger >= self.trigger and self.trigger not in trade['COVS']:
                 self.trade_no = self.trade_no + 1
-                short_tp = round(self.trigger - self.tp_pips * pow(10, self.d.ticker['pipLocation']), 5)
-                short_sl = round(self.trigger + self.sl_pips * pow(10, self.d.ticker['pipLocation']), 5)
+                short_tp = self.level(self.trigger, -self.tp_pips)
+                short_sl = self.level(self.trigger, self.sl_pips)
                 open_shorts[self.trade_no] = dict(
                     SIZE=trade['SIZE'],
                     TRIG=self.trigger,
@@ -526,32 +365,14 @@ class GridSimulator:
             self.update_temp_ac_values()
             self.update_events(self.EVENT_SL)
     
-    def margin_call(self):
-        _, net_bal, margin_used = self.current_ac_values()
-        traded = False
-        if net_bal < margin_used * self.MC_PERCENT:
-            open_longs = self.get_open_longs()
-            for trade_no, trade in open_longs.items():
-                self.close_long(trade_no)
-                traded = True
-
-            open_shorts = self.get_open_shorts()
-            for trade_no, trade in open_shorts.items():
-                self.close_short(trade_no)
-                traded = True
-
-        if traded:
-            self.update_temp_ac_values()
-            self.update_events(self.EVENT_MC)
-
     def update_trailing_sl(self):
         adjusted = False
         # Update long positions, update next_tp, TSL
         open_longs = self.get_open_longs()
         for trade_no, trade in open_longs.items():
             if self.d.fdata('mid_c', self.i) >= trade['TP']:
-                next_tp = round(trade['TP'] + self.grid_pips * pow(10, self.d.ticker['pipLocation']), 5)
-                tsl = round(trade['ENT'] + (trade['TP'] - trade['ENT']) / 2, 5) if trade['TSL'] == 0 else trade['TP']               
+                next_tp = self.level(trade['TP'], self.grid_pips)
+                tsl = self.midpoint(trade['ENT'], trade['TP']) if trade['TSL'] == 0 else trade['TP']               
                 # open_longs[trade_no] = (trade['SIZE'], trade['ENT'], next_tp, trade['SL'], trade[self.COVERED], tsl)
                 open_longs[trade_no]['TP'] = next_tp
                 open_longs[trade_no]['TSL'] = tsl
@@ -562,8 +383,8 @@ class GridSimulator:
         open_shorts = self.get_open_shorts()
         for trade_no, trade in open_shorts.items():
             if self.d.fdata('mid_c', self.i) <= trade['TP']:
-                next_tp = round(trade['TP'] - self.grid_pips * pow(10, self.d.ticker['pipLocation']), 5)
-                tsl = round(trade['ENT'] - (trade['ENT'] - trade['TP']) / 2, 5) if trade['TSL'] == 0 else trade['TP']
+                next_tp = self.level(trade['TP'], -self.grid_pips)
+                tsl = self.midpoint(trade['ENT'], trade['TP']) if trade['TSL'] == 0 else trade['TP']
                 # open_shorts[trade_no] = (trade['SIZE'], trade['ENT'], next_tp, trade['SL'], trade[self.COVERED], tsl)
                 open_shorts[trade_no]['TP'] = next_tp
                 open_shorts[trade_no]['TSL'] = tsl
@@ -614,11 +435,11 @@ class GridSimulator:
             up_grids = int(up_pips / self.grid_pips) if self.i > 1 else 0
             down_grids = int(down_pips / self.grid_pips) if self.i > 1 else 0
             if self.up_grid:
-                self.trigger = round(self.next_up_grid + up_grids * self.grid_pips * pow(10, self.d.ticker['pipLocation']), 5)
+                self.trigger = self.level(self.next_up_grid, up_grids * self.grid_pips)
             else:
-                self.trigger = round(self.next_down_grid - down_grids * self.grid_pips * pow(10, self.d.ticker['pipLocation']), 5)
-            self.next_up_grid = round(self.trigger + self.grid_pips * pow(10, self.d.ticker['pipLocation']), 5)
-            self.next_down_grid = round(self.trigger - self.grid_pips * pow(10, self.d.ticker['pipLocation']), 5)
+                self.trigger = self.level(self.next_down_grid, -down_grids * self.grid_pips)
+            self.next_up_grid = self.level(self.trigger, self.grid_pips)
+            self.next_down_grid = self.level(self.trigger, -self.grid_pips)
 
             self.d.update_fdata('trigger', self.i, self.trigger)
     
@@ -1,4 +1,5 @@
 from martingale_grid_simulator import GridSimulator
+from data import read_candles, time_window, save_result
 from tabulate import tabulate
 import pandas as pd
 
@@ -89,11 +90,13 @@ class GridOptimizer:
         )
 
     def read_data(self, ticker: str, frequency: str):
-        df = pd.read_pickle(f"{self.data_path}{ticker}_{frequency}.pkl")
+        df = read_candles(self.data_path, ticker, frequency)
         return df
     
     def save_files(self, inputs_df, ticker, frequency):
-        result = self.sim.d.df[self.sim.name].copy()
+        result = self.sim.d.export(self.sim.name)
+        if 'npz' in self.records:
+            save_result(result[~result.events.isnull()], f'{self.out_path}{self.sim.name}-events.npz')
         if 'events' in self.records:
             result[~result.events.isnull()].to_csv(f'{self.out_path}{self.sim.name}-events.csv', index=False)
         if 'all' in self.records:
@@ -142,7 +145,7 @@ class GridOptimizer:
 
         def inputs_list():
             gross_bal = self.sim.d.df[self.sim.name].iloc[-1]['gross_bal']
-            start, end = self.sim.d.df[self.sim.name].iloc[0]['time'], self.sim.d.df[self.sim.name].iloc[-1]['time']
+            start, end = self.sim.d.time_range(self.sim.name)
             header = ['sim_name', 'start', 'end', 'init_bal', 'trade_price_type', 'init_trade_size', 'grid_pips', 'sizing', 'cash_out_factor', 'martingale_factor', 'pyramiding', 'streak_reset', 'streak_reset_percent', 'trailing_sl', 'gross_bal']
             inputs = [sim_name, start, end, init_bal, trade_price_type, init_trade_size, grid_pips, sizing, cash_out_factor, martingale_factor, pyramiding, streak_reset, streak_reset_percent, trailing_sl, gross_bal]
             print(tabulate([inputs], header, tablefmt='plain'))
@@ -160,7 +163,7 @@ class GridOptimizer:
     def run_optimizer(self):
         for tk in self.tickers:
             for f in self.frequency:
-                df = self.read_data(tk, f).iloc[self.start:self.end]
+                df = time_window(self.read_data(tk, f), self.start, self.end)
                 for ib in self.init_bal:
                     for t in self.init_trade_size:
                         for s in self.sizing:
@@ -56,7 +56,7 @@ class GridSimulator:
             self.BP, self.SP = 'ask_c', 'bid_c'
 
         self.d = Data(
-            source=df.copy(),
+            source=df,
             ticker=ticker,
             cols=['time', 'mid_c', 'bid_c', 'ask_c'],
             instruments=instruments
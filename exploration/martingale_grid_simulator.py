@@ -1,11 +1,12 @@
 from data import Data
+from grid_engine import GridEngine
 from tqdm import tqdm
 import pandas as pd
 from numpy import isnan
 from random import choice
 
 
-class GridSimulator:
+class GridSimulator(GridEngine):
 
     EVENT_TP, EVENT_SL, EVENT_MC = 'TP', 'SL', 'MC'
     EVENT_BASE_ENTRY, EVENT_CONTRA_ENTRY, EVENT_PYR_ENTRY, EVENT_SPLIT = 'BASE', 'CON', 'PYR', 'SPLIT'
@@ -13,6 +14,8 @@ class GridSimulator:
     EVENT_CASH_IN, EVENT_CASH_OUT =  'CI', 'CO'
     STREAK_CNT, SIZE, ENTRY, TP, SL, TSL = 0, 1, 2, 3, 4, 5
     EXIT, PIPS = 3, 4
+    OPEN_KEYS = ('STREAK_CNT', 'SIZE', 'ENT', 'TP', 'SL', 'TSL')
+    CLOSED_KEYS = ('STREAK_CNT', 'SIZE', 'ENT', 'EXIT', 'PIPS')
     LONG, SHORT = 1, -1
     MC_PERCENT = 0.50
 
@@ -58,7 +61,7 @@ class GridSimulator:
             self.BP, self.SP = 'ask_c', 'bid_c'
 
         self.d = Data(
-            source=df.copy(),
+            source=df,
             ticker=ticker,
             cols=['time', 'mid_c', 'bid_c', 'ask_c'],
             instruments=instruments
@@ -83,71 +86,6 @@ class GridSimulator:
 
         self.d.prepare_fast_data(name=name, start=0, end=self.d.datalen, add_cols=add_cols)
 
-    def cum_long_position(self):
-        open_longs = self.get_open_longs()
-        cum_long_position = 0
-        for _, trade in open_longs.items():
-            cum_long_position = cum_long_position + trade[self.SIZE]
-        return cum_long_position
-
-    def cum_short_position(self):
-        open_shorts = self.get_open_shorts()
-        cum_short_position = 0
-        for _, trade in open_shorts.items():
-            cum_short_position = cum_short_position + trade[self.SIZE]
-        return cum_short_position
-
-    def unrealised_pnl(self):
-        open_longs = self.get_open_longs()
-        open_shorts = self.get_open_shorts()
-        pnl = 0
-        for _, trade in open_longs.items():
-            pnl = pnl + trade[self.SIZE] * (self.d.fdata('mid_c', self.i) - trade[self.ENTRY])
-        for _, trade in open_shorts.items():
-            pnl = pnl + trade[self.SIZE] * (trade[self.ENTRY] - self.d.fdata('mid_c', self.i))
-        return round(pnl, 2)
-    
-    def realised_pnl(self):
-        closed_longs, closed_shorts = self.get_closed_longs(), self.get_closed_shorts()
-        pnl = 0
-        for _, trade in closed_longs.items():
-            pnl = pnl + trade[self.SIZE] * (trade[self.EXIT] - trade[self.ENTRY])
-        for _, trade in closed_shorts.items():
-            pnl = pnl + trade[self.SIZE] * (trade[self.ENTRY] - trade[self.EXIT])
-        return round(pnl, 2)
-    
-    def cash_transfer(self):
-        net_bal, _ = self.current_ac_values()
-        if self.cash_out_factor is not None:
-            self.d.update_fdata('cash_bal', self.i, self.d.fdata('cash_bal', self.i-1))
-            cash_out_threshold = self.init_bal * self.cash_out_factor
-            events = self.d.fdata('events', self.i) if type(self.d.fdata('events', self.i)) == list else list()
-            stop_loss = self.EVENT_SL in events or self.EVENT_MC in events
-            # Cash out / withdraw
-            if net_bal > cash_out_threshold:
-                cash_out = net_bal - cash_out_threshold
-                self.d.update_fdata('ac_bal', self.i, round(self.d.fdata('ac_bal', self.i-1) - cash_out, 2))
-                self.d.update_fdata('cash_bal', self.i, round(self.d.fdata('cash_bal', self.i) + cash_out, 2))
-                # self.update_temp_ac_values()
-                self.update_events(self.EVENT_CASH_OUT)
-                return cash_out
-            # Deposit money into a/c when net_bal < cash_out_threshold
-            elif stop_loss and net_bal < cash_out_threshold:
-                cash_in = min(cash_out_threshold - net_bal, self.d.fdata('cash_bal', self.i))
-                if cash_in > 0:
-                    self.d.update_fdata('ac_bal', self.i, round(self.d.fdata('ac_bal', self.i-1) + cash_in, 2))
-                    self.d.update_fdata('cash_bal', self.i, round(self.d.fdata('cash_bal', self.i) - cash_in, 2))
-                    # self.update_temp_ac_values()
-                    self.update_events(self.EVENT_CASH_IN)    
-                    return cash_in  
-
-    def current_ac_values(self):
-        ac_bal = self.d.fdata('ac_bal', self.i-1) + self.d.fdata('realised_pnl', self.i)
-        margin_used = (self.d.fdata('cum_long_position', self.i) + 
-                       self.d.fdata('cum_short_position', self.i)) * float(self.d.ticker['marginRate'])
-        net_bal = ac_bal + self.d.fdata('unrealised_pnl', self.i)
-        return net_bal, margin_used      
-
     def update_temp_ac_values(self, init: bool=False):
         if init:
             self.d.update_fdata('open_longs', self.i, self.d.fdata('open_longs', self.i-1))
@@ -164,28 +102,7 @@ class GridSimulator:
     def update_ac_values(self):
         self.d.update_fdata('cum_long_position', self.i, self.cum_long_position())
         self.d.update_fdata('cum_short_position', self.i, self.cum_short_position())
-        self.d.update_fdata('unrealised_pnl', self.i, self.unrealised_pnl())
-        self.d.update_fdata('realised_pnl', self.i, self.realised_pnl())
-        
-        # First candle
-        if self.i == 0:               
-            self.d.update_fdata('ac_bal', self.i, self.init_bal)
-        # Subsequent candles
-        else:
-            events = self.d.fdata('events', self.i) if type(self.d.fdata('events', self.i)) == list else list()
-            cash_transfer = self.EVENT_CASH_IN in events or self.EVENT_CASH_OUT in events
-            ac_bal = self.d.fdata('ac_bal', self.i) if cash_transfer else self.d.fdata('ac_bal', self.i-1)
-            self.d.update_fdata('ac_bal', self.i, round(ac_bal + self.d.fdata('realised_pnl', self.i), 2))
-
-        self.d.update_fdata('net_bal', self.i, round(self.d.fdata('ac_bal', self.i) + self.d.fdata('unrealised_pnl', self.i), 2))
-        self.d.update_fdata('margin_used', self.i, \
-                            round((self.d.fdata('cum_long_position', self.i) + 
-                                   self.d.fdata('cum_short_position', self.i)) * float(self.d.ticker['marginRate']), 2))
-        
-        if self.cash_out_factor is not None:
-            self.d.update_fdata('gross_bal', self.i, round(self.d.fdata('ac_bal', self.i) + self.d.fdata('cash_bal', self.i), 2))
-        else:
-            self.d.update_fdata('gross_bal', self.i, self.d.fdata('ac_bal', self.i))
+        self.update_balances()
     
     # def uncovered_pip_position(self):
     #     uncovered_pip_position = 0 
@@ -352,13 +269,13 @@ class GridSimulator:
             
         if self.direction == self.LONG:
             entry = self.d.fdata('ask_c', self.i)
-            tp = round(self.d.fdata('ask_c', self.i) + self.grid_pips * pow(10, self.d.ticker['pipLocation']), 5)
-            sl = round(self.d.fdata('ask_c', self.i) - self.grid_pips * pow(10, self.d.ticker['pipLocation']), 5)
+            tp = self.level(self.d.fdata('ask_c', self.i), self.grid_pips)
+            sl = self.level(self.d.fdata('ask_c', self.i), -self.grid_pips)
             self.next_up_grid, self.next_down_grid = tp, sl
         elif self.direction == self.SHORT:
             entry = self.d.fdata('bid_c', self.i)
-            tp = round(self.d.fdata('bid_c', self.i) - self.grid_pips * pow(10, self.d.ticker['pipLocation']), 5)
-            sl = round(self.d.fdata('bid_c', self.i) + self.grid_pips * pow(10, self.d.ticker['pipLocation']), 5)
+            tp = self.level(self.d.fdata('bid_c', self.i), -self.grid_pips)
+            sl = self.level(self.d.fdata('bid_c', self.i), self.grid_pips)
             self.next_up_grid, self.next_down_grid = sl, tp      
 
         trade_size = self.trade_size()
@@ -429,8 +346,8 @@ class GridSimulator:
         closing_trade = None
         for trade_no, trade in open_longs.items():
             if self.d.fdata(self.SP, self.i) >= trade[self.TP]:
-                next_tp = round(trade[self.TP] + self.grid_pips * pow(10, self.d.ticker['pipLocation']), 5)
-                tsl = round(trade[self.ENTRY] + (trade[self.TP] - trade[self.ENTRY]) / 2, 5) if trade[self.TSL] == 0 else trade[self.TP]               
+                next_tp = self.level(trade[self.TP], self.grid_pips)
+                tsl = self.midpoint(trade[self.ENTRY], trade[self.TP]) if trade[self.TSL] == 0 else trade[self.TP]               
                 # Split base trade to square off 50% and keep open 50%
                 if trade_no == self.base_trade_no:
                     keep_trade, closing_trade = split_trade(trade)
@@ -449,8 +366,8 @@ class GridSimulator:
         closing_trade = None
         for trade_no, trade in open_shorts.items():
             if self.d.fdata(self.BP, self.i) <= trade[self.TP]:
-                next_tp = round(trade[self.TP] - self.grid_pips * pow(10, self.d.ticker['pipLocation']), 5)
-                tsl = round(trade[self.ENTRY] - (trade[self.ENTRY] - trade[self.TP]) / 2, 5) if trade[self.TSL] == 0 else trade[self.TP]
+                next_tp = self.level(trade[self.TP], -self.grid_pips)
+                tsl = self.midpoint(trade[self.ENTRY], trade[self.TP]) if trade[self.TSL] == 0 else trade[self.TP]
                 # Split base trade to square off 50% and keep open 50%
                 if trade_no == self.base_trade_no:
                     keep_trade, closing_trade = split_trade(trade)
@@ -509,25 +426,6 @@ class GridSimulator:
             self.update_temp_ac_values()
             self.update_events(self.EVENT_SL)
     
-    def margin_call(self):
-        net_bal, margin_used = self.current_ac_values()
-        traded = False
-        open_longs, open_shorts = self.get_open_longs(), self.get_open_shorts()
-
-        if net_bal < margin_used * self.MC_PERCENT:
-            for trade_no, trade in open_longs.items():
-                self.close_long(trade_no)
-                traded = True
-
-            for trade_no, trade in open_shorts.items():
-                self.close_short(trade_no)
-                traded = True
-
-        if traded:
-            # self.new_streak = True
-            self.update_temp_ac_values()
-            self.update_events(self.EVENT_MC)
-    
     def update_init_values(self):
         self.trade_no = 0
         # self.new_streak = True
@@ -0,0 +1,66 @@
+import hashlib
+import itertools
+import json
+from math import prod
+
+
+class ParameterSpace:
+    '''Every combination of named parameter values, expanded lazily like nested for loops in the order of params
+    constraints: predicates of a configuration dict, a configuration is dropped when one of them is False
+    irrelevant: {param: predicate}, param has no effect on the configurations the predicate holds for. These are only kept
+    with param at its first value, the others would repeat them.
+    shard: (index, count), only the configurations whose config_id() falls in shard index of count, see in_shard()
+    '''
+
+    def __init__(self, params: dict, constraints: list=None, irrelevant: dict=None, shard: tuple=None):
+        self.params = {name: list(values) for name, values in params.items()}
+        self.constraints = list() if constraints is None else constraints
+        self.irrelevant = dict() if irrelevant is None else irrelevant
+        self.shard = shard
+
+    def __repr__(self) -> str:
+        return str(dict(params=self.params, size=self.size, shard=self.shard))
+
+    @property
+    def size(self) -> int:
+        '''Combinations before any is dropped
+        '''
+        return prod(len(values) for values in self.params.values())
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self.items())
+
+    def __iter__(self):
+        for _, config in self.items():
+            yield config
+
+    @staticmethod
+    def config_id(config: dict) -> str:
+        '''Hash of a configuration, the same for the same values whatever the order of the params or the run
+        '''
+        text = json.dumps(config, sort_keys=True, default=lambda v: v.item())
+        return hashlib.sha1(text.encode()).hexdigest()[:12]
+
+    @classmethod
+    def in_shard(cls, config: dict, index: int, count: int) -> bool:
+        return int(cls.config_id(config), 16) % count == index
+
+    def keep(self, config: dict) -> bool:
+        '''False when config breaks a constraint, repeats a kept configuration or is in another shard
+        '''
+        for param, applies in self.irrelevant.items():
+            if config[param] != self.params[param][0] and applies(config):
+                return False
+        for constraint in self.constraints:
+            if not constraint(config):
+                return False
+        return self.shard is None or self.in_shard(config, *self.shard)
+
+    def items(self):
+        '''(position in the whole product, configuration) of the kept configurations
+        '''
+        names = list(self.params.keys())
+        for index, values in enumerate(itertools.product(*self.params.values())):
+            config = dict(zip(names, values))
+            if self.keep(config):
+                yield index, config
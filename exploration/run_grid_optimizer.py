@@ -151,9 +151,9 @@ instruments = "../data/instruments.json"
 dummyrun = False
 checkpoint=0
 counter=50000
-start=None  
+start=None  # row index or time, e.g. '2021-01-01'
 end=None
-records=['events']
+records=['events'] # 'events', 'all' (csv) and 'npz' (event rows, see data.load_result)
 tickers=['EUR_CHF']
 frequency=['M5']
 init_bal=[1000]
@@ -170,6 +170,16 @@ cover_sl_ratio = [3.0]
 max_unrealised_pnl = [0.10, 0.20]
 trailing_sl = [False, True]
 inputs_file='inputs.50.csv'
+results_file='results.db' # SQLite file in out_path the rows of every sweep are appended to (data.ResultsStore), None to write inputs_file
+lockstep=64 # run up to this many configurations together through GridLockstep, None to run one by one
+workers=None # worker processes of the sweep, e.g. os.cpu_count(), None to run in this process
+prune=True # run configurations that only differ in parameters GridSimulator ignores once, see grid_optimizer.IRRELEVANT
+shard=None # (index, count) to run one of count parts of the sweep, e.g. (0, 2) and (1, 2) on two machines
+cache='D:/Trading/ml4t-data/grid/cache/' # results of every configuration run, reused by any sweep over the same candles, None to always simulate
+cache_gb=20 # least recently used results are removed above this size
+halving_bars=None # e.g. 20000 to rank the configurations on that many bars first and only run the best on the whole window
+halving_keep=0.5 # fraction of the configurations kept by each round, the next round runs 1 / halving_keep times more bars
+halving_metric='gross_bal' # column ranking the configurations at the last bar of a round, higher is better
 
 
 if __name__ == '__main__':
@@ -198,7 +208,17 @@ if __name__ == '__main__':
         instruments=instruments,
         out_path=out_path,
         inputs_file=inputs_file,
-        dummyrun=dummyrun
+        results_file=results_file,
+        dummyrun=dummyrun,
+        lockstep=lockstep,
+        workers=workers,
+        prune=prune,
+        shard=shard,
+        cache=cache,
+        cache_gb=cache_gb,
+        halving_bars=halving_bars,
+        halving_keep=halving_keep,
+        halving_metric=halving_metric
     )
 
     print(optim)
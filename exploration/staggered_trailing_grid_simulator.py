@@ -1,9 +1,10 @@
 from data import Data
+from grid_engine import GridEngine
 from tqdm import tqdm
 import pandas as pd
 
 
-class GridSimulator:
+class GridSimulator(GridEngine):
 
     EVENT_TP, EVENT_SL, EVENT_MC, EVENT_ENTRY, EVENT_COVER,  = 'TP', 'SL', 'MC', 'ENT', 'COV'
     EVENT_TSL_ADJUST, EVENT_PAR_UNLINK, EVENT_COV_UNLINK = 'TSLADJ', 'PARUNL', 'COVUNL'
@@ -49,7 +50,7 @@ class GridSimulator:
         self.trailing_sl = trailing_sl
 
         self.d = Data(
-            source=df.copy(),
+            source=df,
             ticker=ticker,
             cols=['time', 'mid_c', 'bid_c', 'ask_c'],
             instruments=instruments
@@ -80,219 +81,6 @@ class GridSimulator:
         # self.d.prepare_fast_data(name=name, start=0, end=self.d.datalen, add_cols=add_cols)
         self.d.prepare_fast_data(name=name, add_cols=add_cols)
 
-    def get_open_longs(self, i: int=None):
-        i = self.i if i is None else i
-        # open_longs = self.d.fdata('open_longs', i) if type(self.d.fdata('open_longs', i)) == dict else dict()
-        # open_longs = dict()
-        # for trade_no, trade in open_longs_list.items():
-        #     open_longs[trade_no] = dict(
-        #                 SIZE=trade[0],
-        #                 TRIG=trade[1],
-        #                 ENT=trade[2],
-        #                 TP=trade[3],
-        #                 SL=trade[4],
-        #                 TSL=trade[5],
-        #                 PAR=trade[6],
-        #                 COVS=trade[7]
-        #             )
-        # return open_longs
-        return self.d.to_dict_of_dicts('open_longs', self.OPEN_KEYS, i)
-    
-    def get_open_shorts(self, i: int=None):
-        i = self.i if i is None else i
-        # open_shorts_list = self.d.fdata('open_shorts', i) if type(self.d.fdata('open_shorts', i)) == dict else dict()
-        # open_shorts = dict()
-        # for trade_no, trade in open_shorts_list.items():
-        #     open_shorts[trade_no] = dict(
-        #                 SIZE=trade[0],
-        #                 TRIG=trade[1],
-        #                 ENT=trade[2],
-        #                 TP=trade[3],
-        #                 SL=trade[4],
-        #                 TSL=trade[5],
-        #                 PAR=trade[6],
-        #                 COVS=trade[7]
-        #             )
-        # return open_shorts
-        return self.d.to_dict_of_dicts('open_shorts', self.OPEN_KEYS, i)
-    
-    def get_closed_longs(self, i: int=None):
-        i = self.i if i is None else i
-        # closed_longs_tuple = self.d.fdata('closed_longs', i) if type(self.d.fdata('closed_longs', i)) == dict else dict()
-        # closed_longs = dict()
-        # for trade_no, trade in closed_longs_tuple.items():
-        #     closed_longs[trade_no] = dict(
-        #                 SIZE=trade[0],
-        #                 TRIG=trade[1],
-        #                 ENT=trade[2],
-        #                 PAR=trade[3],
-        #                 COVS=trade[4],
-        #                 EXIT=trade[5],
-        #                 PIPS=trade[6]
-        #             )
-        # return closed_longs    
-        return self.d.to_dict_of_dicts('closed_longs', self.CLOSED_KEYS, i)
-    
-    def get_closed_shorts(self, i: int=None):
-        i = self.i if i is None else i
-        # closed_shorts_tuple = self.d.fdata('closed_shorts', i) if type(self.d.fdata('closed_shorts', i)) == dict else dict()
-        # closed_shorts = dict()
-        # for trade_no, trade in closed_shorts_tuple.items():
-        #     closed_shorts[trade_no] = dict(
-        #                 SIZE=trade[0],
-        #                 TRIG=trade[1],
-        #                 ENT=trade[2],
-        #                 PAR=trade[3],
-        #                 COVS=trade[4],
-        #                 EXIT=trade[5],
-        #                 PIPS=trade[6]
-        #             )
-        # return closed_shorts  
-        return self.d.to_dict_of_dicts('closed_shorts', self.CLOSED_KEYS, i)
-    
-    def update_open_longs(self, open_longs: dict):
-        open_longs_tuple = dict()
-        for trade_no, trade in open_longs.items():
-            open_longs_tuple[trade_no] = tuple(trade.values())
-        self.d.update_fdata('open_longs', self.i, open_longs_tuple)
-
-    def update_open_shorts(self, open_shorts: dict):
-        open_shorts_tuple = dict()
-        for trade_no, trade in open_shorts.items():
-            open_shorts_tuple[trade_no] = tuple(trade.values())
-        self.d.update_fdata('open_shorts', self.i, open_shorts_tuple)
-
-    def update_closed_longs(self, closed_longs: dict):
-        closed_longs_tuple = dict()
-        for trade_no, trade in closed_longs.items():
-            closed_longs_tuple[trade_no] = tuple(trade.values())
-        self.d.update_fdata('closed_longs', self.i, closed_longs_tuple)
-
-    def update_closed_shorts(self, closed_shorts: dict):
-        closed_shorts_tuple = dict()
-        for trade_no, trade in closed_shorts.items():
-            closed_shorts_tuple[trade_no] = tuple(trade.values())
-        self.d.update_fdata('closed_shorts', self.i, closed_shorts_tuple)
-    
-    def cum_long_position(self):
-        open_longs = self.get_open_longs()
-        cum_long_position = 0
-        for _, trade in open_longs.items():
-            cum_long_position = cum_long_position + trade['SIZE']
-        return cum_long_position
-
-    def cum_short_position(self):
-        open_shorts = self.get_open_shorts()
-        cum_short_position = 0
-        for _, trade in open_shorts.items():
-            cum_short_position = cum_short_position + trade['SIZE']
-        return cum_short_position
-
-    def unrealised_pnl(self):
-        open_longs = self.get_open_longs()
-        open_shorts = self.get_open_shorts()
-        pnl = 0
-        for _, trade in open_longs.items():
-            pnl = pnl + trade['SIZE'] * (self.d.fdata('mid_c', self.i) - trade['ENT'])
-        for _, trade in open_shorts.items():
-            pnl = pnl + trade['SIZE'] * (trade['ENT'] - self.d.fdata('mid_c', self.i))
-        return round(pnl, 2)
-    
-    def realised_pnl(self):
-        closed_longs = self.get_closed_longs()
-        closed_shorts = self.get_closed_shorts()
-        pnl = 0
-        for _, trade in closed_longs.items():
-            pnl = pnl + trade['SIZE'] * (trade['EXIT'] - trade['ENT'])
-        for _, trade in closed_shorts.items():
-            pnl = pnl + trade['SIZE'] * (trade['ENT'] - trade['EXIT'])
-        return round(pnl, 2)
-    
-    def cash_transfer(self):
-        net_bal, _ = self.current_ac_values()
-        if self.cash_out_factor is not None:
-            self.d.update_fdata('cash_bal', self.i, self.d.fdata('cash_bal', self.i-1))
-            cash_out_threshold = self.init_bal * self.cash_out_factor
-            events = self.d.fdata('events', self.i) if type(self.d.fdata('events', self.i)) == list else list()
-            stop_loss = self.EVENT_SL in events or self.EVENT_MC in events
-            # Cash out / withdraw
-            if net_bal > cash_out_threshold:
-                cash_out = net_bal - cash_out_threshold
-                self.d.update_fdata('ac_bal', self.i, round(self.d.fdata('ac_bal', self.i-1) - cash_out, 2))
-                self.d.update_fdata('cash_bal', self.i, round(self.d.fdata('cash_bal', self.i) + cash_out, 2))
-                # self.update_temp_ac_values()
-                self.update_events(self.EVENT_CASH_OUT)
-                return cash_out
-            # Deposit money into a/c when net_bal < cash_out_threshold
-            elif stop_loss and net_bal < cash_out_threshold:
-                cash_in = min(cash_out_threshold - net_bal, self.d.fdata('cash_bal', self.i))
-                if cash_in > 0:
-                    self.d.update_fdata('ac_bal', self.i, round(self.d.fdata('ac_bal', self.i-1) + cash_in, 2))
-                    self.d.update_fdata('cash_bal', self.i, round(self.d.fdata('cash_bal', self.i) - cash_in, 2))
-                    # self.update_temp_ac_values()
-                    self.update_events(self.EVENT_CASH_IN)    
-                    return cash_in  
-
-    def current_ac_values(self):
-        ac_bal = self.d.fdata('ac_bal', self.i-1) + self.d.fdata('realised_pnl', self.i)
-        margin_used = (self.d.fdata('cum_long_position', self.i) + 
-                       self.d.fdata('cum_short_position', self.i)) * float(self.d.ticker['marginRate'])
-        net_bal = ac_bal + self.d.fdata('unrealised_pnl', self.i)
-        return net_bal, margin_used      
-
-    def update_temp_ac_values(self, init: bool=False):
-        if init:
-            self.d.update_fdata('open_longs', self.i, self.d.fdata('open_longs', self.i-1))
-            self.d.update_fdata('open_shorts', self.i, self.d.fdata('open_shorts', self.i-1))
-            self.d.update_fdata('cum_long_position', self.i, self.d.fdata('cum_long_position', self.i-1))
-            self.d.update_fdata('cum_short_position', self.i, self.d.fdata('cum_short_position', self.i-1))
-            self.d.update_fdata('open_long_count', self.i, len(self.get_open_longs(self.i-1)))
-            self.d.update_fdata('open_short_count', self.i, len(self.get_open_shorts(self.i-1)))
-            self.d.update_fdata('closed_long_count', self.i, len(self.get_closed_longs(self.i-1)))
-            self.d.update_fdata('closed_short_count', self.i, len(self.get_closed_shorts(self.i-1)))
-            # self.d.update_fdata('uncovered_trades', self.i, self.d.fdata('uncovered_trades', self.i-1))
-        else:
-            self.d.update_fdata('cum_long_position', self.i, self.cum_long_position())
-            self.d.update_fdata('cum_short_position', self.i, self.cum_short_position())
-            self.d.update_fdata('open_long_count', self.i, len(self.get_open_longs()))
-            self.d.update_fdata('open_short_count', self.i, len(self.get_open_shorts()))
-            self.d.update_fdata('closed_long_count', self.i, len(self.get_closed_longs()))
-            self.d.update_fdata('closed_short_count', self.i, len(self.get_closed_shorts()))
-        
-        self.d.update_fdata('unrealised_pnl', self.i, self.unrealised_pnl())
-        self.d.update_fdata('realised_pnl', self.i, self.realised_pnl())
-
-    def update_ac_values(self):
-        self.d.update_fdata('cum_long_position', self.i, self.cum_long_position())
-        self.d.update_fdata('cum_short_position', self.i, self.cum_short_position())
-        self.d.update_fdata('open_long_count', self.i, len(self.get_open_longs()))
-        self.d.update_fdata('open_short_count', self.i, len(self.get_open_shorts()))
-        self.d.update_fdata('closed_long_count', self.i, len(self.get_closed_longs()))
-        self.d.update_fdata('closed_short_count', self.i, len(self.get_closed_shorts()))
-
-        self.d.update_fdata('unrealised_pnl', self.i, self.unrealised_pnl())
-        self.d.update_fdata('realised_pnl', self.i, self.realised_pnl())
-        
-        # First candle
-        if self.i == 0:               
-            self.d.update_fdata('ac_bal', self.i, self.init_bal)
-        # Subsequent candles
-        else:
-            events = self.d.fdata('events', self.i) if type(self.d.fdata('events', self.i)) == list else list()
-            cash_transfer = self.EVENT_CASH_IN in events or self.EVENT_CASH_OUT in events
-            ac_bal = self.d.fdata('ac_bal', self.i) if cash_transfer else self.d.fdata('ac_bal', self.i-1)
-            self.d.update_fdata('ac_bal', self.i, round(ac_bal + self.d.fdata('realised_pnl', self.i), 2))
-
-        self.d.update_fdata('net_bal', self.i, round(self.d.fdata('ac_bal', self.i) + self.d.fdata('unrealised_pnl', self.i), 2))
-        self.d.update_fdata('margin_used', self.i, \
-                            round((self.d.fdata('cum_long_position', self.i) + 
-                                   self.d.fdata('cum_short_position', self.i)) * float(self.d.ticker['marginRate']), 2))
-        
-        if self.cash_out_factor is not None:
-            self.d.update_fdata('gross_bal', self.i, round(self.d.fdata('ac_bal', self.i) + self.d.fdata('cash_bal', self.i), 2))
-        else:
-            self.d.update_fdata('gross_bal', self.i, self.d.fdata('ac_bal', self.i))
-           
     def calc_trade_size(self):
         if self.i == 0:
             trade_size = self.init_trade_size
@@ -306,12 +94,6 @@ class GridSimulator:
                 trade_size = 0
         return trade_size
     
-    def update_events(self, event):
-        events = self.d.fdata('events', self.i) if type(self.d.fdata('events', self.i)) == list else list()
-        if event not in events:
-            events.append(event)
-            self.d.update_fdata('events', self.i, events)
-
     def close_long(self, trade_no: int):
         # Remove from open longs
         open_longs = self.get_open_longs()
@@ -364,11 +146,11 @@ class GridSimulator:
             csl_pips = self.grid_pips * cover_grid_count
             if parent == self.LONG:
                 # long_csl = round(self.d.fdata('mid_c', self.i) - csl_pips * pow(10, self.d.ticker['pipLocation']), 5)
-                long_csl = round(trigger_price - csl_pips * pow(10, self.d.ticker['pipLocation']), 5)
+                long_csl = self.level(trigger_price, -csl_pips)
                 covers[long_csl] = 0
             elif parent == self.SHORT:
                 # short_csl = round(self.d.fdata('mid_c', self.i) + csl_pips * pow(10, self.d.ticker['pipLocation']), 5)
-                short_csl = round(trigger_price + csl_pips * pow(10, self.d.ticker['pipLocation']), 5)
+                short_csl = self.level(trigger_price, csl_pips)
                 covers[short_csl] = 0
             cover_grid_count = cover_grid_count + 1
         return covers
@@ -381,8 +163,8 @@ class GridSimulator:
             # short_tp = round(self.d.fdata('mid_c', self.i) - self.grid_pips * pow(10, self.d.ticker['pipLocation']), 5)         
 
             trigger = self.next_up_grid if up_grid else self.next_down_grid
-            long_tp = round(trigger + self.grid_pips * pow(10, self.d.ticker['pipLocation']), 5)
-            short_tp = round(trigger - self.grid_pips * pow(10, self.d.ticker['pipLocation']), 5)  
+            long_tp = self.level(trigger, self.grid_pips)
+            short_tp = self.level(trigger, -self.grid_pips)  
 
             trade_size = self.calc_trade_size()
             open_longs = self.get_open_longs()
@@ -395,8 +177,8 @@ class GridSimulator:
 
                 # long_sl = round(self.d.fdata('mid_c', self.i) - self.sl_pips * pow(10, self.d.ticker['pipLocation']), 5)
                 # short_sl = round(self.d.fdata('mid_c', self.i) + self.sl_pips * pow(10, self.d.ticker['pipLocation']), 5)
-                long_sl = round(trigger - self.sl_pips * pow(10, self.d.ticker['pipLocation']), 5)
-                short_sl = round(trigger + self.sl_pips * pow(10, self.d.ticker['pipLocation']), 5)
+                long_sl = self.level(trigger, -self.sl_pips)
+                short_sl = self.level(trigger, self.sl_pips)
                 
                 # long_covers = self.cover_triggers(self.next_up_grid, self.LONG)
                 # short_covers = self.cover_triggers(self.next_down_grid, self.LONG)
@@ -456,9 +238,9 @@ class GridSimulator:
                         self.trade_no = self.trade_no + 1
                         long_tp = trade['SL']
                         # long_sl = round(self.d.fdata('mid_c', self.i) - self.sl_pips * pow(10, self.d.ticker['pipLocation']), 5)
-                        long_sl = round(trade['ENT'] - trade['REM_COVS'] * self.grid_pips * pow(10, self.d.ticker['pipLocation']), 5)
+                        long_sl = self.level(trade['ENT'], -trade['REM_COVS'] * self.grid_pips)
                         # long_csl = round(self.d.fdata('mid_c', self.i) - csl_pips * pow(10, self.d.ticker['pipLocation']), 5)
-                        long_csl = round(trade['CSL'] - csl_pips * pow(10, self.d.ticker['pipLocation']), 5)
+                        long_csl = self.level(trade['CSL'], -csl_pips)
                         # open_longs[self.trade_no] = (trade['SIZE'], self.d.fdata('ask_c', self.i), trade['CSL'], long_tp, long_sl, 0, long_csl, list(), self.total_covers) # (SIZE, ENTRY, TP, SL, TSL, CSL, COVS, REM_COVS)
                         open_longs[self.trade_no] = dict(
                             SIZE=trade['SIZE'],
@@ -478,7 +260,7 @@ class GridSimulator:
                         self.update_events(self.EVENT_COVER)
 
                         # Update open short position: Update cover stop loss & Reduce remaining covers
-                        short_csl = round(trade['CSL'] + self.grid_pips * pow(10, self.d.ticker['pipLocation']), 5)
+                        short_csl = self.level(trade['CSL'], self.grid_pips)
                         # covers = trade['COVS']
                         # covers.append(self.trade_no)
                         # open_shorts[trade_no] = (trade['SIZE'], trade['ENT'], trade['TRIG'], trade['TP'], trade['SL'], trade['TSL'], short_csl, covers, trade['REM_COVS'] - 1)
@@ -500,9 +282,9 @@ class GridSimulator:
                         self.trade_no = self.trade_no + 1
                         short_tp = trade['SL']
                         # short_sl = round(self.d.fdata('mid_c', self.i) + self.sl_pips * pow(10, self.d.ticker['pipLocation']), 5)
-                        short_sl = round(trade['ENT'] + trade['REM_COVS'] * self.grid_pips * pow(10, self.d.ticker['pipLocation']), 5)
+                        short_sl = self.level(trade['ENT'], trade['REM_COVS'] * self.grid_pips)
                         # short_csl = round(self.d.fdata('mid_c', self.i) + csl_pips * pow(10, self.d.ticker['pipLocation']), 5)
-                        short_csl = round(trade['CSL'] + csl_pips * pow(10, self.d.ticker['pipLocation']), 5)
+                        short_csl = self.level(trade['CSL'], csl_pips)
                         # open_shorts[self.trade_no] = (trade['SIZE'], self.d.fdata('bid_c', self.i), trade['CSL'], short_tp, short_sl, 0, short_csl, list(), self.total_covers) # (SIZE, ENTRY, TP, SL, TSL, CSL, COVS, REM_COVS)
                         open_shorts[self.trade_no] = dict(
                             SIZE=trade['SIZE'],
@@ -522,7 +304,7 @@ class GridSimulator:
                         self.update_events(self.EVENT_COVER)
 
                         # Update open long position: Update cover stop loss & Reduce remaining covers
-                        long_csl = round(trade['CSL'] - self.grid_pips * pow(10, self.d.ticker['pipLocation']), 5)
+                        long_csl = self.level(trade['CSL'], -self.grid_pips)
                         # covers = trade['COVS']
                         # covers.append(self.trade_no)
                         # open_longs[trade_no] = (trade['SIZE'], trade['ENT'], trade['TRIG'], trade['TP'], trade['SL'], trade['TSL'], long_csl, covers, trade['REM_COVS'] - 1)
@@ -555,7 +337,7 @@ class GridSimulator:
                         long_tp = trade['SL']
                         # long_sl = round(self.d.fdata('mid_c', self.i) - self.sl_pips * pow(10, self.d.ticker['pipLocation']), 5)
                         # long_sl = round(trade['ENT'] - trade['REM_COVS'] * self.grid_pips * pow(10, self.d.ticker['pipLocation']), 5)
-                        long_sl = round(csl - self.sl_pips * pow(10, self.d.ticker['pipLocation']), 5)
+                        long_sl = self.level(csl, -self.sl_pips)
                         # long_csl = round(self.d.fdata('mid_c', self.i) - csl_pips * pow(10, self.d.ticker['pipLocation']), 5)
                         # long_csl = round(csl - csl_pips * pow(10, self.d.ticker['pipLocation']), 5)
                         # open_longs[self.trade_no] = (trade['SIZE'], self.d.fdata('ask_c', self.i), trade['CSL'], long_tp, long_sl, 0, long_csl, list(), self.total_covers) # (SIZE, ENTRY, TP, SL, TSL, CSL, COVS, REM_COVS)
@@ -598,7 +380,7 @@ class GridSimulator:
                         short_tp = trade['SL']
                         # short_sl = round(self.d.fdata('mid_c', self.i) + self.sl_pips * pow(10, self.d.ticker['pipLocation']), 5)
                         # short_sl = round(trade['ENT'] + trade['REM_COVS'] * self.grid_pips * pow(10, self.d.ticker['pipLocation']), 5)
-                        short_sl = round(csl + self.sl_pips * pow(10, self.d.ticker['pipLocation']), 5)
+                        short_sl = self.level(csl, self.sl_pips)
                         # short_csl = round(self.d.fdata('mid_c', self.i) + csl_pips * pow(10, self.d.ticker['pipLocation']), 5)
                         # short_csl = round(trade['CSL'] + csl_pips * pow(10, self.d.ticker['pipLocation']), 5)
                         # open_shorts[self.trade_no] = (trade['SIZE'], self.d.fdata('bid_c', self.i), trade['CSL'], short_tp, short_sl, 0, short_csl, list(), self.total_covers) # (SIZE, ENTRY, TP, SL, TSL, CSL, COVS, REM_COVS)
@@ -631,7 +413,7 @@ class GridSimulator:
             for _, trade_no in closed_trade['COVS'].items():
                 if trade_no > 0:
                     # trade = open_longs[trade_no]
-                    long_tp = round(open_longs[trade_no]['TRIG'] + self.grid_pips * pow(10, self.d.ticker['pipLocation']), 5)
+                    long_tp = self.level(open_longs[trade_no]['TRIG'], self.grid_pips)
                     # open_longs[self.trade_no] = (trade['SIZE'], trade['ENT'], trade['TRIG'], long_tp, trade['SL'], trade['TSL'], trade['CSL'], trade['COVS'], trade['REM_COVS']) # (SIZE, ENTRY, TP, SL, TSL, CSL, COVS, REM_COVS)
                     open_longs[trade_no]['TP'] = long_tp
                     open_longs[trade_no]['PAR'] = 0
@@ -642,7 +424,7 @@ class GridSimulator:
             for _, trade_no in closed_trade['COVS'].items():
                 if trade_no > 0:
                     # trade = open_shorts[trade_no]
-                    short_tp = round(open_shorts[trade_no]['TRIG'] - self.grid_pips * pow(10, self.d.ticker['pipLocation']), 5) 
+                    short_tp = self.level(open_shorts[trade_no]['TRIG'], -self.grid_pips) 
                     # open_shorts[self.trade_no] = (trade['SIZE'], trade['ENT'], trade['TRIG'], short_tp, trade['SL'], trade['TSL'], trade['CSL'], trade['COVS'], trade['REM_COVS']) # (SIZE, ENTRY, TP, SL, TSL, CSL, COVS, REM_COVS)
                     open_shorts[trade_no]['TP'] = short_tp
                     open_shorts[trade_no]['PAR'] = 0
@@ -745,27 +527,6 @@ class GridSimulator:
     #             cum_sl_shorts = cum_sl_shorts + trade['PIPS']
     #     return cum_sl_longs, cum_sl_shorts
     
-    def margin_call(self):
-        net_bal, margin_used = self.current_ac_values()
-        # cum_position = self.d.fdata('cum_long_position', self.i) + self.d.fdata('cum_short_position', self.i)
-        traded = False
-        if net_bal < margin_used * self.MC_PERCENT:
-            open_longs = self.get_open_longs()
-            for trade_no, trade in open_longs.items():
-                self.close_long(trade_no)
-                # self.update_uncovered_trades(trade_no, self.EVENT_MC)
-                traded = True
-
-            open_shorts = self.get_open_shorts()
-            for trade_no, trade in open_shorts.items():
-                self.close_short(trade_no)
-                # self.update_uncovered_trades(trade_no, self.EVENT_MC)
-                traded = True
-
-        if traded:
-            self.update_temp_ac_values()
-            self.update_events(self.EVENT_MC)
-
             # # if len(open_longs) > len(open_shorts):
             # if self.d.fdata('long_count', self.i) > self.d.fdata('short_count', self.i)
             #     self.cover_sl_direction = self.SHORT
@@ -784,8 +545,8 @@ class GridSimulator:
         open_longs = self.get_open_longs()
         for trade_no, trade in open_longs.items():
             if self.d.fdata('mid_c', self.i) >= trade['TP']:
-                next_tp = round(trade['TP'] + self.grid_pips * pow(10, self.d.ticker['pipLocation']), 5)
-                tsl = round(trade['ENT'] + (trade['TP'] - trade['ENT']) / 2, 5) if trade['TSL'] == 0 else trade['TP']               
+                next_tp = self.level(trade['TP'], self.grid_pips)
+                tsl = self.midpoint(trade['ENT'], trade['TP']) if trade['TSL'] == 0 else trade['TP']               
                 # open_longs[trade_no] = (trade['SIZE'], trade['ENT'], next_tp, trade['SL'], trade[self.COVERED], tsl)
                 open_longs[trade_no]['TP'] = next_tp
                 open_longs[trade_no]['TSL'] = tsl
@@ -796,8 +557,8 @@ class GridSimulator:
         open_shorts = self.get_open_shorts()
         for trade_no, trade in open_shorts.items():
             if self.d.fdata('mid_c', self.i) <= trade['TP']:
-                next_tp = round(trade['TP'] - self.grid_pips * pow(10, self.d.ticker['pipLocation']), 5)
-                tsl = round(trade['ENT'] - (trade['ENT'] - trade['TP']) / 2, 5) if trade['TSL'] == 0 else trade['TP']
+                next_tp = self.level(trade['TP'], -self.grid_pips)
+                tsl = self.midpoint(trade['ENT'], trade['TP']) if trade['TSL'] == 0 else trade['TP']
                 # open_shorts[trade_no] = (trade['SIZE'], trade['ENT'], next_tp, trade['SL'], trade[self.COVERED], tsl)
                 open_shorts[trade_no]['TP'] = next_tp
                 open_shorts[trade_no]['TSL'] = tsl
@@ -1,17 +1,21 @@
-from data import Data
+from data import Data, LevelIndex, PositionTotals, to_points, round_points
+from grid_engine import GridEngine
 from tqdm import tqdm
 import pandas as pd
+import numpy as np
 from collections import deque
 
-class GridSimulator:
+class GridSimulator(GridEngine):
 
     EVENT_TP, EVENT_SL, EVENT_MC, EVENT_ENTRY, EVENT_TSL_ADJUST, EVENT_ENT_FAIL  = 'TP', 'SL', 'MC', 'ENT', 'TSLADJ', 'EFAIL'
     EVENT_CASH_IN, EVENT_CASH_OUT =  'CI', 'CO'
     EVENT_UP, EVENT_DOWN = 'UP', 'DN'
     OPEN_KEYS = ('SIZE', 'TRIG', 'ENT', 'TP', 'SL', 'TSL')
     CLOSED_KEYS = ('SIZE', 'TRIG', 'ENT', 'EXIT', 'PIPS')
+    LEVEL_KEYS = ('ENT', 'TP', 'SL', 'TSL')
     LONG, SHORT = 1, -1
     MC_PERCENT = 0.50
+    SKIP_ROWS, SKIP_MAX_ROWS = 64, 8192
 
     def __init__(
             self,
@@ -32,7 +36,8 @@ class GridSimulator:
             notrade_count: int,
             sizing: str,
             cash_out_factor: float,
-            trailing_sl: float):
+            trailing_sl: float,
+            skip_bars: bool=True):
         
         self.name = name
         self.init_bal = init_bal
@@ -52,9 +57,10 @@ class GridSimulator:
         self.sizing = sizing
         self.cash_out_factor = cash_out_factor
         self.trailing_sl = trailing_sl
+        self.skip_bars = skip_bars
 
         self.d = Data(
-            source=df.copy(),
+            source=df,
             ticker=ticker,
             cols=['time', 'mid_c', 'bid_c', 'ask_c'],
             instruments=instruments
@@ -89,61 +95,45 @@ class GridSimulator:
 
         self.d.prepare_fast_data(name=name, add_cols=add_cols)
 
-    def get_open_longs(self, i: int=None):
-        i = self.i if i is None else i
-        return self.d.to_dict_of_dicts('open_longs', self.OPEN_KEYS, i)
-    
-    def get_open_shorts(self, i: int=None):
-        i = self.i if i is None else i
-        return self.d.to_dict_of_dicts('open_shorts', self.OPEN_KEYS, i)
-    
-    def get_closed_longs(self, i: int=None):
-        i = self.i if i is None else i
-        return self.d.to_dict_of_dicts('closed_longs', self.CLOSED_KEYS, i)
-    
-    def get_closed_shorts(self, i: int=None):
-        i = self.i if i is None else i
-        return self.d.to_dict_of_dicts('closed_shorts', self.CLOSED_KEYS, i)
-    
-    def update_open_longs(self, open_longs: dict):
-        open_longs_tuple = dict()
-        for trade_no, trade in open_longs.items():
-            open_longs_tuple[trade_no] = tuple(trade.values())
-        self.d.update_fdata('open_longs', self.i, open_longs_tuple)
-
-    def update_open_shorts(self, open_shorts: dict):
-        open_shorts_tuple = dict()
-        for trade_no, trade in open_shorts.items():
-            open_shorts_tuple[trade_no] = tuple(trade.values())
-        self.d.update_fdata('open_shorts', self.i, open_shorts_tuple)
-
-    def update_closed_longs(self, closed_longs: dict):
-        closed_longs_tuple = dict()
-        for trade_no, trade in closed_longs.items():
-            closed_longs_tuple[trade_no] = tuple(trade.values())
-        self.d.update_fdata('closed_longs', self.i, closed_longs_tuple)
-
-    def update_closed_shorts(self, closed_shorts: dict):
-        closed_shorts_tuple = dict()
-        for trade_no, trade in closed_shorts.items():
-            closed_shorts_tuple[trade_no] = tuple(trade.values())
-        self.d.update_fdata('closed_shorts', self.i, closed_shorts_tuple)
+        # Open trades by entry, TP, SL and TSL, kept in step with the open_longs / open_shorts cells
+        self.long_levels = {key: LevelIndex() for key in self.LEVEL_KEYS}
+        self.short_levels = {key: LevelIndex() for key in self.LEVEL_KEYS}
+        # Running size and size x entry of the open trades, realised pnl of the bar, in price points
+        self.scale = self.d.price_scale()
+        self.long_totals, self.short_totals = PositionTotals(self.scale), PositionTotals(self.scale)
+        self.realised_points = 0
+
+    def add_realised(self, size: int, entry: float, exit: float):
+        '''Add size x (exit - entry) of a closed trade to the realised pnl of the bar, size < 0 for shorts
+        '''
+        entry, exit = to_points(entry, self.scale), to_points(exit, self.scale)
+        if self.realised_points is None or entry is None or exit is None:
+            self.realised_points = None
+        else:
+            self.realised_points = self.realised_points + size * (exit - entry)
+
+    def index_levels(self, levels: dict, trade_no: int, trade: dict=None):
+        '''Index the levels of an open trade, or drop a closed one when trade is None
+        '''
+        for key, index in levels.items():
+            if trade is None:
+                index.discard(trade_no)
+            else:
+                index.add(trade_no, trade[key])
     
     def cum_long_position(self):
-        open_longs = self.get_open_longs()
-        cum_long_position = 0
-        for _, trade in open_longs.items():
-            cum_long_position = cum_long_position + trade['SIZE']
-        return cum_long_position
+        return self.long_totals.size
 
     def cum_short_position(self):
-        open_shorts = self.get_open_shorts()
-        cum_short_position = 0
-        for _, trade in open_shorts.items():
-            cum_short_position = cum_short_position + trade['SIZE']
-        return cum_short_position
+        return self.short_totals.size
 
     def unrealised_pnl(self):
+        points = to_points(self.d.fget('mid_c', self.i), self.scale)
+        if points is not None and self.long_totals.exact and self.short_totals.exact:
+            pnl = round_points(self.long_totals.value(points) - self.short_totals.value(points), self.scale)
+            if pnl is not None:
+                return pnl
+        # Ties at half a cent are rounded as the float sum in trade order always did
         open_longs = self.get_open_longs()
         open_shorts = self.get_open_shorts()
         pnl = 0
@@ -154,6 +144,10 @@ class GridSimulator:
         return round(pnl, 2)
     
     def realised_pnl(self):
+        if self.realised_points is not None:
+            pnl = round_points(self.realised_points, self.scale)
+            if pnl is not None:
+                return pnl
         closed_longs = self.get_closed_longs()
         closed_shorts = self.get_closed_shorts()
         pnl = 0
@@ -163,102 +157,24 @@ class GridSimulator:
             pnl = pnl + trade['SIZE'] * (trade['ENT'] - trade['EXIT'])
         return round(pnl, 2)
     
-    def cash_transfer(self):
-        _, net_bal, _ = self.current_ac_values()
-        if self.cash_out_factor is not None:
-            self.d.update_fdata('cash_bal', self.i, self.d.fdata('cash_bal', self.i-1))
-            cash_out_threshold = self.init_bal * self.cash_out_factor
-            events = self.d.fdata('events', self.i) if type(self.d.fdata('events', self.i)) == list else list()
-            stop_loss = self.EVENT_SL in events or self.EVENT_MC in events
-            # Cash out / withdraw
-            if net_bal > cash_out_threshold:
-                cash_out = net_bal - cash_out_threshold
-                self.d.update_fdata('ac_bal', self.i, round(self.d.fdata('ac_bal', self.i-1) - cash_out, 2))
-                self.d.update_fdata('cash_bal', self.i, round(self.d.fdata('cash_bal', self.i) + cash_out, 2))
-                self.update_events(self.EVENT_CASH_OUT)
-                return cash_out
-            # Deposit money into a/c when net_bal < cash_out_threshold
-            elif stop_loss and net_bal < cash_out_threshold:
-                cash_in = min(cash_out_threshold - net_bal, self.d.fdata('cash_bal', self.i))
-                if cash_in > 0:
-                    self.d.update_fdata('ac_bal', self.i, round(self.d.fdata('ac_bal', self.i-1) + cash_in, 2))
-                    self.d.update_fdata('cash_bal', self.i, round(self.d.fdata('cash_bal', self.i) - cash_in, 2))
-                    self.update_events(self.EVENT_CASH_IN)    
-                    return cash_in  
-
-    def current_ac_values(self):
-        ac_bal = self.d.fdata('ac_bal', self.i-1) + self.d.fdata('realised_pnl', self.i)
-        margin_used = (self.d.fdata('cum_long_position', self.i) + 
-                       self.d.fdata('cum_short_position', self.i)) * float(self.d.ticker['marginRate'])
-        net_bal = ac_bal + self.d.fdata('unrealised_pnl', self.i)
-        return ac_bal, net_bal, margin_used      
-
-    def update_temp_ac_values(self, init: bool=False):
-        if init:
-            self.d.update_fdata('open_longs', self.i, self.d.fdata('open_longs', self.i-1))
-            self.d.update_fdata('open_shorts', self.i, self.d.fdata('open_shorts', self.i-1))
-            self.d.update_fdata('cum_long_position', self.i, self.d.fdata('cum_long_position', self.i-1))
-            self.d.update_fdata('cum_short_position', self.i, self.d.fdata('cum_short_position', self.i-1))
-            self.d.update_fdata('open_long_count', self.i, len(self.get_open_longs(self.i-1)))
-            self.d.update_fdata('open_short_count', self.i, len(self.get_open_shorts(self.i-1)))
-            self.d.update_fdata('closed_long_count', self.i, len(self.get_closed_longs(self.i-1)))
-            self.d.update_fdata('closed_short_count', self.i, len(self.get_closed_shorts(self.i-1)))
-            self.d.update_fdata('moves_hist', self.i, self.d.fdata('moves_hist', self.i-1))
-            self.d.update_fdata('up_moves_ratio', self.i, self.d.fdata('up_moves_ratio', self.i-1))
-            self.d.update_fdata('down_moves_ratio', self.i, self.d.fdata('down_moves_ratio', self.i-1))
-            self.d.update_fdata('grid_trades_long', self.i, self.d.fdata('grid_trades_long', self.i-1))
-            self.d.update_fdata('grid_trades_short', self.i, self.d.fdata('grid_trades_short', self.i-1))
-        else:
-            self.d.update_fdata('cum_long_position', self.i, self.cum_long_position())
-            self.d.update_fdata('cum_short_position', self.i, self.cum_short_position())
-            self.d.update_fdata('open_long_count', self.i, len(self.get_open_longs()))
-            self.d.update_fdata('open_short_count', self.i, len(self.get_open_shorts()))
-            self.d.update_fdata('closed_long_count', self.i, len(self.get_closed_longs()))
-            self.d.update_fdata('closed_short_count', self.i, len(self.get_closed_shorts()))
-            moves = self.d.fdata('moves_hist', self.i)
-            up_moves, down_moves = moves.count(self.EVENT_UP), moves.count(self.EVENT_DOWN)
-            self.d.update_fdata(f'up_moves_ratio', self.i, round(up_moves / len(moves), 2))
-            self.d.update_fdata(f'down_moves_ratio', self.i, round(down_moves / len(moves), 2))
-        
-        self.d.update_fdata('unrealised_pnl', self.i, self.unrealised_pnl())
-        self.d.update_fdata('realised_pnl', self.i, self.realised_pnl())
-
-    def update_ac_values(self):
-        self.d.update_fdata('cum_long_position', self.i, self.cum_long_position())
-        self.d.update_fdata('cum_short_position', self.i, self.cum_short_position())
-        self.d.update_fdata('open_long_count', self.i, len(self.get_open_longs()))
-        self.d.update_fdata('open_short_count', self.i, len(self.get_open_shorts()))
-        self.d.update_fdata('closed_long_count', self.i, len(self.get_closed_longs()))
-        self.d.update_fdata('closed_short_count', self.i, len(self.get_closed_shorts()))
-
-        self.d.update_fdata('unrealised_pnl', self.i, self.unrealised_pnl())
-        self.d.update_fdata('realised_pnl', self.i, self.realised_pnl())
-        
-        # First candle
-        if self.i == 0:               
-            self.d.update_fdata('ac_bal', self.i, self.init_bal)
-        # Subsequent candles
-        else:
-            events = self.d.fdata('events', self.i) if type(self.d.fdata('events', self.i)) == list else list()
-            cash_transfer = self.EVENT_CASH_IN in events or self.EVENT_CASH_OUT in events
-            ac_bal = self.d.fdata('ac_bal', self.i) if cash_transfer else self.d.fdata('ac_bal', self.i-1)
-            self.d.update_fdata('ac_bal', self.i, round(ac_bal + self.d.fdata('realised_pnl', self.i), 2))
-
-        self.d.update_fdata('net_bal', self.i, round(self.d.fdata('ac_bal', self.i) + self.d.fdata('unrealised_pnl', self.i), 2))
-        self.d.update_fdata('margin_used', self.i, \
-                            round((self.d.fdata('cum_long_position', self.i) + 
-                                   self.d.fdata('cum_short_position', self.i)) * float(self.d.ticker['marginRate']), 2))
-        
-        if self.cash_out_factor is not None:
-            self.d.update_fdata('gross_bal', self.i, round(self.d.fdata('ac_bal', self.i) + self.d.fdata('cash_bal', self.i), 2))
-        else:
-            self.d.update_fdata('gross_bal', self.i, self.d.fdata('ac_bal', self.i))
-           
+    def carry_strategy_values(self):
+        self.d.update_fdata('moves_hist', self.i, self.d.fdata('moves_hist', self.i-1))
+        self.d.update_fdata('up_moves_ratio', self.i, self.d.fdata('up_moves_ratio', self.i-1))
+        self.d.update_fdata('down_moves_ratio', self.i, self.d.fdata('down_moves_ratio', self.i-1))
+        self.d.update_fdata('grid_trades_long', self.i, self.d.fdata('grid_trades_long', self.i-1))
+        self.d.update_fdata('grid_trades_short', self.i, self.d.fdata('grid_trades_short', self.i-1))
+
+    def update_strategy_values(self):
+        moves = self.d.fdata('moves_hist', self.i)
+        up_moves, down_moves = moves.count(self.EVENT_UP), moves.count(self.EVENT_DOWN)
+        self.d.update_fdata(f'up_moves_ratio', self.i, round(up_moves / len(moves), 2))
+        self.d.update_fdata(f'down_moves_ratio', self.i, round(down_moves / len(moves), 2))
+
     def calc_trade_size(self):
         if self.i == 0:
             trade_size = self.init_trade_size
         else:
-            _, net_bal, margin_used = self.current_ac_values()
+            net_bal, margin_used = self.current_ac_values()
             trade_size = int(net_bal * self.sizing_ratio) if self.sizing == 'dynamic' else self.init_trade_size
             if self.notrade_margin_percent is not None and self.notrade_count is not None:
                 allowed_trade_size = max(0, (net_bal / self.notrade_margin_percent - margin_used) / (2 * float(self.d.ticker['marginRate'])))
@@ -283,12 +199,6 @@ class GridSimulator:
             short_trade_size = int(trade_size * 2 * self.d.fdata('down_moves_ratio', self.i))
         return long_trade_size, short_trade_size
     
-    def update_events(self, event):
-        events = self.d.fdata('events', self.i) if type(self.d.fdata('events', self.i)) == list else list()
-        if event not in events:
-            events.append(event)
-            self.d.update_fdata('events', self.i, events)
-
     def update_moves_hist(self):
         if self.up_grid or self.down_grid:
             move = self.EVENT_UP if self.up_grid else self.EVENT_DOWN
@@ -303,6 +213,8 @@ class GridSimulator:
         closing_long = open_longs[trade_no]
         del open_longs[trade_no]
         self.update_open_longs(open_longs)
+        self.index_levels(self.long_levels, trade_no)
+        self.long_totals.remove(closing_long['SIZE'], closing_long['ENT'])
 
         # Append to closed longs
         pips = round((self.d.fdata('bid_c',  self.i) - closing_long['ENT']) * pow(10, -self.d.ticker['pipLocation']), 1)
@@ -316,6 +228,7 @@ class GridSimulator:
             PIPS=pips
         )
         self.update_closed_longs(closed_longs)
+        self.add_realised(closing_long['SIZE'], closing_long['ENT'], closed_longs[trade_no]['EXIT'])
         # self.update_hist(pips, self.LONG)
 
         if self.max_trades_per_grid is not None:
@@ -334,6 +247,8 @@ class GridSimulator:
         closing_short = open_shorts[trade_no]
         del open_shorts[trade_no]
         self.update_open_shorts(open_shorts)
+        self.index_levels(self.short_levels, trade_no)
+        self.short_totals.remove(closing_short['SIZE'], closing_short['ENT'])
 
         # Append to closed shorts
         pips = round((closing_short['ENT'] - self.d.fdata('ask_c',  self.i)) * pow(10, -self.d.ticker['pipLocation']), 1)
@@ -346,6 +261,7 @@ class GridSimulator:
             PIPS=pips
         )
         self.update_closed_shorts(closed_shorts)
+        self.add_realised(-closing_short['SIZE'], closing_short['ENT'], closed_shorts[trade_no]['EXIT'])
         # self.update_hist(pips, self.SHORT)
 
         if self.max_trades_per_grid is not None:
@@ -363,8 +279,8 @@ class GridSimulator:
         traded = False
         if self.up_grid or self.down_grid:
             # self.trigger = self.next_up_grid if self.up_grid else self.next_down_grid
-            long_tp = round(self.trigger + self.tp_pips * pow(10, self.d.ticker['pipLocation']), 5)
-            short_tp = round(self.trigger - self.tp_pips * pow(10, self.d.ticker['pipLocation']), 5)  
+            long_tp = self.level(self.trigger, self.tp_pips)
+            short_tp = self.level(self.trigger, -self.tp_pips)  
 
             long_trade_size, short_trade_size = self.calc_trade_size()
             open_longs = self.get_open_longs()
@@ -381,8 +297,8 @@ class GridSimulator:
             else:
                 self.trade_no = self.trade_no + 1
 
-                long_sl = round(self.trigger - self.sl_pips * pow(10, self.d.ticker['pipLocation']), 5)
-                short_sl = round(self.trigger + self.sl_pips * pow(10, self.d.ticker['pipLocation']), 5)
+                long_sl = self.level(self.trigger, -self.sl_pips)
+                short_sl = self.level(self.trigger, self.sl_pips)
 
                 if long_trade_size > 0:
                     if self.max_trades_per_grid is not None:
@@ -407,6 +323,8 @@ class GridSimulator:
                             TSL=0
                         )
                         self.update_open_longs(open_longs)
+                        self.index_levels(self.long_levels, self.trade_no, open_longs[self.trade_no])
+                        self.long_totals.add(long_trade_size, open_longs[self.trade_no]['ENT'])
                         if self.max_trades_per_grid is not None:
                             self.d.update_fdata('grid_trades_long', self.i, grid_trades_long)
                         traded = True
@@ -436,6 +354,8 @@ class GridSimulator:
                             TSL=0
                         )
                         self.update_open_shorts(open_shorts)
+                        self.index_levels(self.short_levels, self.trade_no, open_shorts[self.trade_no])
+                        self.short_totals.add(short_trade_size, open_shorts[self.trade_no]['ENT'])
                         if self.max_trades_per_grid is not None:
                             self.d.update_fdata('grid_trades_short', self.i, grid_trades_short)
                         traded = True
@@ -451,19 +371,16 @@ class GridSimulator:
     
     def take_profit(self):     
         traded = False
+        price = self.d.fdata('mid_c', self.i)
         # Close long positions take profit
-        open_longs = self.get_open_longs()
-        for trade_no, trade in open_longs.items():
-            if self.d.fdata('mid_c', self.i) >= trade['TP']:
-                self.close_long(trade_no)
-                traded = True
+        for trade_no in self.long_levels['TP'].at_or_below(price):
+            self.close_long(trade_no)
+            traded = True
 
         # Close short positions take profit
-        open_shorts = self.get_open_shorts()
-        for trade_no, trade in open_shorts.items():
-            if self.d.fdata('mid_c', self.i) <= trade['TP']:
-                self.close_short(trade_no)
-                traded = True
+        for trade_no in self.short_levels['TP'].at_or_above(price):
+            self.close_short(trade_no)
+            traded = True
 
         if traded:
             self.update_temp_ac_values()
@@ -471,39 +388,38 @@ class GridSimulator:
 
     def stop_loss_grid_count(self):
         traded = False
+        price = self.d.fdata('mid_c', self.i)
         # Close long positions stop loss
-        open_longs = self.get_open_longs()
-        for trade_no, trade in open_longs.items():
-            if self.d.fdata('mid_c', self.i) <= trade['SL']:
-                self.close_long(trade_no)
-                traded = True
+        for trade_no in self.long_levels['SL'].at_or_above(price):
+            self.close_long(trade_no)
+            traded = True
 
         # Close short positions stop loss
-        open_shorts = self.get_open_shorts()
-        for trade_no, trade in open_shorts.items():
-            if self.d.fdata('mid_c', self.i) >= trade['SL']:
-                self.close_short(trade_no)
-                traded = True
+        for trade_no in self.short_levels['SL'].at_or_below(price):
+            self.close_short(trade_no)
+            traded = True
 
         return traded
     
+    def farthest_trades(self, price: float):
+        '''Long with the highest entry above price and short with the lowest entry below price
+        First in trade order on ties, None when no trade is beyond price
+        '''
+        farthest_long, farthest_long_price, farthest_short, farthest_short_price = None, price, None, price
+        top = self.long_levels['ENT'].top()
+        if top is not None and top[0] > price:
+            farthest_long_price, farthest_long = top
+        bottom = self.short_levels['ENT'].bottom()
+        if bottom is not None and bottom[0] < price:
+            farthest_short_price, farthest_short = bottom
+        return farthest_long, farthest_long_price, farthest_short, farthest_short_price
+
     def stop_loss_max_unrealised_pnl(self):
         traded = False
         price = self.d.fdata('mid_c', self.i)
-        ac_bal, _, _ = self.current_ac_values()
+        ac_bal = self.current_ac_bal()
         while ac_bal * self.max_unrealised_pnl < -self.d.fdata('unrealised_pnl', self.i):
-            farthest_long_price, farthest_short_price = price, price
-            farthest_long, farthest_short = None, None
-            open_longs = self.get_open_longs(self.i)
-            for long, trade in open_longs.items():
-                if trade['ENT'] > farthest_long_price:
-                    farthest_long_price = trade['ENT']
-                    farthest_long = long
-            open_shorts = self.get_open_shorts(self.i)
-            for short, trade in open_shorts.items():
-                if trade['ENT'] < farthest_short_price:
-                    farthest_short_price = trade['ENT']
-                    farthest_short = short
+            farthest_long, farthest_long_price, farthest_short, farthest_short_price = self.farthest_trades(price)
             if farthest_long == None and farthest_short == None:
                 pass
             else:
@@ -517,7 +433,7 @@ class GridSimulator:
                     else:
                         self.close_short(farthest_short)
                 self.update_temp_ac_values()
-                ac_bal, _, _ = self.current_ac_values()
+                ac_bal = self.current_ac_bal()
                 traded = True
 
         return traded
@@ -527,13 +443,7 @@ class GridSimulator:
         price = self.d.fdata('mid_c', self.i)
 
         while self.d.fdata('open_long_count', self.i) >= self.max_trades_per_side:
-            farthest_long_price = price
-            farthest_long = None
-            open_longs = self.get_open_longs(self.i)
-            for long, trade in open_longs.items():
-                if trade['ENT'] > farthest_long_price:
-                    farthest_long_price = trade['ENT']
-                    farthest_long = long
+            farthest_long, _, _, _ = self.farthest_trades(price)
 
             if farthest_long is None:
                 break
@@ -543,13 +453,7 @@ class GridSimulator:
                 traded = True
 
         while self.d.fdata('open_short_count', self.i) >= self.max_trades_per_side:
-            farthest_short_price = price
-            farthest_short = None
-            open_shorts = self.get_open_shorts(self.i)
-            for short, trade in open_shorts.items():
-                if trade['ENT'] < farthest_short_price:
-                    farthest_short_price = trade['ENT']
-                    farthest_short = short
+            _, _, farthest_short, _ = self.farthest_trades(price)
 
             if farthest_short is None:
                 break
@@ -573,50 +477,33 @@ class GridSimulator:
             self.update_temp_ac_values()
             self.update_events(self.EVENT_SL)
     
-    def margin_call(self):
-        _, net_bal, margin_used = self.current_ac_values()
-        traded = False
-        if net_bal < margin_used * self.MC_PERCENT:
-            open_longs = self.get_open_longs()
-            for trade_no, trade in open_longs.items():
-                self.close_long(trade_no)
-                traded = True
-
-            open_shorts = self.get_open_shorts()
-            for trade_no, trade in open_shorts.items():
-                self.close_short(trade_no)
-                traded = True
-
-        if traded:
-            self.update_temp_ac_values()
-            self.update_events(self.EVENT_MC)
-
     def update_trailing_sl(self):
         adjusted = False
+        price = self.d.fdata('mid_c', self.i)
         # Update long positions, update next_tp, TSL
         open_longs = self.get_open_longs()
-        for trade_no, trade in open_longs.items():
-            if self.d.fdata('mid_c', self.i) >= trade['TP']:
-                # next_tp = round(trade['TP'] + self.grid_pips * pow(10, self.d.ticker['pipLocation']), 5)
-                next_tp = self.next_up_grid
-                # tsl = round(trade['ENT'] + (trade['TP'] - trade['ENT']) / 2, 5) if trade['TSL'] == 0 else trade['TP']  
-                tsl = round(next_tp - self.grid_pips * 2 * pow(10, self.d.ticker['pipLocation']), 5)             
-                open_longs[trade_no]['TP'] = next_tp
-                open_longs[trade_no]['TSL'] = tsl
-                adjusted = True
+        for trade_no in self.long_levels['TP'].at_or_below(price):
+            # next_tp = round(trade['TP'] + self.grid_pips * pow(10, self.d.ticker['pipLocation']), 5)
+            next_tp = self.next_up_grid
+            # tsl = round(trade['ENT'] + (trade['TP'] - trade['ENT']) / 2, 5) if trade['TSL'] == 0 else trade['TP']  
+            tsl = self.level(next_tp, -self.grid_pips * 2)             
+            open_longs[trade_no]['TP'] = next_tp
+            open_longs[trade_no]['TSL'] = tsl
+            self.index_levels(self.long_levels, trade_no, open_longs[trade_no])
+            adjusted = True
         self.update_open_longs(open_longs)
 
         # Update short positions, update TSL
         open_shorts = self.get_open_shorts()
-        for trade_no, trade in open_shorts.items():
-            if self.d.fdata('mid_c', self.i) <= trade['TP']:
-                # next_tp = round(trade['TP'] - self.grid_pips * pow(10, self.d.ticker['pipLocation']), 5)
-                next_tp = self.next_down_grid
-                # tsl = round(trade['ENT'] - (trade['ENT'] - trade['TP']) / 2, 5) if trade['TSL'] == 0 else trade['TP']
-                tsl = round(next_tp + self.grid_pips * 2 * pow(10, self.d.ticker['pipLocation']), 5)    
-                open_shorts[trade_no]['TP'] = next_tp
-                open_shorts[trade_no]['TSL'] = tsl
-                adjusted = True
+        for trade_no in self.short_levels['TP'].at_or_above(price):
+            # next_tp = round(trade['TP'] - self.grid_pips * pow(10, self.d.ticker['pipLocation']), 5)
+            next_tp = self.next_down_grid
+            # tsl = round(trade['ENT'] - (trade['ENT'] - trade['TP']) / 2, 5) if trade['TSL'] == 0 else trade['TP']
+            tsl = self.level(next_tp, self.grid_pips * 2)    
+            open_shorts[trade_no]['TP'] = next_tp
+            open_shorts[trade_no]['TSL'] = tsl
+            self.index_levels(self.short_levels, trade_no, open_shorts[trade_no])
+            adjusted = True
         self.update_open_shorts(open_shorts)
 
         if adjusted:
@@ -624,19 +511,16 @@ class GridSimulator:
 
     def take_profit_tsl(self):
         traded = False
-        # Close long positions take profit
-        open_longs = self.get_open_longs()
-        for trade_no, trade in open_longs.items():
-            if self.d.fdata('mid_c', self.i) <= trade['TSL'] and trade['TSL'] != 0:
-                self.close_long(trade_no)
-                traded = True
+        price = self.d.fdata('mid_c', self.i)
+        # Close long positions take profit, an unset TSL of 0 is not in the index
+        for trade_no in self.long_levels['TSL'].at_or_above(price):
+            self.close_long(trade_no)
+            traded = True
 
         # Close short positions take profit
-        open_shorts = self.get_open_shorts()
-        for trade_no, trade in open_shorts.items():
-            if self.d.fdata('mid_c', self.i) >= trade['TSL'] and trade['TSL'] != 0:
-                self.close_short(trade_no)
-                traded = True
+        for trade_no in self.short_levels['TSL'].at_or_below(price):
+            self.close_short(trade_no)
+            traded = True
 
         if traded:
             self.update_temp_ac_values()
@@ -664,20 +548,95 @@ class GridSimulator:
             up_grids = int(up_pips / self.grid_pips) if self.i > 1 else 0
             down_grids = int(down_pips / self.grid_pips) if self.i > 1 else 0
             if self.up_grid:
-                self.trigger = round(self.next_up_grid + up_grids * self.grid_pips * pow(10, self.d.ticker['pipLocation']), 5)
+                self.trigger = self.level(self.next_up_grid, up_grids * self.grid_pips)
             else:
-                self.trigger = round(self.next_down_grid - down_grids * self.grid_pips * pow(10, self.d.ticker['pipLocation']), 5)
+                self.trigger = self.level(self.next_down_grid, -down_grids * self.grid_pips)
             # self.trigger = self.next_up_grid if self.up_grid else self.next_down_grid
-            self.next_up_grid = round(self.trigger + self.grid_pips * pow(10, self.d.ticker['pipLocation']), 5)
-            self.next_down_grid = round(self.trigger - self.grid_pips * pow(10, self.d.ticker['pipLocation']), 5)
+            self.next_up_grid = self.level(self.trigger, self.grid_pips)
+            self.next_down_grid = self.level(self.trigger, -self.grid_pips)
 
             self.d.update_fdata('trigger', self.i, self.trigger)
         
         self.update_moves_hist()
-    
+
+    def unrealised_pnls(self, prices: np.ndarray, open_longs: dict, open_shorts: dict) -> np.ndarray:
+        '''unrealised_pnl() of the open trade cells at each of prices, same order of additions and rounding
+        '''
+        size, ent = self.OPEN_KEYS.index('SIZE'), self.OPEN_KEYS.index('ENT')
+        longs = np.array([(trade[size], trade[ent]) for trade in open_longs.values()], dtype=np.float64).reshape(-1, 2)
+        shorts = np.array([(trade[size], trade[ent]) for trade in open_shorts.values()], dtype=np.float64).reshape(-1, 2)
+        pnl = np.concatenate((longs[:, 0] * (prices[:, None] - longs[:, 1]),
+                              shorts[:, 0] * (shorts[:, 1] - prices[:, None])), axis=1)
+        return np.round(pnl.cumsum(axis=1)[:, -1], 2) if pnl.shape[1] > 0 else np.zeros(len(prices))
+
+    def skip(self, start: int) -> int:
+        '''Fill bars from start in bulk up to the first one that can trigger anything, returns that bar
+        Trades only change on a new grid, so a bar triggers nothing while mid_c stays strictly between the next grids
+        and neither margin call nor cash out fires. Such a bar carries the previous bar over, with no closed trades,
+        and moves unrealised_pnl and net_bal with the price.
+        '''
+        mid = self.d.fview('mid_c')
+        if start >= self.d.fdatalen or mid[start] >= self.next_up_grid or mid[start] <= self.next_down_grid:
+            return start
+
+        cells = {col: self.d.fget(col, start-1) for col in ('open_longs', 'open_shorts', 'moves_hist', 'up_moves_ratio',
+                                                               'down_moves_ratio', 'grid_trades_long', 'grid_trades_short')}
+        open_longs = cells['open_longs'] if type(cells['open_longs']) == dict else dict()
+        open_shorts = cells['open_shorts'] if type(cells['open_shorts']) == dict else dict()
+        cum_long_position = self.d.fget('cum_long_position', start-1)
+        cum_short_position = self.d.fget('cum_short_position', start-1)
+        margin_used = (cum_long_position + cum_short_position) * float(self.d.ticker['marginRate'])
+        i, rows = start, self.SKIP_ROWS
+        while i < self.d.fdatalen:
+            prices = mid[i:i + rows]
+            crossed = (prices >= self.next_up_grid) | (prices <= self.next_down_grid)
+            n = int(crossed.argmax()) if crossed.any() else len(prices)
+            # ac_bal of the previous bar plus a realised_pnl of 0, as in current_ac_values()
+            prev_ac_bal = np.full(n, round(self.d.fget('ac_bal', i-1) + 0.0, 2))
+            prev_ac_bal[:1] = self.d.fget('ac_bal', i-1)
+            unrealised_pnl = self.unrealised_pnls(prices[:n], open_longs, open_shorts)
+            net_bal = prev_ac_bal + 0.0 + unrealised_pnl
+            triggers = net_bal < margin_used * self.MC_PERCENT
+            if self.cash_out_factor is not None:
+                triggers |= net_bal > self.init_bal * self.cash_out_factor
+            if triggers.any():
+                n = int(triggers.argmax())
+            if n == 0:
+                break
+
+            ac_bal = np.round(prev_ac_bal[:n] + 0.0, 2)
+            for col, cell in cells.items():
+                self.d.fill_fdata(col, i, i+n, cell)
+            self.d.fill_fdata('cum_long_position', i, i+n, cum_long_position)
+            self.d.fill_fdata('cum_short_position', i, i+n, cum_short_position)
+            self.d.fill_fdata('open_long_count', i, i+n, len(open_longs))
+            self.d.fill_fdata('open_short_count', i, i+n, len(open_shorts))
+            self.d.fill_fdata('closed_long_count', i, i+n, 0)
+            self.d.fill_fdata('closed_short_count', i, i+n, 0)
+            self.d.fill_fdata('unrealised_pnl', i, i+n, unrealised_pnl[:n])
+            self.d.fill_fdata('realised_pnl', i, i+n, 0)
+            self.d.fill_fdata('ac_bal', i, i+n, ac_bal)
+            self.d.fill_fdata('net_bal', i, i+n, np.round(ac_bal + unrealised_pnl[:n], 2))
+            self.d.fill_fdata('margin_used', i, i+n, round(margin_used, 2))
+            if self.cash_out_factor is not None:
+                self.d.fill_fdata('cash_bal', i, i+n, self.d.fget('cash_bal', i-1))
+                self.d.fill_fdata('gross_bal', i, i+n, np.round(ac_bal + self.d.fget('cash_bal', i-1), 2))
+            else:
+                self.d.fill_fdata('gross_bal', i, i+n, ac_bal)
+            i = i + n
+            if n < len(prices):
+                break
+            rows = min(rows * 2, self.SKIP_MAX_ROWS)
+        return i
+
     def run_sim(self):
-        for i in tqdm(range(self.d.fdatalen), desc=" Simulating... "):
+        '''With skip_bars, the bars after each simulated bar that cannot trigger anything are filled in bulk by skip()
+        '''
+        progress = tqdm(total=self.d.fdatalen, desc=" Simulating... ")
+        i = 0
+        while i < self.d.fdatalen:
             self.i = i
+            self.realised_points = 0
             if self.i == 0:
                 self.update_init_values()
             else:
@@ -694,4 +653,8 @@ class GridSimulator:
                         self.take_profit()
                     self.entry()
                 self.cash_transfer()
-            self.update_ac_values()
\ No newline at end of file
+            self.update_ac_values()
+            next_i = self.skip(i + 1) if self.skip_bars else i + 1
+            progress.update(next_i - i)
+            i = next_i
+        progress.close()